@@ -0,0 +1,322 @@
+"""Admission control for scrib generation: a global cap on generations in flight and per-user quotas.
+
+Each generation costs OpenAI rate limit and holds a job worker for tens of seconds, so they're
+gated twice:
+
+- when a generation is requested (create_scrib, the batch api), admit() reserves one of
+  ADMISSION_MAX_PENDING places for it and takes a token from the user's bucket
+  (ADMISSION_USER_BURST tokens, refilled one per ADMISSION_USER_REFILL_SECONDS). A place is
+  held from then until the job finishes, waiting for a job worker included, so it refuses
+  right away once that many generations are already in line. The route answers 429 (quota)
+  or 503 (busy) with a Retry-After, and the job gives its place back with finish().
+- around the OpenAI calls, slot() holds one of ADMISSION_MAX_IN_FLIGHT slots. Without a free
+  slot the job waits its turn in a queue of at most ADMISSION_MAX_QUEUED, for up to
+  ADMISSION_QUEUE_TIMEOUT seconds, and fails with GenerationRejected past either bound.
+
+The places, the slots, the wait queue and the buckets live in a small SQLite database: private to the
+process with ADMISSION_BACKEND="memory", or in the file at ADMISSION_PATH with "sqlite" so every
+gunicorn worker on the host shares them. Slots are leases, a process that dies holding one
+only holds it until the lease runs out, places likewise after ADMISSION_PENDING_LEASE. The admitted/queued/rejected counters are per process
+like every other metric.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from instrumentation import phase
+from metrics import counter, histogram
+
+ADMITTED = "admitted"
+QUEUED = "queued"
+REJECTED = "rejected"
+
+admissions_total = counter(
+    "scribcraft_generation_admissions_total", "Generation admission decisions", ["outcome", "reason"])
+admission_wait_seconds = histogram(
+    "scribcraft_generation_admission_wait_seconds", "Time generations waited for a slot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS admission_slots (
+    ticket TEXT PRIMARY KEY,
+    running INTEGER NOT NULL,
+    queued_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admission_pending (
+    ticket TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admission_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_admission_buckets_updated_at ON admission_buckets (updated_at);
+"""
+
+
+class GenerationRejected(Exception):
+    """Raised when a generation isn't admitted. reason is "quota", "busy" or "timeout"."""
+
+    MESSAGES = {
+        "quota": "You're generating scribs too quickly. Please try again later.",
+        "busy": "We're generating too many scribs right now. Please try again in a moment.",
+        "timeout": "We're generating too many scribs right now. Please try again in a moment.",
+    }
+
+    def __init__(self, reason, retry_after):
+        super().__init__(self.MESSAGES[reason])
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SQLiteAdmissionBackend:
+    """Slots and buckets in a SQLite database, path ":memory:" keeps them private to the process.
+    Every operation is one IMMEDIATE transaction, which SQLite serializes across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        # a connection inherited through gunicorn's fork must not be used by the child
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            if self.path != ":memory:":
+                # the state is rebuilt by the traffic in seconds, no need to survive a power cut
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=OFF")
+            connection.executescript(SCHEMA)
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def occupancy(self, now):
+        """(running, waiting) slots"""
+
+        with self.transaction() as connection:
+            return connection.execute(
+                "SELECT COALESCE(SUM(running), 0), COALESCE(SUM(1 - running), 0) FROM admission_slots"
+                " WHERE expires_at >= ?", (now,)).fetchone()
+
+    def try_acquire(self, ticket, now, max_in_flight, max_queued, lease, wait_lease):
+        """ADMITTED (ticket holds a slot), QUEUED (ticket waits in line) or REJECTED (queue full).
+        Waiting tickets call again until they are admitted, slots go to them in arrival order.
+        """
+
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM admission_slots WHERE expires_at < ?", (now,))
+            running, waiting = connection.execute(
+                "SELECT COALESCE(SUM(running), 0), COALESCE(SUM(1 - running), 0) FROM admission_slots").fetchone()
+            row = connection.execute(
+                "SELECT queued_at FROM admission_slots WHERE ticket = ?", (ticket,)).fetchone()
+
+            if row is None:
+                if running < max_in_flight and waiting == 0:
+                    connection.execute("INSERT INTO admission_slots VALUES (?, 1, ?, ?)", (ticket, now, now + lease))
+                    return ADMITTED
+                if waiting < max_queued:
+                    connection.execute("INSERT INTO admission_slots VALUES (?, 0, ?, ?)",
+                                       (ticket, now, now + wait_lease))
+                    return QUEUED
+                return REJECTED
+
+            (queued_at,) = row
+            ahead = connection.execute(
+                "SELECT COUNT(*) FROM admission_slots WHERE running = 0 AND (queued_at < ? OR"
+                " (queued_at = ? AND ticket < ?))", (queued_at, queued_at, ticket)).fetchone()[0]
+            if running + ahead < max_in_flight:
+                connection.execute("UPDATE admission_slots SET running = 1, expires_at = ? WHERE ticket = ?",
+                                   (now + lease, ticket))
+                return ADMITTED
+            # still in line, keep the place from expiring
+            connection.execute("UPDATE admission_slots SET expires_at = ? WHERE ticket = ?",
+                               (now + wait_lease, ticket))
+            return QUEUED
+
+    def release(self, ticket):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM admission_slots WHERE ticket = ?", (ticket,))
+
+    def reserve(self, tickets, now, max_pending, lease):
+        """Records as many of tickets as fit under max_pending places, returns those that did"""
+
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM admission_pending WHERE expires_at < ?", (now,))
+            (pending,) = connection.execute("SELECT COUNT(*) FROM admission_pending").fetchone()
+            reserved = tickets[:max(0, max_pending - pending)]
+            connection.executemany("INSERT INTO admission_pending VALUES (?, ?)",
+                                   [(ticket, now + lease) for ticket in reserved])
+            return reserved
+
+    def unreserve(self, tickets):
+        with self.transaction() as connection:
+            connection.executemany("DELETE FROM admission_pending WHERE ticket = ?", [(ticket,) for ticket in tickets])
+
+    def pending(self, now):
+        with self.transaction() as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM admission_pending WHERE expires_at >= ?", (now,)).fetchone()[0]
+
+    def take_tokens(self, key, count, now, burst, refill_seconds):
+        """Takes up to count tokens from key's bucket. Returns (tokens taken, seconds until the next one)"""
+
+        with self.transaction() as connection:
+            # a bucket untouched for this long is full again, which is what a missing row means
+            connection.execute("DELETE FROM admission_buckets WHERE updated_at < ?", (now - burst * refill_seconds,))
+            row = connection.execute(
+                "SELECT tokens, updated_at FROM admission_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) / refill_seconds)
+
+            taken = min(count, int(tokens))
+            tokens -= taken
+            connection.execute("INSERT OR REPLACE INTO admission_buckets VALUES (?, ?, ?)", (key, tokens, now))
+            return taken, (1 - tokens) * refill_seconds
+
+
+class AdmissionControl:
+    """Small extension configured from app.config['ADMISSION_*']"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # "memory" (this process only) or "sqlite" (every process using ADMISSION_PATH)
+        app.config.setdefault("ADMISSION_BACKEND", "memory")
+        app.config.setdefault("ADMISSION_PATH", os.path.join(tempfile.gettempdir(), "scribcraft-admission.sqlite3"))
+        app.config.setdefault("ADMISSION_MAX_IN_FLIGHT", 8)
+        app.config.setdefault("ADMISSION_MAX_QUEUED", 16)
+        # generations admitted and not finished yet, the ones waiting for a job worker included
+        app.config.setdefault("ADMISSION_MAX_PENDING",
+                              app.config["ADMISSION_MAX_IN_FLIGHT"] + app.config["ADMISSION_MAX_QUEUED"])
+        app.config.setdefault("ADMISSION_QUEUE_TIMEOUT", 60)
+        app.config.setdefault("ADMISSION_USER_BURST", 5)
+        app.config.setdefault("ADMISSION_USER_REFILL_SECONDS", 60)
+        # seconds a client shed because we're busy is told to wait
+        app.config.setdefault("ADMISSION_RETRY_AFTER", 10)
+        # a slot outlives any generation, OpenAI calls give up after OPENAI_TOTAL_DEADLINE
+        app.config.setdefault("ADMISSION_SLOT_LEASE", 300)
+        # a place outlives the wait for a job worker plus the generation
+        app.config.setdefault("ADMISSION_PENDING_LEASE", 900)
+        app.config.setdefault("ADMISSION_POLL_INTERVAL", 0.1)
+
+        backend_name = app.config["ADMISSION_BACKEND"]
+        if backend_name == "memory":
+            self.backend = SQLiteAdmissionBackend(":memory:")
+        elif backend_name == "sqlite":
+            self.backend = SQLiteAdmissionBackend(app.config["ADMISSION_PATH"])
+        else:
+            raise ValueError(f"Unknown admission backend: {backend_name}")
+
+        self.max_in_flight = app.config["ADMISSION_MAX_IN_FLIGHT"]
+        self.max_queued = app.config["ADMISSION_MAX_QUEUED"]
+        self.max_pending = app.config["ADMISSION_MAX_PENDING"]
+        self.pending_lease = app.config["ADMISSION_PENDING_LEASE"]
+        self.queue_timeout = app.config["ADMISSION_QUEUE_TIMEOUT"]
+        self.burst = app.config["ADMISSION_USER_BURST"]
+        self.refill_seconds = app.config["ADMISSION_USER_REFILL_SECONDS"]
+        self.retry_after = app.config["ADMISSION_RETRY_AFTER"]
+        self.lease = app.config["ADMISSION_SLOT_LEASE"]
+        self.poll_interval = app.config["ADMISSION_POLL_INTERVAL"]
+        app.extensions["admission"] = self
+
+    def reject(self, reason, retry_after, count=1):
+        admissions_total.inc(count, outcome=REJECTED, reason=reason)
+        return GenerationRejected(reason, max(1, retry_after))
+
+    def admit(self, user_id, count=1):
+        """Admits up to count generations requested by user_id, as many as there are places and
+        tokens for. Returns (tickets, reason): the tickets of the admitted ones (at least 1), each job
+        hands its own to finish() once it's over, and why the others weren't ("busy"/"quota", None
+        when all were). Raises GenerationRejected when we're saturated or the user has no tokens left.
+        """
+
+        tickets = self.backend.reserve([uuid.uuid4().hex for _ in range(count)], time.time(),
+                                       self.max_pending, self.pending_lease)
+        if not tickets:
+            raise self.reject("busy", self.retry_after, count)
+        reason = None
+        if len(tickets) < count:
+            admissions_total.inc(count - len(tickets), outcome=REJECTED, reason="busy")
+            reason = "busy"
+
+        taken, next_token = self.backend.take_tokens(
+            f"user:{user_id}", len(tickets), time.time(), self.burst, self.refill_seconds)
+        if taken < len(tickets):
+            admissions_total.inc(len(tickets) - taken, outcome=REJECTED, reason="quota")
+            self.backend.unreserve(tickets[taken:])
+            reason = "quota"
+        if taken == 0:
+            raise GenerationRejected("quota", max(1, next_token))
+        return tickets[:taken], reason
+
+    def finish(self, ticket):
+        """Gives back the place of an admitted generation, whether it succeeded or not"""
+
+        self.backend.unreserve([ticket])
+
+    @contextmanager
+    def slot(self):
+        """Holds a generation slot for the with block, waiting in line for one if need be.
+        Raises GenerationRejected when the line is full or the wait exceeds ADMISSION_QUEUE_TIMEOUT.
+        """
+
+        ticket = uuid.uuid4().hex
+        # a waiter that stops polling (its process died) loses its place quickly
+        wait_lease = max(10 * self.poll_interval, 5)
+
+        def acquire():
+            return self.backend.try_acquire(ticket, time.time(), self.max_in_flight, self.max_queued,
+                                            self.lease, wait_lease)
+
+        outcome = acquire()
+        if outcome == REJECTED:
+            raise self.reject("busy", self.retry_after)
+
+        if outcome == QUEUED:
+            admissions_total.inc(outcome=QUEUED, reason="")
+            started = time.monotonic()
+            with phase("admission"):
+                while outcome == QUEUED:
+                    if time.monotonic() - started >= self.queue_timeout:
+                        self.backend.release(ticket)
+                        admission_wait_seconds.observe(time.monotonic() - started)
+                        raise self.reject("timeout", self.retry_after)
+                    time.sleep(self.poll_interval)
+                    outcome = acquire()
+            admission_wait_seconds.observe(time.monotonic() - started)
+
+        admissions_total.inc(outcome=ADMITTED, reason="")
+        try:
+            yield
+        finally:
+            self.backend.release(ticket)
+
+    def stats(self):
+        """counters for monitoring, running/waiting/pending are shared by every process on the backend"""
+
+        running, waiting = self.backend.occupancy(time.time())
+        totals = {ADMITTED: 0, QUEUED: 0, REJECTED: 0}
+        for (outcome, reason), value in list(admissions_total.values.items()):
+            totals[outcome] += value
+        return {"running": running, "waiting": waiting, "pending": self.backend.pending(time.time()), **totals}
@@ -1,50 +1,167 @@
 import os
-import requests
-import boto3
-import aiohttp
+import json
+import time
 import asyncio
+import concurrent.futures
 
+from datetime import datetime
 from dotenv import load_dotenv, find_dotenv
-from flask import Flask, url_for, render_template, request, flash, redirect, session, g, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Flask, Blueprint, current_app, url_for, render_template, request, flash, redirect, session, g,
+                   jsonify, make_response, get_template_attribute, Markup, stream_with_context, abort)
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, joinedload, selectinload, undefer
 
+from config import load_config
 from forms import UserSignupForm, UserLoginForm, NewScribForm, UserEditForm
-from models import db, connect_db, User, Scrib, ConceptImage
+from models import db, bcrypt, connect_db, User, Scrib, ConceptImage, GenerationJob
+from password_hashing import password_hash_pool, PasswordHashPoolFull
+from login_throttle import LoginThrottle
+from admission import AdmissionControl, GenerationRejected
+from jobs import JobQueue
+from job_reaper import JobReaper
+from s3_uploads import S3Uploader
+from s3_cleanup import S3Cleanup, concept_art_of
+from query_counter import init_query_guard
+from instrumentation import init_instrumentation, phase
+from search import search_scribs_query, username_prefix_query
+from pagination import decode_cursor, newest_first_page
+from user_cache import UserCache
+from response_cache import ResponseCache
+from read_replica import ReadReplica
+from stream_hub import StreamHub
+from openai_client import OpenAIClient, OpenAIError
+from generation_cache import GenerationCache, generation_key, TEXT, IMAGES
+from fast_json import FastJSON
+from compression import Compress
+from http_caching import (make_etag, collection_version, viewer_etag_part, not_modified,
+                          add_validators, not_modified_response, init_static_versioning)
 
 load_dotenv(find_dotenv())
 
 CURRENT_USER_KEY = "current_user"
-API_KEY = os.environ.get('OPEN_AI_API_KEY')
-AI_API_BASE_URL = "https://api.openai.com/v1/"
+IMAGE_GENERATION_PARAMS = {"n": 3, "size": "512x512"}
+STORY_GENERATION_PARAMS = {"model": "text-davinci-003",
+                           "max_tokens": 750, "temperature": 0.3}
+PARTIAL_TEXT_FLUSH_SECONDS = 1
+SSE_WAIT_SECONDS = 0.5
+SSE_HEARTBEAT_SECONDS = 15
+# streams end after this long and the browser reconnects, sooner than a request would time out behind a proxy
+SSE_MAX_SECONDS = 30
+SSE_RETRY_MS = 1000
+API_DEFAULT_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# username typeahead suggestions, and how long browsers may reuse them
+USER_SEARCH_DEFAULT_LIMIT = 8
+USER_SEARCH_MAX_LIMIT = 20
+USER_SEARCH_MAX_AGE = 60
+# rows per query while streaming /api/scribs/export
+API_EXPORT_BATCH_SIZE = 500
+# rows per page of the server rendered lists, more are fetched as html fragments while scrolling
+HTML_PAGE_SIZE = 24
 BASE_IMG_PROMPT = "Photorealistic detailed high quality 4k concept art for a story about: "
 STORY_GENERATION_BASE_PROMPT = "From the following prompt below create a brief, original literary plot outline including: a brief description of the main character and his or her motivation, brief character sketches for different characters that fit within the story, brief sketch of an antagonist that fits the tone of the story and the antagonist's motives, a brief beginning with an inciting incident, rising action, and a fitting conclusion to the story. Prompt: "
 
-# instantiate app
-app = Flask(__name__)
-
-# set up config properties
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///scribcraft-1'))
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-toolbar = DebugToolbarExtension(app)
+# extensions are created here and bound to the app in create_app(), routes live on the main blueprint
+main = Blueprint('main', __name__)
+compress = Compress()
+login_throttle = LoginThrottle()
+admission = AdmissionControl()
+job_queue = JobQueue()
+job_reaper = JobReaper()
+s3_uploader = S3Uploader()
+s3_cleanup = S3Cleanup()
+user_cache = UserCache()
+response_cache = ResponseCache()
+generation_cache = GenerationCache()
+stream_hub = StreamHub()
+openai_client = OpenAIClient()
+fast_json = FastJSON()
+read_replica = ReadReplica()
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def create_app(profile=None, migrations=False, script_info=None):
+    """Builds the app with the "dev", "test" or "prod" profile (default: $APP_PROFILE, else "prod").
+    Flask-Migrate (and alembic, a good part of the import time) is only set up with migrations=True,
+    or when the flask cli loads the app, which passes script_info, so `flask db ...` keeps working.
+    """
 
-connect_db(app)
+    app = Flask(__name__)
+    load_config(app, profile or os.environ.get('APP_PROFILE', 'prod'))
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = trust_proxies(app.wsgi_app, app.config['TRUSTED_PROXIES'])
+
+    # after_request hooks run in reverse order, compress first so it sees the final body (toolbar included)
+    compress.init_app(app)
+    if app.config['DEBUG_TB_ENABLED']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    read_replica.init_app(app)
+    if migrations or script_info is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=MIGRATIONS_DIRECTORY)
+    bcrypt.init_app(app)
+    password_hash_pool.init_app(app)
+    login_throttle.init_app(app)
+    admission.init_app(app)
+    job_queue.init_app(app)
+    job_reaper.init_app(app)
+    s3_uploader.init_app(app)
+    s3_cleanup.init_app(app)
+    user_cache.init_app(app)
+    response_cache.init_app(app)
+    generation_cache.init_app(app)
+    openai_client.init_app(app)
+    stream_hub.init_app(app)
+    init_query_guard(app)
+    init_instrumentation(app)
+    init_static_versioning(app)
+    fast_json.init_app(app)
+    app.register_blueprint(main)
+    return app
+
+
+def trust_proxies(wsgi_app, count):
+    """Takes the client address and scheme from the headers set by the count proxies in front of us"""
+
+    try:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+    except ImportError:  # Werkzeug < 0.15
+        from werkzeug.contrib.fixers import ProxyFix
+        return ProxyFix(wsgi_app, num_proxies=count)
+    return ProxyFix(wsgi_app, x_for=count, x_proto=count)
+
+
+# DATABASE ROUTING
+# Read only pages and apis read from the replica (when there is one), their users included.
+# Writes, the job pages polling for a generation and the auth pages stay on the primary.
+
+REPLICA_ENDPOINTS = {
+    'main.root', 'main.dashboard_fragment', 'main.retrieve_scribs', 'main.export_scribs', 'main.search_scribs',
+    'main.retrieve_users', 'main.search_usernames', 'main.show_scrib', 'main.users_page', 'main.users_fragment',
+    'main.show_user_profile', 'main.user_scribs_fragment',
+}
+
+
+@main.before_app_request
+def route_reads_to_replica():
+    if request.endpoint in REPLICA_ENDPOINTS:
+        read_replica.use_replica()
 
 
 # USER SIGNUP/LOGIN/LOGOUT
 
 
-@app.before_request
+@main.before_app_request
 def add_user_to_g():
     """add current user to Flask global if logged in"""
 
     if CURRENT_USER_KEY in session:
-        g.user = User.query.get(session[CURRENT_USER_KEY])
+        # a cached snapshot of the user, not a db row. Load the User when you need to modify it
+        g.user = user_cache.get(session[CURRENT_USER_KEY], User.query.get)
     else:
         g.user = None
 
@@ -62,30 +179,106 @@ def user_logout():
         del session[CURRENT_USER_KEY]
 
 
-@app.route('/')
+def get_or_build_cached(cache_key, tags, build):
+    """Returns the response cache entry for cache_key, building and storing it on a miss.
+    build() returns (body, extra_tags, extras): extra_tags are tags only known once the data is
+    loaded (eg. the authors on a page), extras are stored alongside the body.
+    """
+
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        versions = response_cache.versions(tags)
+        body, extra_tags, extras = build()
+        versions.update(response_cache.versions(extra_tags))
+        # a lagging replica may not have the write that bumped the tags yet, don't keep its page for long
+        ttl = read_replica.cache_ttl if read_replica.in_use() else None
+        response_cache.set(cache_key, body, versions, ttl=ttl, **extras)
+        entry = dict(extras, body=body)
+    return entry
+
+
+def author_tags(scribs):
+    """cache tags for the authors whose username/avatar show up next to scribs"""
+
+    return [f"user:{user_id}" for user_id in {scrib.user_id for scrib in scribs}]
+
+
+def get_cursor_arg():
+    """Reads the ?after= keyset cursor of the server rendered lists"""
+
+    try:
+        return decode_cursor(request.args.get('after'))
+    except ValueError:
+        abort(400)
+
+
+def next_page_urls(next_cursor, endpoint, fragment_endpoint, **values):
+    """(full page url, html fragment url) of the page at next_cursor, (None, None) after the last page"""
+
+    if next_cursor is None:
+        return None, None
+    return (url_for(endpoint, after=next_cursor, **values),
+            url_for(fragment_endpoint, after=next_cursor, **values))
+
+
+def dashboard_page(macro_name):
+    """Cached html of the requested page of dashboard scribs, rendered with the macro_name macro"""
+
+    cursor = get_cursor_arg()
+
+    def build_page():
+        query = Scrib.query.options(joinedload(Scrib.user), defer(Scrib.scrib_text))
+        scribs, next_cursor = newest_first_page(query, Scrib, cursor, HTML_PAGE_SIZE)
+        macro = get_template_attribute('components/macros.html', macro_name)
+        html = macro(scribs, *next_page_urls(next_cursor, 'main.root', 'main.dashboard_fragment'))
+        return str(html), author_tags(scribs), {}
+
+    page = get_or_build_cached(
+        f"fragment:dashboard:{macro_name}:{request.args.get('after', '')}", ["scribs"], build_page)
+    return page["body"]
+
+
+@main.route('/')
 def root():
     if not g.user:
         flash("Login or register to view/create scribs", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    scribs = Scrib.query.all()
-    return render_template('user/dashboard.html', scribs=scribs)
+    return render_template('user/dashboard.html', scribs_list_html=Markup(dashboard_page('scribs_list')))
+
+
+@main.route('/fragments/scribs')
+def dashboard_fragment():
+    """The next page of dashboard scrib cards as an html fragment, for infinite scroll"""
+
+    if not g.user:
+        return "Access unauthorized", 401
+
+    return dashboard_page('scrib_cards')
 
 
 # 404 error
-@app.errorhandler(404)
+@main.app_errorhandler(404)
 def not_found(error):
     """404 page"""
 
     if not g.user:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template("404.html"), 404
 
 # AUTH ROUTES
 
 
-@app.route('/login', methods=["GET", "POST"])
+def retry_later(body, status, retry_after):
+    """Response for a request we shed (429 throttled/503 overloaded), telling the client when to come back"""
+
+    res = make_response(body, status)
+    res.headers["Retry-After"] = str(int(retry_after))
+    return res
+
+
+@main.route('/login', methods=["GET", "POST"])
 def login():
     """Login form page for registered users. Should redirect to dashboard if user is already logged in"""
 
@@ -95,17 +288,31 @@ def login():
     form = UserLoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data, form.password.data)
+        username = form.username.data
+        # refuse throttled attempts before paying for a hash
+        retry_after = login_throttle.retry_after(username, request.remote_addr)
+        if retry_after is not None:
+            flash("Too many failed login attempts. Please try again later.", "danger")
+            return retry_later(render_template('auth/login.html', form=form), 429, retry_after)
+
+        try:
+            user = User.authenticate(username, form.password.data)
+        except PasswordHashPoolFull as e:
+            flash("We're busy right now. Please try again in a moment.", "danger")
+            return retry_later(render_template('auth/login.html', form=form), 503, e.retry_after)
 
         if user:
+            login_throttle.reset(username)
             user_login(user)
             flash(f'Welcome, {user.username}!', 'success')
             return redirect('/')
 
+        login_throttle.record_failure(username, request.remote_addr)
+
     return render_template('auth/login.html', form=form)
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@main.route('/signup', methods=["GET", "POST"])
 def signup():
     """Signup form page for registered users. Should redirect to dashboard if user is already logged in"""
 
@@ -123,144 +330,681 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg
             )
             db.session.commit()
+            response_cache.invalidate("users")
 
         except IntegrityError:
             flash('Username already taken.', 'danger')
             return render_template('auth/signup.html', form=form)
 
+        except PasswordHashPoolFull as e:
+            flash("We're busy right now. Please try again in a moment.", "danger")
+            return retry_later(render_template('auth/signup.html', form=form), 503, e.retry_after)
+
         user_login(user)
 
-        return redirect(url_for('root'))
+        return redirect(url_for('main.root'))
 
     return render_template('auth/signup.html', form=form)
 
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     """Log user out of application by removing their id from the session"""
 
     user_logout()
     flash("User logged out!", "success")
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
 # SCRIB REST API ROUTES
 
 
-@app.route('/api/scribs')
+def get_page_args():
+    """Reads keyset pagination args (?after=<id>&limit=) off the request"""
+
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', API_DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        raise ValueError("limit must be a positive number")
+
+    return after, min(limit, API_MAX_PAGE_SIZE)
+
+
+def get_fields_arg(arg_name, allowed_fields):
+    """Reads a comma separated ?fields= style projection. Returns None when every field is wanted"""
+
+    raw_fields = request.args.get(arg_name)
+    if not raw_fields:
+        return None
+
+    fields = [field.strip() for field in raw_fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed_fields]
+    if unknown:
+        raise ValueError(f"Unknown {arg_name}: {', '.join(unknown)}")
+
+    return fields
+
+
+def get_date_arg(arg_name):
+    """Reads an ISO 8601 date/datetime query arg"""
+
+    value = request.args.get(arg_name)
+    if not value:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{arg_name} must be an ISO 8601 date")
+
+
+def scrib_loader_options(fields):
+    """Loader options so serializing a page of scribs with fields takes a fixed number of queries"""
+
+    options = []
+    if fields is None or {'user_username', 'user_image_url'} & set(fields):
+        options.append(joinedload(Scrib.user))
+    if fields is None or {'concept_images', 'concept_image_variants'} & set(fields):
+        options.append(selectinload(Scrib.concept_images))
+    if fields is not None and 'scrib_text' not in fields:
+        options.append(defer(Scrib.scrib_text))
+    return options
+
+
+@main.route('/api/scribs')
 def retrieve_scribs():
-    """GET route to fetch all scribs from db.
-    Returns list of scrib objects serialzied to dictionaries
+    """GET route to fetch a page of scribs from db, newest first.
+    Query params:
+        after: id of the last scrib of the previous page (cursor)
+        limit: page size, capped at API_MAX_PAGE_SIZE
+        fields: comma separated subset of scrib fields to return, eg. fields=id,title,timestamp
+        user_id, title, since, until: filters applied in SQL
+    Returns list of scrib objects serialzied to dictionaries and the cursor for the next page
+    """
+
+    try:
+        after, limit = get_page_args()
+        fields = get_fields_arg('fields', Scrib.SERIALIZERS)
+        since = get_date_arg('since')
+        until = get_date_arg('until')
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    etag = collection_version()
+    if not_modified(etag):
+        return not_modified_response(etag)
+
+    query = filtered_scribs_query(since, until).order_by(Scrib.id.desc())
+
+    query = query.options(*scrib_loader_options(fields))
+    if after is not None:
+        query = query.filter(Scrib.id < after)
+
+    def build_page():
+        # fetch one extra row to know whether there is a next page
+        scribs = query.limit(limit + 1).all()
+        next_cursor = scribs[limit - 1].id if len(scribs) > limit else None
+        body = fast_json.dumps({"scribs": [scrib.serialize_scrib(fields) for scrib in scribs[:limit]],
+                                "next_cursor": next_cursor}).decode()
+        return body, author_tags(scribs[:limit]), {}
+
+    page = get_or_build_cached(
+        f"api:{request.full_path}", ["scribs"], build_page)
+    return add_validators(current_app.response_class(page["body"], mimetype='application/json'), etag)
+
+
+def filtered_scribs_query(since, until):
+    """Scrib query with the request's user_id, title, since and until filters applied"""
+
+    query = Scrib.query
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        query = query.filter(Scrib.user_id == user_id)
+    if request.args.get('title'):
+        query = query.filter(Scrib.title.ilike(f"%{request.args['title']}%"))
+    if since is not None:
+        query = query.filter(Scrib.date_time >= since)
+    if until is not None:
+        query = query.filter(Scrib.date_time < until)
+    return query
+
+
+@main.route('/api/scribs/export')
+def export_scribs():
+    """GET route streaming every scrib that matches the filters, newest first, in one json document.
+    Query params:
+        fields, user_id, title, since, until: same as /api/scribs
+    Rows are read API_EXPORT_BATCH_SIZE at a time and written as they are serialized, the
+    document is never held in memory whole. Returns {"scribs": [...]}
+    """
+
+    try:
+        fields = get_fields_arg('fields', Scrib.SERIALIZERS)
+        since = get_date_arg('since')
+        until = get_date_arg('until')
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    query = filtered_scribs_query(since, until).options(
+        *scrib_loader_options(fields)).order_by(Scrib.id.desc())
+
+    def scribs():
+        after = None
+        while True:
+            batch = (query if after is None else query.filter(Scrib.id < after)
+                     ).limit(API_EXPORT_BATCH_SIZE).all()
+            yield from batch
+            if len(batch) < API_EXPORT_BATCH_SIZE:
+                return
+            after = batch[-1].id
+            # the written rows can go, or the session would end up holding the whole table
+            db.session.expunge_all()
+
+    return fast_json.stream_array("scribs", scribs(), lambda scrib: scrib.serialize_scrib(fields))
+
+
+@main.route('/api/scribs/search')
+def search_scribs():
+    """GET route for ranked full-text search over scrib titles, prompts and text.
+    Query params:
+        q: search terms, the last one matches as a prefix
+        offset, limit: page through the ranked results
+        fields: same projection as /api/scribs
+    Returns list of matching scrib objects, best match first, and the offset of the next page
     """
 
-    all_scribs = [scrib.serialize_scrib() for scrib in Scrib.query.all()]
-    return jsonify(scribs=all_scribs)
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        _, limit = get_page_args()
+        fields = get_fields_arg('fields', Scrib.SERIALIZERS)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    query = search_scribs_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify(scribs=[], next_offset=None)
+
+    etag = collection_version()
+    if not_modified(etag):
+        return not_modified_response(etag)
+
+    scribs = query.options(*scrib_loader_options(fields)
+                           ).offset(max(offset, 0)).limit(limit + 1).all()
+    next_offset = max(offset, 0) + limit if len(scribs) > limit else None
+
+    return add_validators(fast_json.response(scribs=[scrib.serialize_scrib(fields) for scrib in scribs[:limit]],
+                                             next_offset=next_offset), etag)
+
+
+# JOBS REST API ROUTES
+
+
+def reap_if_stale(jobs):
+    """Fails those of jobs a dead process left unfinished, see job_reaper"""
+
+    stale_ids = [job.id for job in jobs if job_reaper.is_stale(job)]
+    if stale_ids:
+        job_reaper.reap(GenerationJob.id.in_(stale_ids))
+
+
+@main.route('/api/jobs/<int:job_id>')
+def retrieve_job(job_id):
+    """GET route to fetch the status of one of the logged in user's generation jobs"""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized"), 401
+
+    job = GenerationJob.query.get_or_404(job_id)
+
+    if job.user_id != g.user.id:
+        return jsonify(error="Access unauthorized"), 403
+
+    reap_if_stale([job])
+    return fast_json.response(job=job.serialize_job())
+
+
+@main.route('/api/jobs')
+def retrieve_jobs():
+    """GET route to fetch the status of several of the logged in user's generation jobs at once.
+    Query params:
+        ids: comma separated job ids, eg. the jobs of a batch
+    Returns the jobs in the order asked for (other users' jobs are left out) and how many are in each status
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized"), 401
+
+    try:
+        ids = [int(job_id) for job_id in request.args.get('ids', '').split(',') if job_id.strip()]
+    except ValueError:
+        return jsonify(error="ids must be comma separated job ids"), 400
+    if len(ids) > API_MAX_PAGE_SIZE:
+        return jsonify(error=f"At most {API_MAX_PAGE_SIZE} ids per request"), 400
+
+    jobs = {job.id: job for job in GenerationJob.query.filter(
+        GenerationJob.id.in_(ids), GenerationJob.user_id == g.user.id)}
+    jobs = [jobs[job_id] for job_id in ids if job_id in jobs]
+    reap_if_stale(jobs)
+
+    summary = dict.fromkeys([GenerationJob.QUEUED, GenerationJob.RUNNING,
+                             GenerationJob.DONE, GenerationJob.FAILED], 0)
+    for job in jobs:
+        summary[job.status] += 1
+
+    return fast_json.response(jobs=[job.serialize_job() for job in jobs], summary=summary)
 
 
 # USERS REST API ROUTES
 
 
-@app.route('/api/users')
+@main.route('/api/users')
 def retrieve_users():
-    """GET route to fetch all users from db.
-    Returns list of user objects serialzied to dictionaries
+    """GET route to fetch a page of users from db, oldest first.
+    Query params:
+        after: id of the last user of the previous page (cursor)
+        limit: page size, capped at API_MAX_PAGE_SIZE
+        fields: comma separated subset of user fields, leave out "scribs" to skip nested scribs
+        scrib_fields: same projection for the nested scribs
+    Returns list of user objects serialzied to dictionaries and the cursor for the next page
     """
 
-    all_users = [user.serialize_user() for user in User.query.all()]
-    return jsonify(users=all_users)
+    try:
+        after, limit = get_page_args()
+        fields = get_fields_arg('fields', User.SERIALIZERS)
+        scrib_fields = get_fields_arg('scrib_fields', Scrib.SERIALIZERS)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    etag = collection_version()
+    if not_modified(etag):
+        return not_modified_response(etag)
+
+    query = User.query.order_by(User.id)
+
+    if fields is None or 'scribs' in fields:
+        # nested scrib.user resolves from the identity map, the parent user is already loaded
+        scrib_loader = selectinload(User.scribs)
+        query = query.options(scrib_loader)
+        if scrib_fields is None or 'concept_images' in scrib_fields:
+            query = query.options(scrib_loader.selectinload(Scrib.concept_images))
+        if scrib_fields is not None and 'scrib_text' not in scrib_fields:
+            query = query.options(scrib_loader.defer(Scrib.scrib_text))
+
+    if after is not None:
+        query = query.filter(User.id > after)
+
+    def build_page():
+        users = query.limit(limit + 1).all()
+        next_cursor = users[limit - 1].id if len(users) > limit else None
+        body = fast_json.dumps({"users": [user.serialize_user(fields, scrib_fields) for user in users[:limit]],
+                                "next_cursor": next_cursor}).decode()
+        return body, [f"user:{user.id}" for user in users[:limit]], {}
+
+    # nested scribs only change the page when scribs are created/deleted
+    tags = ["users", "scribs"] if fields is None or 'scribs' in fields else [
+        "users"]
+    page = get_or_build_cached(f"api:{request.full_path}", tags, build_page)
+    return add_validators(current_app.response_class(page["body"], mimetype='application/json'), etag)
+
+
+@main.route('/api/users/search')
+def search_usernames():
+    """GET route for the username typeahead: users whose username starts with prefix, ignoring case.
+    Query params:
+        prefix: start of the username
+        limit: number of suggestions, capped at USER_SEARCH_MAX_LIMIT
+    Returns [{id, username, image_url}] in username order
+    """
+
+    prefix = request.args.get('prefix', '').strip()
+    limit = request.args.get('limit', USER_SEARCH_DEFAULT_LIMIT, type=int)
+    if not prefix:
+        return jsonify(error="prefix is required"), 400
+    if limit < 1:
+        return jsonify(error="limit must be a positive number"), 400
+
+    users = username_prefix_query(prefix).limit(min(limit, USER_SEARCH_MAX_LIMIT)).all()
+    res = fast_json.response(users=[{"id": user_id, "username": username, "image_url": image_url}
+                                    for user_id, username, image_url in users])
+    # typing and deleting asks for the same prefixes again
+    res.headers["Cache-Control"] = f"private, max-age={USER_SEARCH_MAX_AGE}"
+    return res
 
 
 # GET SINGLE, CREATE, UPDATE, DELETE SCRIB ROUTES
-@app.route('/scribs/<int:scrib_id>')
+@main.route('/scribs/<int:scrib_id>')
 def show_scrib(scrib_id):
     """Displays a single scrib on page"""
 
     if not g.user:
         flash("You must be logged in to view this page.", "danger")
-        return redirect(url_for('login'))
-
-    scrib = Scrib.query.get_or_404(scrib_id)
-
-    return render_template('user/scrib.html', scrib=scrib)
-
-
-@app.route('/create-scrib', methods=["GET", "POST"])
+        return redirect(url_for('main.login'))
+
+    fragment = get_scrib_details_fragment(scrib_id)
+
+    # scribs are immutable, the cached fragment changes with the author's profile and attached concept art
+    etag = make_etag(fragment["body"], viewer_etag_part())
+    last_modified = datetime.fromisoformat(fragment["last_modified"])
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    page = render_template('user/scrib.html', scrib_title=fragment["title"],
+                           scrib_details_html=Markup(fragment["body"]))
+    return add_validators(make_response(page), etag, last_modified)
+
+
+def get_scrib_details_fragment(scrib_id):
+    """Cached html of a scrib with its concept art. The author sees a delete button, so authors get their own variant"""
+
+    cache_key = f"fragment:scrib:{scrib_id}"
+    fragment = response_cache.get(cache_key)
+    if fragment is not None and fragment["user_id"] == g.user.id:
+        fragment = response_cache.get(cache_key + ":author")
+    if fragment is not None:
+        return fragment
+
+    def build_details():
+        scrib = Scrib.query.options(joinedload(Scrib.user), selectinload(
+            Scrib.concept_images)).get_or_404(scrib_id)
+        last_modified = max(filter(None, [scrib.date_time, scrib.user.updated_at]))
+        body = render_template('components/scrib-details.html', scrib=scrib)
+        extras = {"title": scrib.title, "user_id": scrib.user_id,
+                  "last_modified": last_modified.isoformat()}
+        return body, [f"user:{scrib.user_id}"], extras
+
+    scrib_user_id = Scrib.query.with_entities(Scrib.user_id).filter_by(id=scrib_id).scalar()
+    if scrib_user_id is None and read_replica.in_use():
+        # the job page links to a scrib as soon as it's generated, the replica may not have it yet
+        read_replica.use_primary()
+        scrib_user_id = Scrib.query.with_entities(Scrib.user_id).filter_by(id=scrib_id).scalar()
+    if scrib_user_id == g.user.id:
+        cache_key += ":author"
+    return get_or_build_cached(cache_key, [f"scrib:{scrib_id}"], build_details)
+
+
+@main.route('/create-scrib', methods=["GET", "POST"])
 def create_scrib():
     """Presents form to create a new scrib and handles submission"""
 
     if not g.user:
         flash("You must be logged in to view this page.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     form = NewScribForm()
 
     if form.validate_on_submit():
-        title = form.title.data
-        prompt = form.prompt.data
+        try:
+            (ticket,), _ = admission.admit(g.user.id)
+        except GenerationRejected as e:
+            flash(str(e), "danger")
+            return retry_later(render_template('user/create-scrib.html', form=form),
+                               429 if e.reason == "quota" else 503, e.retry_after)
+
+        job = GenerationJob(title=form.title.data, prompt=form.prompt.data,
+                            user_id=g.user.id, admission_ticket=ticket)
+        db.session.add(job)
+        db.session.commit()
+
+        # generation takes tens of seconds, hand it to the worker pool and let the job page poll for it
+        job_queue.enqueue(run_scrib_generation_job, job.id, ticket)
+
+        return redirect(url_for('main.show_job', job_id=job.id))
+
+    return render_template('user/create-scrib.html', form=form)
+
+
+def batch_item_error(item, taken_titles):
+    """Why a batch item can't be queued, None when it can. taken_titles collects the batch's titles"""
+
+    if not isinstance(item, dict):
+        return "Items must be objects with a title and a prompt."
 
+    title, prompt = item.get('title'), item.get('prompt')
+    if not isinstance(title, str) or not title.strip():
+        return "Title must be included."
+    if not isinstance(prompt, str) or not prompt.strip():
+        return "You must submit a prompt."
+    if title.strip() in taken_titles:
+        return "A scrib with that title already exists. Please pick another title."
+
+    taken_titles.add(title.strip())
+    return None
+
+
+@main.route('/api/scribs/batch', methods=["POST"])
+def create_scribs_batch():
+    """POST route queueing the generation of many scribs at once.
+    JSON body:
+        items: list of {"title", "prompt"}, at most GENERATION_BATCH_MAX_ITEMS
+        concurrency: how many of them generate at the same time, capped at GENERATION_BATCH_CONCURRENCY
+    Every item stands on its own: invalid ones and those past the user's generation quota are rejected
+    while the rest are queued, and a failed generation leaves the others alone. Returns 202 with each
+    item's status ("queued" with its job_id or "rejected" with an error) and the url reporting the
+    progress of the queued ones, or 429/503 with a Retry-After when nothing can be admitted
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized"), 401
+
+    # requiring a json body keeps other sites from posting batches with the user's cookie,
+    # browsers won't send one cross site without a CORS preflight
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('items'), list) or not body['items']:
+        return jsonify(error='Expected a json body like {"items": [{"title": "...", "prompt": "..."}]}'), 400
+
+    items = body['items']
+    max_items = current_app.config['GENERATION_BATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        return jsonify(error=f"At most {max_items} items per batch"), 400
+
+    max_concurrency = current_app.config['GENERATION_BATCH_CONCURRENCY']
+    concurrency = body.get('concurrency', max_concurrency)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return jsonify(error="concurrency must be a positive number"), 400
+    concurrency = min(concurrency, max_concurrency)
+
+    # one query for every title in the batch that is already taken
+    titles = [item['title'].strip() for item in items
+              if isinstance(item, dict) and isinstance(item.get('title'), str)]
+    taken_titles = {title for (title,) in db.session.query(Scrib.title).filter(Scrib.title.in_(titles))}
+
+    errors = [batch_item_error(item, taken_titles) for item in items]
+    valid_count = errors.count(None)
+    tickets, refused_reason = [], None
+    if valid_count:
         try:
-            [image_urls, scrib_content] = asyncio.run(
-                fetch_images_and_scrib_bundle(prompt))
+            tickets, refused_reason = admission.admit(g.user.id, valid_count)
+        except GenerationRejected as e:
+            return retry_later(jsonify(error=str(e)), 429 if e.reason == "quota" else 503, e.retry_after)
+
+    results = []
+    jobs = []
+    for item, error in zip(items, errors):
+        if error is None and len(jobs) == len(tickets):
+            error = GenerationRejected.MESSAGES[refused_reason]
+        if error is not None:
+            results.append({"title": item.get('title') if isinstance(item, dict) else None,
+                            "status": "rejected", "error": error})
+            continue
+
+        job = GenerationJob(title=item['title'].strip(), prompt=item['prompt'], user_id=g.user.id,
+                            admission_ticket=tickets[len(jobs)])
+        jobs.append(job)
+        results.append({"title": job.title, "status": GenerationJob.QUEUED, "job": job})
+
+    db.session.add_all(jobs)
+    # read the ids before the commit expires the jobs, afterwards every id would be a query
+    db.session.flush()
+    job_ids = [job.id for job in jobs]
+    for result in results:
+        if "job" in result:
+            result["job_id"] = result.pop("job").id
+    db.session.commit()
 
-            scrib = Scrib(title=title, prompt=prompt,
-                          scrib_text=scrib_content, user_id=g.user.id)
+    job_queue.enqueue_many(run_scrib_generation_job, list(zip(job_ids, tickets)), concurrency)
 
-            db.session.add(scrib)
-            db.session.commit()
+    return fast_json.response(
+        items=results, concurrency=concurrency,
+        status_url=url_for('main.retrieve_jobs', ids=",".join(map(str, job_ids))) if job_ids else None
+    ), 202
 
-            # upload image urls to s3 bucket bc urls from openai expire after 1 hour
-            s3_bucket_urls = []
-            for index, png_url in enumerate(image_urls, start=1):
-                s3_url = upload_img_to_s3_bucket_from_url(
-                    png_url, scrib.id, index)
-                s3_bucket_urls.append(s3_url)
 
-            # add the s3 urls to the db
-            add_concept_art_to_db(s3_bucket_urls, scrib.id)
+@main.route('/jobs/<int:job_id>')
+def show_job(job_id):
+    """Displays progress of a scrib generation job, sends user to the scrib once it's done"""
 
-        except Exception as e:
-            return render_template('user/error.html', error_message=e)
+    if not g.user:
+        flash("You must be logged in to view this page.", "danger")
+        return redirect(url_for('main.login'))
 
+    job = GenerationJob.query.get_or_404(job_id)
+
+    if job.user_id != g.user.id:
+        flash("Unauthorized access attempt.", "danger")
+        return redirect(url_for('main.root'))
+
+    reap_if_stale([job])
+    if job.status == GenerationJob.DONE:
         flash("Scrib created!", "success")
-        return redirect(url_for('show_scrib', scrib_id=scrib.id))
+        return redirect(url_for('main.show_scrib', scrib_id=job.scrib_id))
 
-    return render_template('user/create-scrib.html', form=form)
+    if job.status == GenerationJob.FAILED:
+        return render_template('user/error.html', error_message=job.error_message)
+
+    return render_template('user/job.html', job=job)
 
 
-@app.route('/scribs/delete/<int:scrib_id>', methods=["POST"])
+def sse_event(event, data):
+    """format one Server-Sent Event, data is json encoded so newlines in text survive"""
+
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@main.route('/jobs/<int:job_id>/stream')
+def stream_job(job_id):
+    """Server-Sent Events stream of a generation job: "text" events carry the story as it is generated,
+    a final "done" or "failed" event carries the job. Every connection starts from the beginning of the text.
+    A stream ends after SSE_MAX_SECONDS and EventSource reconnects. 503 when the process already serves
+    SSE_MAX_STREAMS streams, the page then polls /api/jobs/<id> instead.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized"), 401
+
+    job = GenerationJob.query.get_or_404(job_id)
+
+    if job.user_id != g.user.id:
+        return jsonify(error="Access unauthorized"), 403
+
+    reap_if_stale([job])
+
+    def read_job():
+        """fresh job state from the db, without holding a connection while we wait"""
+        db.session.refresh(job)
+        state = (job.partial_text or "", job.is_finished)
+        db.session.rollback()
+        return state
+
+    if not stream_hub.acquire_reader():
+        response = jsonify(error="Too many streams, poll the job instead")
+        response.headers["Retry-After"] = str(SSE_MAX_SECONDS)
+        return response, 503
+
+    def events():
+        sent = 0
+        started = last_event = time.monotonic()
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+
+        while time.monotonic() - started < SSE_MAX_SECONDS:
+            update = stream_hub.wait(job_id, sent, SSE_WAIT_SECONDS)
+            if update is None:
+                # not running in this process (yet), follow the text it flushes to the db
+                text, finished = read_job()
+                text = text[sent:]
+                if not text and not finished:
+                    time.sleep(SSE_WAIT_SECONDS)
+            else:
+                text, finished, _ = update
+
+            if text:
+                sent += len(text)
+                last_event = time.monotonic()
+                yield sse_event("text", text)
+            elif time.monotonic() - last_event >= SSE_HEARTBEAT_SECONDS:
+                last_event = time.monotonic()
+                yield ": keepalive\n\n"
+
+            if finished:
+                read_job()
+                yield sse_event(job.status, job.serialize_job())
+                return
+
+    response = current_app.response_class(stream_with_context(events()), mimetype='text/event-stream')
+    # the server calls close() when the client goes away, even before the stream started
+    response.call_on_close(stream_hub.release_reader)
+    response.headers["Cache-Control"] = "no-cache"
+    # don't let a proxy (nginx, render, heroku) buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@main.route('/scribs/delete/<int:scrib_id>', methods=["POST"])
 def delete_scrib(scrib_id):
     """Post route to submit form and delete script"""
 
     if not g.user:
         flash("Access unauthorized", "danger")
-        return redirect(url_for('login'))
-
-    scrib = Scrib.query.get_or_404(scrib_id)
+        return redirect(url_for('main.login'))
 
-    db.session.delete(scrib)
+    # one DELETE, the database cascades it to the concept images
+    concept_art = concept_art_of(Scrib.id == scrib_id)
+    if not Scrib.query.filter_by(id=scrib_id).delete(synchronize_session=False):
+        abort(404)
     db.session.commit()
+    response_cache.invalidate("scribs", f"scrib:{scrib_id}")
+    s3_cleanup.enqueue(concept_art)
 
     flash("Scrib deleted!", "success")
-    return redirect(url_for('root'))
+    return redirect(url_for('main.root'))
 
 
 # USER ROUTES
 
 
-@app.route('/users')
+@main.route('/users')
 def users_page():
     """Presents list of site users and allows filtering by username"""
 
     if not g.user:
         flash("You must be logged in to view this page", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
+
+    users, (next_page_url, next_fragment_url) = users_list_page()
+
+    return render_template('user/users.html', users=users,
+                           next_page_url=next_page_url, next_fragment_url=next_fragment_url)
+
+
+@main.route('/fragments/users')
+def users_fragment():
+    """The next page of user cards as an html fragment, for infinite scroll"""
+
+    if not g.user:
+        return "Access unauthorized", 401
+
+    users, next_urls = users_list_page()
+    return get_template_attribute('components/macros.html', 'user_cards')(users, *next_urls)
+
 
-    users = User.query.all()
+def users_list_page():
+    """The requested page of users, newest first, and the urls of the next one"""
 
-    return render_template('user/users.html', users=users)
+    query = User.query.options(undefer(User.scrib_count))
+    users, next_cursor = newest_first_page(query, User, get_cursor_arg(), HTML_PAGE_SIZE)
+    return users, next_page_urls(next_cursor, 'main.users_page', 'main.users_fragment')
 
 
-@app.route('/users/<int:user_id>')
+@main.route('/users/<int:user_id>')
 def show_user_profile(user_id):
     """Page to display a specific user profile including some of their info and their scribs"""
 
@@ -269,21 +1013,43 @@ def show_user_profile(user_id):
         return redirect('login')
 
     user = User.query.get_or_404(user_id)
+    scribs, (next_page_url, next_fragment_url) = user_scribs_page(user_id)
 
-    return render_template('user/user.html', user=user)
+    return render_template('user/user.html', user=user, scribs=scribs,
+                           next_page_url=next_page_url, next_fragment_url=next_fragment_url)
 
 
-@app.route('/users/edit/<int:user_id>', methods=["GET", "POST"])
+@main.route('/fragments/users/<int:user_id>/scribs')
+def user_scribs_fragment(user_id):
+    """The next page of a profile's scrib cards as an html fragment, for infinite scroll"""
+
+    if not g.user:
+        return "Access unauthorized", 401
+
+    scribs, next_urls = user_scribs_page(user_id)
+    return get_template_attribute('components/macros.html', 'scrib_cards')(scribs, *next_urls)
+
+
+def user_scribs_page(user_id):
+    """The requested page of a user's scribs, newest first, and the urls of the next one"""
+
+    # scrib.user resolves from the identity map once the author is loaded
+    query = Scrib.query.filter(Scrib.user_id == user_id).options(defer(Scrib.scrib_text))
+    scribs, next_cursor = newest_first_page(query, Scrib, get_cursor_arg(), HTML_PAGE_SIZE)
+    return scribs, next_page_urls(next_cursor, 'main.show_user_profile', 'main.user_scribs_fragment', user_id=user_id)
+
+
+@main.route('/users/edit/<int:user_id>', methods=["GET", "POST"])
 def edit_user_profile(user_id):
     """Page that displays form with prefilled data to edit user"""
 
     if not g.user:
         flash("You must be logged in to view this page.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     if g.user.id != user_id:
         flash("Unauthorized access attempt.", "danger")
-        return redirect(url_for('root'))
+        return redirect(url_for('main.root'))
 
     form = UserEditForm(obj=g.user)
 
@@ -297,101 +1063,279 @@ def edit_user_profile(user_id):
 
         db.session.add(user)
         db.session.commit()
+        user_cache.invalidate(user.id)
+        # username/avatar show up on every card of their scribs
+        response_cache.invalidate("users", f"user:{user.id}")
 
         flash("Profile updated!", "success")
-        return redirect(url_for("show_user_profile", user_id=user.id))
+        return redirect(url_for("main.show_user_profile", user_id=user.id))
 
     return render_template("/user/edit-user.html", form=form, user=g.user)
 
 
-@app.route('/users/delete', methods=["POST"])
+@main.route('/users/delete', methods=["POST"])
 def delete_user():
     """Receives post request from form to permanenetly delete user"""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
+    user_id = g.user.id
     user_logout()
 
-    db.session.delete(g.user)
+    # one DELETE, the database cascades it to the user's scribs, concept images and jobs
+    concept_art = concept_art_of(Scrib.user_id == user_id)
+    if not User.query.filter_by(id=user_id).delete(synchronize_session=False):
+        abort(404)
     db.session.commit()
+    user_cache.invalidate(user_id)
+    response_cache.invalidate("users", "scribs", f"user:{user_id}")
+    s3_cleanup.enqueue(concept_art)
 
-    return redirect(url_for('signup'))
+    return redirect(url_for('main.signup'))
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Caching policy: auth pages are never stored, everything else may be stored but must be
+# revalidated (routes with validators answer that with a 304). Versioned static files set
+# their own long lived Cache-Control in http_caching.init_static_versioning.
+
+NO_STORE_ENDPOINTS = {'main.login', 'main.signup'}
+
+
+@main.after_app_request
+def add_header(res):
+    """Add caching headers to every response that didn't set its own policy"""
 
+    if request.endpoint in NO_STORE_ENDPOINTS:
+        res.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        res.headers["Pragma"] = "no-cache"
+        res.headers["Expires"] = "0"
+    elif "Cache-Control" not in res.headers:
+        res.headers["Cache-Control"] = "private, no-cache"
+    return res
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# BACKGROUND JOBS
+
+
+def run_scrib_generation_job(job_id, ticket=None):
+    """Runs a queued job, then gives back the admission place admit() gave it as ticket"""
+
+    try:
+        generate_job_scrib(job_id)
+    finally:
+        if ticket is not None:
+            admission.finish(ticket)
+
+
+def generate_job_scrib(job_id):
+    """Runs the whole generation pipeline for a queued job: fetch text + concept art from OpenAI,
+    save the scrib, copy the images to s3 and record them. Job status is kept up to date in the db
+    so the job page can report progress.
+    """
+
+    job = GenerationJob.query.get(job_id)
+    if job is None or job.status != GenerationJob.QUEUED:
+        return
+
+    job.status = GenerationJob.RUNNING
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+
+    scrib_id = None
+    streamed = []
+    on_text = None
+    on_wait = None
+    if current_app.config['SCRIB_STREAMING']:
+        stream_hub.open(job_id)
+
+        def on_text(chunk):
+            """push streamed text to SSE readers in this process. Runs on the OpenAI client's loop thread,
+            so it leaves the db alone, on_wait flushes the text from the job thread
+            """
+            stream_hub.publish(job_id, chunk)
+            streamed.append(chunk)
+
+        def on_wait():
+            """flush the text streamed so far to the db now and then for readers in other processes"""
+            if streamed:
+                job.partial_text = "".join(streamed)
+                db.session.commit()
+
+    try:
+        [image_urls, scrib_content] = generate_scrib_bundle(
+            job.prompt, on_text, on_wait)
+
+        scrib = Scrib(title=job.title, prompt=job.prompt,
+                      scrib_text=scrib_content, user_id=job.user_id)
+
+        db.session.add(scrib)
+        db.session.commit()
+        scrib_id = scrib.id
+
+        # upload images and their resized copies to s3 bucket bc urls from openai expire after 1 hour
+        with phase("s3"):
+            uploaded_images = s3_uploader.upload_concept_images(
+                image_urls, scrib.id)
+
+        # add the s3 urls to the db
+        add_concept_art_to_db(uploaded_images, scrib.id)
+
+        job.status = GenerationJob.DONE
+        job.scrib_id = scrib.id
+        # the reaper may have given up on a job this slow
+        job.error_message = None
+
+    except IntegrityError:
+        db.session.rollback()
+        job.status = GenerationJob.FAILED
+        job.error_message = "A scrib with that title already exists. Please pick another title."
+
+    except Exception as e:
+        db.session.rollback()
+        job.status = GenerationJob.FAILED
+        job.error_message = str(e)
+
+    job.finished_at = datetime.utcnow()
+    # the scrib now holds the full text
+    job.partial_text = None
+    db.session.commit()
+    stream_hub.close(job_id, job.error_message)
+
+    # the scrib stays even if its concept art failed to upload
+    if scrib_id is not None:
+        response_cache.invalidate("scribs", f"scrib:{scrib_id}")
 
 
 # DEFINITIONS for AI api requests
-async def fetch_images_and_scrib_bundle(prompt):
-    """Call other two async api functions to run requests concurrently"""
+def generate_scrib_bundle(prompt, on_text=None, on_wait=None):
+    """Fetch concept art urls and the story for prompt, reusing memoized results when policy allows.
+    The api calls run concurrently on the shared OpenAI client loop, this thread waits for them and
+    calls on_wait() every PARTIAL_TEXT_FLUSH_SECONDS meanwhile.
+    Returns [image_urls, scrib_text]
+    """
+
+    # the cache lives in the db, so it is read and written here rather than on the client loop
+    images_key = generation_key(
+        IMAGES, BASE_IMG_PROMPT, prompt, IMAGE_GENERATION_PARAMS)
+    text_key = generation_key(
+        TEXT, STORY_GENERATION_BASE_PROMPT, prompt, STORY_GENERATION_PARAMS)
+    image_urls = generation_cache.get(IMAGES, images_key)
+    scrib_text = generation_cache.get(TEXT, text_key)
+    if scrib_text is not None and on_text is not None:
+        on_text(scrib_text)
+
+    fetched_urls = fetched_text = None
+    if image_urls is None or scrib_text is None:
+        # waits for a slot while too many generations are in flight, raises GenerationRejected past the queue
+        with admission.slot():
+            future = openai_client.submit(fetch_images_and_scrib_bundle(
+                prompt, on_text, fetch_images=image_urls is None, fetch_text=scrib_text is None))
+            while True:
+                try:
+                    with phase("openai"):
+                        [fetched_urls, fetched_text] = future.result(
+                            timeout=PARTIAL_TEXT_FLUSH_SECONDS)
+                    break
+                except concurrent.futures.TimeoutError:
+                    if on_wait is not None:
+                        on_wait()
+
+    if fetched_urls is not None:
+        image_urls = fetched_urls
+        generation_cache.set(IMAGES, images_key, image_urls)
+    if fetched_text is not None:
+        scrib_text = fetched_text
+        generation_cache.set(TEXT, text_key, scrib_text)
+
+    return [image_urls, scrib_text]
+
+
+async def fetch_images_and_scrib_bundle(prompt, on_text=None, fetch_images=True, fetch_text=True):
+    """Call other two async api functions to run requests concurrently, parts not fetched come back as None.
+    With on_text the story is streamed, on_text(chunk) is called for every piece as it arrives.
+    """
 
-    async with aiohttp.ClientSession() as session:
+    async def skip():
+        return None
 
-        tasks = []
-        tasks.append(asyncio.ensure_future(
-            post_generate_image_art_API(session, prompt)))
-        tasks.append(asyncio.ensure_future(
-            post_generate_scrib_content_API(session, prompt)))
+    tasks = []
+    tasks.append(post_generate_image_art_API(prompt) if fetch_images else skip())
+    if not fetch_text:
+        tasks.append(skip())
+    elif on_text is None:
+        tasks.append(post_generate_scrib_content_API(prompt))
+    else:
+        tasks.append(stream_generate_scrib_content_API(prompt, on_text))
 
-        bundle = await asyncio.gather(*tasks)
-        return bundle
+    bundle = await asyncio.gather(*tasks)
+    return bundle
 
 
-async def post_generate_image_art_API(session, prompt):
-    """async function to fetch concept art"""
+async def post_generate_image_art_API(prompt):
+    """async function to fetch concept art, returns the list of image urls"""
 
-    headers = {'Authorization': f"Bearer {API_KEY}",
-               'Content-Type': 'application/json'}
     prompt_with_base = BASE_IMG_PROMPT + prompt
-    async with session.post(f"{AI_API_BASE_URL}images/generations", headers=headers, json={
+    try:
+        concept_art_images = await openai_client.post_json("images/generations", {
             'prompt': prompt_with_base,
-            "n": 3,
-            "size": "512x512"
-    }) as res:
-        concept_art_images = await res.json()
-        if "error" in concept_art_images:
-            raise Exception(
-                f"Error message: {concept_art_images['error']['message']}. Error type: {concept_art_images['error']['type']}")
-        return [item['url'] for item in concept_art_images['data']]
+            **IMAGE_GENERATION_PARAMS
+        })
+    except OpenAIError as e:
+        if e.error_type is None:
+            raise
+        raise Exception(
+            f"Error message: {e.message}. Error type: {e.error_type}")
+
+    return [item['url'] for item in concept_art_images['data']]
 
 
-async def post_generate_scrib_content_API(session, prompt):
+async def post_generate_scrib_content_API(prompt):
     """async function to fetch story generated"""
 
-    headers = {'Authorization': f"Bearer {API_KEY}",
-               'Content-Type': 'application/json'}
     prompt_with_base = STORY_GENERATION_BASE_PROMPT + prompt
+    try:
+        generated_text = await openai_client.post_json("completions", {
+            "prompt": prompt_with_base,
+            **STORY_GENERATION_PARAMS
+        })
+    except OpenAIError as e:
+        if e.error_type is None:
+            raise
+        raise Exception(
+            "Error in generating your text. Your content may be inappropriate. Please try again. 😭")
+
+    return generated_text["choices"][0]["text"]
+
+
+async def stream_generate_scrib_content_API(prompt, on_text):
+    """async function to fetch story generated, streamed: on_text(chunk) gets the text as OpenAI produces it.
+    Returns the whole text once the stream ends.
+    """
 
-    async with session.post(f"{AI_API_BASE_URL}completions", headers=headers, json={
-        "model": "text-davinci-003",
-        "prompt": prompt_with_base,
-        "max_tokens": 750,
-        "temperature": 0.3
-    }) as res:
-        generated_text = await res.json()
+    prompt_with_base = STORY_GENERATION_BASE_PROMPT + prompt
+    chunks = []
+
+    def on_event(event):
+        text = event["choices"][0]["text"]
+        if text:
+            chunks.append(text)
+            on_text(text)
 
-        if "error" in generated_text:
-            raise Exception(
-                "Error in generating your text. Your content may be inappropriate. Please try again. 😭")
-        return generated_text["choices"][0]["text"]
+    try:
+        await openai_client.post_stream("completions", {
+            "prompt": prompt_with_base,
+            **STORY_GENERATION_PARAMS
+        }, on_event)
+    except OpenAIError as e:
+        if e.error_type is None and e.status is None:
+            raise
+        raise Exception(
+            "Error in generating your text. Your content may be inappropriate. Please try again. 😭")
+
+    return "".join(chunks)
 
 
 def generate_concept_art_list_API(prompt):
@@ -402,28 +1346,27 @@ def generate_concept_art_list_API(prompt):
     Return: shoudl return a list containing 5 urls for generated images
     """
 
-    headers = {'Authorization': f"Bearer {API_KEY}",
-               'Content-Type': 'application/json'}
     prompt_with_base = BASE_IMG_PROMPT + prompt
 
-    res = requests.post(f"{AI_API_BASE_URL}images/generations", headers=headers, json={
+    concept_art_images = openai_client.run(openai_client.post_json("images/generations", {
         'prompt': prompt_with_base,
         "n": 5,
         "size": "512x512"
-    })
-    return [item['url'] for item in res.json()['data']]
+    }))
+    return [item['url'] for item in concept_art_images['data']]
 
 
 def add_concept_art_to_db(concept_art, scrib_id):
     """Stores concept art to relevant table in database
     Params: 
-        concept_art: list, should be a list of urls pointing to the images generated
+        concept_art: list of uploaded images as returned by s3_uploader.upload_concept_image, {"url", "variants"}
         scrib_id: id for scrib that all images will belong to or will be associated with
     Returns None
     """
 
     concept_image_objects = [ConceptImage(
-        concept_image_url=concept_image_url, scrib_id=scrib_id) for concept_image_url in concept_art]
+        concept_image_url=image["url"], variants=json.dumps(image["variants"]), scrib_id=scrib_id)
+        for image in concept_art]
 
     db.session.add_all(concept_image_objects)
     db.session.commit()
@@ -434,46 +1377,31 @@ def generate_scrib_content_API(prompt):
     Returns string of scrib content with line breaks 
     """
 
-    headers = {'Authorization': f"Bearer {API_KEY}",
-               'Content-Type': 'application/json'}
     prompt_with_base = STORY_GENERATION_BASE_PROMPT + prompt
 
-    res = requests.post(f"{AI_API_BASE_URL}completions", headers=headers, json={
+    generated_text = openai_client.run(openai_client.post_json("completions", {
         "model": "text-davinci-003",
         "prompt": prompt_with_base,
         "max_tokens": 750,
         "temperature": 0.3
-    })
+    }))
 
-    return res.json()["choices"][0]["text"]
+    return generated_text["choices"][0]["text"]
 
 
 def upload_img_to_s3_bucket_from_url(url: str, scrib_id, img_number):
     """Uploads an image from input url to s3 bucket and returns url to display it publically from s3"""
 
-    r = requests.get(url, stream=True)
-
-    session = boto3.Session(aws_access_key_id=os.environ.get('ACCESS_KEY'),
-                            aws_secret_access_key=os.environ.get('SECRET_ACCESS_KEY_AWS'))
-    s3 = session.resource('s3')
-
-    bucket_name = "scribcraft.concept"
-    key = f"scrib_{scrib_id}_{img_number}"
-
-    bucket = s3.Bucket(bucket_name)
-    bucket.upload_fileobj(r.raw, key, ExtraArgs={
-                          'ContentType': "image/png"})
-
-    return f"https://s3.amazonaws.com/{bucket_name}/{key}"
+    return s3_uploader.upload_from_url(url, f"scrib_{scrib_id}_{img_number}")
 
 
 def get_img_url_from_s3_bucket():
     """Fetch a url to image stored in bucket"""
 
-    s3 = boto3.client('s3', aws_access_key_id=os.environ.get('ACCESS_KEY'),
-                      aws_secret_access_key=os.environ.get('SECRET_ACCESS_KEY_AWS'))
+    s3 = s3_uploader.get_client()
 
     url = s3.generate_presigned_url(
         'get_object', Params={'Bucket': 'scribcraft.concept', 'Key': 'scrib_1'}, ExpiresIn=3600)
 
-    print(url)
+    current_app.logger.debug("Presigned url for scrib_1: %s", url)
+    return url
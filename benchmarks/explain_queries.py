@@ -0,0 +1,144 @@
+"""Check that the hot list queries are answered from indexes, not full table scans.
+
+EXPLAINs the queries behind the dashboard, profile pages, the users list, the username
+typeahead and concept image loading against the configured database (DATABASE_URL) and fails if a query doesn't use the
+index it was written for. Plans only mean something on a database of realistic size, so
+seed one first (or pass --generate, which resets the database!):
+
+    python benchmarks/explain_queries.py --generate --users 10000 --scribs 100000
+
+Prints each plan and exits non-zero when an expected index is missing from it.
+"""
+import os
+import sys
+import json
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import or_  # noqa: E402
+from sqlalchemy.orm import undefer  # noqa: E402
+
+from app import create_app  # noqa: E402
+from search import username_prefix_query  # noqa: E402
+from models import db, User, Scrib, ConceptImage  # noqa: E402
+
+PAGE_SIZE = 20
+
+
+def hot_queries():
+    """[(name, query, index it should use)] for a prolific user and the newest page of scribs"""
+
+    user_id = (db.session.query(Scrib.user_id).group_by(Scrib.user_id)
+               .order_by(db.func.count(Scrib.id).desc()).limit(1).scalar())
+    newest = Scrib.query.order_by(Scrib.date_time.desc(), Scrib.id.desc())
+    page = newest.limit(PAGE_SIZE).all()
+    last = page[-1]
+    # the second page of a keyset paginated list, see pagination.py
+    older = (Scrib.date_time <= last.date_time, or_(Scrib.date_time < last.date_time, Scrib.id < last.id))
+
+    return [
+        ("newest scribs", newest.limit(PAGE_SIZE), "ix_scribs_date_time_id"),
+        ("next page of scribs", newest.filter(*older).limit(PAGE_SIZE), "ix_scribs_date_time_id"),
+        ("scribs by author",
+         Scrib.query.filter(Scrib.user_id == user_id).order_by(Scrib.date_time.desc(), Scrib.id.desc())
+         .limit(PAGE_SIZE),
+         "ix_scribs_user_id_date_time_id"),
+        ("concept images of a page of scribs",
+         ConceptImage.query.filter(ConceptImage.scrib_id.in_([scrib.id for scrib in page])),
+         "ix_concept_images_scrib_id"),
+        ("newest users with scrib counts",
+         User.query.options(undefer(User.scrib_count)).order_by(User.date_time.desc(), User.id.desc())
+         .limit(PAGE_SIZE),
+         "ix_users_date_time_id"),
+        ("scrib count of a user",
+         db.session.query(User.scrib_count).filter(User.id == user_id),
+         "ix_scribs_user_id_date_time_id"),
+        ("username typeahead",
+         username_prefix_query(User.query.get(user_id).username[:2]).limit(PAGE_SIZE),
+         "ix_users_username_lower"),
+    ]
+
+
+def compile_sql(query):
+    return str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+
+
+def postgres_indexes(plan):
+    """names of the indexes used anywhere in a FORMAT JSON plan"""
+
+    found = set()
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            found.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+def explain(sql):
+    """(printable plan, set of index names it uses), None on databases it can't EXPLAIN"""
+
+    if db.engine.dialect.name == "postgresql":
+        plan = db.session.execute(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        return json.dumps(root, indent=2), postgres_indexes(root)
+
+    if db.engine.dialect.name == "sqlite":
+        rows = db.session.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        details = [row[-1] for row in rows]
+        found = {word for detail in details for word in detail.split() if word.startswith("ix_")}
+        return "\n".join(details), found
+
+    return None
+
+
+def analyze():
+    """refresh planner statistics, freshly loaded tables have none"""
+
+    if db.engine.dialect.name == "postgresql":
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute("ANALYZE")
+    else:
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generate", action="store_true", help="reset the database and seed it first")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--scribs", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.generate:
+        from generate_data import generate
+        generate(args.users, args.scribs, reset=True)
+
+    analyze()
+    failures = []
+    for name, query, index in hot_queries():
+        explained = explain(compile_sql(query))
+        if explained is None:
+            print(f"skip {name}: no EXPLAIN support for {db.engine.dialect.name}")
+            continue
+        plan, used = explained
+        ok = index in used
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: expects {index}, uses {', '.join(sorted(used)) or 'no index'}")
+        print("     " + plan.replace("\n", "\n     "))
+        if not ok:
+            failures.append(name)
+
+    if failures:
+        print(f"{len(failures)} queries don't use their index: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    with create_app(migrations=True).app_context():
+        sys.exit(main())
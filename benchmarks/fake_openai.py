@@ -0,0 +1,138 @@
+"""Local stand-in for the OpenAI endpoints Scribcraft uses, for benchmarks.
+
+Serves POST images/generations and completions (plain and streamed) with a configurable
+latency and error rate, plus the generated images themselves so the S3 upload path has
+something real to download and resize.
+
+    server = FakeOpenAI(latency=2.0, error_rate=0.05).start()
+    os.environ["OPEN_AI_API_BASE_URL"] = server.base_url
+"""
+import io
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image
+
+STORY_PARAGRAPHS = [
+    "The main character is a restless cartographer who maps places that do not exist yet.",
+    "Her rival, a retired admiral, wants the maps burned before anyone can follow them.",
+    "It begins when a map she drew the night before turns out to be accurate.",
+    "The chase builds across three continents and a city that appears only at low tide.",
+    "In the end she hands the last map to the admiral, who finally understands why it was drawn.",
+]
+
+
+def make_png(seed, size=512):
+    """A noisy gradient PNG of about the size OpenAI returns, different for every seed"""
+
+    rng = random.Random(seed)
+    image = Image.effect_noise((size, size), 30).convert("RGB")
+    tint = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    Image.blend(image, tint, 0.6).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeOpenAI:
+    def __init__(self, host="127.0.0.1", port=0, latency=1.0, error_rate=0.0, images=8):
+        """latency: seconds per call (a streamed completion spreads it over its chunks),
+        error_rate: share of calls answered 503 with a Retry-After
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.images = [make_png(seed) for seed in range(images)]
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body, headers=()):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                # /images/<n>.png
+                try:
+                    data = fake.images[int(self.path.rsplit("/", 1)[-1].split(".")[0]) % len(fake.images)]
+                except ValueError:
+                    return self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                endpoint = self.path.split("/v1/", 1)[-1]
+                fake.count(endpoint)
+
+                if random.random() < fake.error_rate:
+                    time.sleep(fake.latency / 10)
+                    return self.send_json(503, {"error": {"message": "The server is overloaded", "type": "server_error"}},
+                                          headers=[("Retry-After", "0.5")])
+
+                if endpoint == "images/generations":
+                    time.sleep(fake.latency)
+                    host, port = fake.server.server_address
+                    first = random.randrange(len(fake.images))
+                    return self.send_json(200, {"data": [{"url": f"http://{host}:{port}/images/{first + n}.png"}
+                                                         for n in range(body.get("n", 1))]})
+
+                if endpoint == "completions" and body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for paragraph in STORY_PARAGRAPHS:
+                        time.sleep(fake.latency / len(STORY_PARAGRAPHS))
+                        chunk = {"choices": [{"text": paragraph + "\n\n"}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.close_connection = True
+                    return
+
+                if endpoint == "completions":
+                    time.sleep(fake.latency)
+                    return self.send_json(200, {"choices": [{"text": "\n\n".join(STORY_PARAGRAPHS)}]})
+
+                self.send_json(404, {"error": {"message": f"Unknown endpoint {endpoint}",
+                                               "type": "invalid_request_error"}})
+
+        return Handler
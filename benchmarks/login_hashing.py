@@ -0,0 +1,75 @@
+"""Micro-benchmark: bcrypt logins per second per core at different cost factors.
+
+Measures the password check a login performs (flask_bcrypt.check_password_hash), on one
+thread and on PASSWORD_HASH_WORKERS threads through the same PasswordHashPool the app uses,
+and prints one json object per cost factor. Pick BCRYPT_LOG_ROUNDS so logins/sec per core
+covers the expected login peak with headroom.
+
+    python benchmarks/login_hashing.py --rounds 10 11 12 13 --seconds 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from flask_bcrypt import Bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from password_hashing import PasswordHashPool  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def checks_per_second(check, pw_hash, seconds, threads):
+    """Run check(pw_hash, PASSWORD) from threads threads for seconds, returns checks/sec"""
+
+    deadline = time.monotonic() + seconds
+
+    def worker():
+        count = 0
+        while time.monotonic() < deadline:
+            check(pw_hash, PASSWORD)
+            count += 1
+        return count
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(lambda _: worker(), range(threads)))
+    return total / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    for log_rounds in args.rounds:
+        app = Flask(__name__)
+        app.config["BCRYPT_LOG_ROUNDS"] = log_rounds
+        app.config["PASSWORD_HASH_WORKERS"] = args.workers
+        app.config["PASSWORD_HASH_MAX_QUEUE"] = args.workers
+        bcrypt = Bcrypt(app)
+        pool = PasswordHashPool(app)
+        pw_hash = bcrypt.generate_password_hash(PASSWORD)
+
+        single = checks_per_second(bcrypt.check_password_hash, pw_hash, args.seconds, threads=1)
+        pooled = checks_per_second(lambda pw_hash, password: pool.run(bcrypt.check_password_hash, pw_hash, password),
+                                   pw_hash, args.seconds, threads=args.workers)
+
+        print(json.dumps({
+            "log_rounds": log_rounds,
+            "ms_per_login": round(1000 / single, 1),
+            "logins_per_sec_per_core": round(single, 2),
+            "workers": args.workers,
+            "logins_per_sec_pooled": round(pooled, 2),
+            "scaling_efficiency": round(pooled / (single * args.workers), 2)
+        }))
+
+
+if __name__ == "__main__":
+    main()
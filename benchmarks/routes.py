@@ -0,0 +1,257 @@
+"""Benchmark the Flask routes end to end and write the results as json.
+
+Runs the real app on a local threaded server against a freshly seeded database (see
+generate_data.py), with fake_openai.py standing in for OpenAI and moto's server for S3, then
+drives each route at a fixed concurrency over keep-alive HTTP connections. For every route it
+reports throughput, p50/p95/p99 latency, status codes and SQL queries per request (from the
+app's X-SQL-Queries header), so two result files can be diffed between commits.
+
+    python benchmarks/routes.py --users 1000 --scribs 10000 --concurrency 8 --output results.json
+
+Needs the moto[server] package. DATABASE_URL defaults to a throwaway SQLite file, point it at
+a scratch Postgres database to benchmark what production runs (it is reset!).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_openai import FakeOpenAI  # noqa: E402
+
+ROUTES = ["/", "/api/scribs", "/api/users", "/scribs/<id>", "/users/<id>", "/login", "/create-scrib"]
+
+
+def percentile(sorted_values, p):
+    """nearest rank percentile of an already sorted list"""
+
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    """samples: [(seconds, status, sql_queries or None)]"""
+
+    latencies = sorted(seconds * 1000 for seconds, status, count in samples)
+    queries = [count for seconds, status, count in samples if count is not None]
+    status_codes = {}
+    for seconds, status, count in samples:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+    return {
+        "requests": len(samples),
+        # 4xx too, a shed (429) request would otherwise pass for a fast one
+        "errors": sum(1 for seconds, status, count in samples if status >= 400 or status == 0),
+        "status_codes": status_codes,
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2)
+        },
+        "sql_queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "max": max(queries) if queries else None
+        }
+    }
+
+
+class Driver:
+    """Issues requests for one route from a pool of logged in clients, one per worker thread"""
+
+    def __init__(self, base_url, usernames, password, id_ranges):
+        self.base_url = base_url
+        self.usernames = usernames
+        self.password = password
+        self.id_ranges = id_ranges
+        self.local = threading.local()
+
+    def client(self):
+        """keep-alive session for this thread, logged in as its own user"""
+
+        if getattr(self.local, "session", None) is None:
+            session = requests.Session()
+            self.local.username = random.choice(self.usernames)
+            session.post(f"{self.base_url}/login", data={"username": self.local.username, "password": self.password},
+                         allow_redirects=False)
+            self.local.session = session
+        return self.local.session
+
+    def request(self, route):
+        session = self.client()
+        started = time.perf_counter()
+
+        if route == "/login":
+            # a logged out login, so every request pays for the password check
+            anonymous = requests.Session()
+            res = anonymous.post(f"{self.base_url}/login", data={"username": self.local.username,
+                                                                 "password": self.password}, allow_redirects=False)
+            anonymous.close()
+        elif route == "/create-scrib":
+            # unique prompts so the generation cache can't answer for OpenAI
+            token = uuid.uuid4().hex
+            res = session.post(f"{self.base_url}/create-scrib", data={
+                "title": f"Benchmark {token}", "prompt": f"A cartographer maps {token}"}, allow_redirects=False)
+        elif route == "/scribs/<id>":
+            res = session.get(f"{self.base_url}/scribs/{random.randint(*self.id_ranges['scribs'])}")
+        elif route == "/users/<id>":
+            res = session.get(f"{self.base_url}/users/{random.randint(*self.id_ranges['users'])}")
+        else:
+            res = session.get(f"{self.base_url}{route}")
+
+        elapsed = time.perf_counter() - started
+        queries = res.headers.get("X-SQL-Queries")
+        return elapsed, res.status_code, int(queries) if queries is not None else None
+
+    def run(self, route, count, concurrency):
+        """count requests at concurrency, returns (samples, elapsed seconds)"""
+
+        def safe_request(_):
+            try:
+                return self.request(route)
+            except requests.RequestException:
+                return 0, 0, None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(safe_request, range(count)))
+        return samples, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--scribs", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--create-requests", type=int, default=20, help="measured requests for /create-scrib")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route first")
+    parser.add_argument("--routes", nargs="+", default=ROUTES, choices=ROUTES)
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="seconds per fake OpenAI call")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--response-cache", default="memory", choices=["memory", "null"],
+                        help="null measures every request rendered from the db")
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="scribcraft-bench-")
+    openai = FakeOpenAI(latency=args.openai_latency, error_rate=args.openai_error_rate).start()
+
+    from moto.server import ThreadedMotoServer
+    s3_port = free_port()
+    s3 = ThreadedMotoServer(ip_address="127.0.0.1", port=s3_port)
+    s3.start()
+
+    # the app reads its configuration at import time
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.update({
+        "SECRET_KEY": "benchmark",
+        "OPEN_AI_API_BASE_URL": openai.base_url,
+        "OPEN_AI_API_KEY": "benchmark",
+        "S3_ENDPOINT_URL": f"http://127.0.0.1:{s3_port}",
+        "ACCESS_KEY": "benchmark",
+        "SECRET_ACCESS_KEY_AWS": "benchmark",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        # /create-scrib latency covers the whole generation pipeline
+        "JOB_QUEUE_BACKEND": "inline",
+        # the benchmark measures the generation pipeline, not the per-user quotas: a handful of
+        # users sends every create, they'd get 429s past their burst
+        "ADMISSION_USER_BURST": str(10 ** 6),
+        "BCRYPT_LOG_ROUNDS": str(args.bcrypt_rounds),
+        "RESPONSE_CACHE_BACKEND": args.response_cache
+    })
+
+    from werkzeug.serving import make_server
+    from app import create_app, s3_uploader
+    from generate_data import generate, GENERATED_PASSWORD
+    from models import db, User
+
+    # the production profile, generate() needs the migrations to stamp the fresh schema
+    app = create_app("prod", migrations=True)
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["SQL_QUERY_COUNT_HEADER"] = True
+    # every client logs in from the same ip
+    app.config["LOGIN_MAX_FAILURES_PER_IP"] = sys.maxsize
+    s3_uploader.get_client().create_bucket(Bucket=app.config["S3_BUCKET_NAME"])
+
+    with app.app_context():
+        id_ranges = generate(args.users, args.scribs, reset=True)
+        usernames = [username for (username,) in
+                     db.session.query(User.username).filter(User.id <= id_ranges["users"][0] + 99)]
+        db.session.remove()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    driver = Driver(f"http://127.0.0.1:{server.server_port}", usernames, GENERATED_PASSWORD, id_ranges)
+
+    results = {}
+    for route in args.routes:
+        count = args.create_requests if route == "/create-scrib" else args.requests
+        warmup = min(args.warmup, count)
+        driver.run(route, warmup, args.concurrency)
+        samples, elapsed = driver.run(route, count, args.concurrency)
+        results[route] = summarize(samples, elapsed)
+        print(f"{route:15} {results[route]['throughput_rps']:>8} req/s  p50 {results[route]['latency_ms']['p50']:>9} ms  "
+              f"p99 {results[route]['latency_ms']['p99']:>9} ms  sql {results[route]['sql_queries_per_request']['mean']}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "database": db.engine.dialect.name,
+            "users": args.users,
+            "scribs": args.scribs,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "openai_latency": args.openai_latency,
+            "openai_error_rate": args.openai_error_rate,
+            "openai_calls": openai.calls,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "response_cache": args.response_cache
+        },
+        "routes": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+
+    server.shutdown()
+    s3.stop()
+    openai.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark cold start: importing the app, building it and serving the first request.
+
+Every run is a fresh python process, so nothing is cached in memory between runs (the OS page
+cache still is, like on a warm host). Each run reports how long `import app` took, how long
+create_app() took for the profile and how long the first request (GET /login, no db needed)
+took, and which of the heavy optional modules had been imported by then. Prints the median and
+min of every measure per profile as json, and writes them to --output if given.
+
+    python benchmarks/startup.py --runs 10 --profiles prod dev
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that should only be imported once they are used
+HEAVY_MODULES = ["boto3", "aiohttp", "requests", "PIL", "alembic", "flask_debugtoolbar", "pkg_resources"]
+
+CHILD = """
+import sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(sys.argv[1])
+created = time.perf_counter()
+status = flask_app.test_client().get("/login").status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - started) * 1000,
+    "status": status,
+    "heavy_modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def run_once(profile):
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("DATABASE_URL", "sqlite://")
+    output = subprocess.run([sys.executable, "-c", CHILD, profile] + HEAVY_MODULES, cwd=ROOT, env=env,
+                            check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def summarize(runs):
+    summary = {}
+    for measure in ("import_ms", "create_app_ms", "first_request_ms", "total_ms"):
+        values = [run[measure] for run in runs]
+        summary[measure] = {"median": round(statistics.median(values), 1), "min": round(min(values), 1)}
+    summary["statuses"] = sorted({run["status"] for run in runs})
+    summary["heavy_modules"] = sorted({name for run in runs for name in run["heavy_modules"]})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--profiles", nargs="+", default=["prod", "dev"])
+    parser.add_argument("--output", help="write the results to this json file")
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profiles:
+        # one discarded run so every measured one finds the files in the page cache
+        run_once(profile)
+        results[profile] = summarize([run_once(profile) for _ in range(args.runs)])
+        print(json.dumps({"profile": profile, **results[profile]}))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""gzip/brotli response compression, negotiated from the request's Accept-Encoding.
+
+Text responses (html, json, css, js...) of at least COMPRESS_MIN_SIZE bytes are compressed
+with the best coding the client accepts: brotli when the brotli package is installed, gzip
+otherwise. Smaller bodies aren't worth the CPU and header overhead. Streamed responses
+(stream_array exports, static files) are compressed chunk by chunk as they are sent, so they
+are never buffered whole. Server-sent events are left alone, compressing them would hold
+back events until a compressed block fills up.
+
+Validators stay valid: add_validators() already stamps weak ETags for exactly this reason, and
+the strong ETags of static files are weakened on the responses that get compressed (and on
+their 304s), a strong ETag promises the same bytes whatever the encoding. Conditional requests
+compare weakly, so the uncompressed and compressed copies revalidate against each other.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"text/html", "text/css", "text/plain", "text/javascript", "application/javascript",
+                          "application/json", "image/svg+xml"}
+
+
+def weaken_etag(response):
+    """W/ in front of a strong ETag, the compressed body isn't byte for byte what it validated"""
+
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+
+class Compress:
+    """Small extension configured from app.config['COMPRESS_*']"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_ENABLED", True)
+        app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+        app.config.setdefault("COMPRESS_GZIP_LEVEL", 6)
+        # 4-5 is about gzip's speed at a noticeably better ratio, 11 is for precompressed assets only
+        app.config.setdefault("COMPRESS_BROTLI_QUALITY", 4)
+        app.config.setdefault("COMPRESS_MIMETYPES", COMPRESSIBLE_MIMETYPES)
+
+        self.enabled = app.config["COMPRESS_ENABLED"]
+        self.min_size = app.config["COMPRESS_MIN_SIZE"]
+        self.gzip_level = app.config["COMPRESS_GZIP_LEVEL"]
+        self.brotli_quality = app.config["COMPRESS_BROTLI_QUALITY"]
+        self.mimetypes = set(app.config["COMPRESS_MIMETYPES"])
+        # preferred first, the client's q-values decide between them
+        self.encodings = (["br"] if brotli is not None else []) + ["gzip"]
+
+        app.after_request(self.compress_response)
+        app.extensions["compress"] = self
+
+    def choose_encoding(self):
+        """Best coding the client accepts, None for identity"""
+
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = request.accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compressor(self, encoding):
+        """(compress(chunk) -> bytes, finish() -> bytes) for one response body"""
+
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.finish
+
+        # wbits 31: zlib deflate with a gzip header and trailer
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+
+    def compress_response(self, response):
+        if (not self.enabled or response.mimetype not in self.mimetypes
+                or response.status_code < 200 or response.status_code in (204, 206)
+                or "Content-Encoding" in response.headers):
+            return response
+
+        # caches must keep the encodings apart whether or not this one gets compressed
+        response.vary.add("Accept-Encoding")
+
+        if response.status_code == 304:
+            # carries the validator of the 200 it stands for, which would have been compressed
+            if self.choose_encoding() is not None:
+                weaken_etag(response)
+            return response
+
+        # unknown (None) for streamed bodies, which are big by design
+        length = response.content_length
+        if length is not None and length < self.min_size:
+            return response
+
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        weaken_etag(response)
+        compress, finish = self.compressor(encoding)
+        if response.is_streamed or response.direct_passthrough:
+            body = response.response
+
+            def compressed_chunks():
+                try:
+                    for chunk in body:
+                        data = compress(chunk.encode(response.charset) if isinstance(chunk, str) else chunk)
+                        if data:
+                            yield data
+                    yield finish()
+                finally:
+                    if hasattr(body, "close"):
+                        body.close()
+
+            response.response = compressed_chunks()
+            response.direct_passthrough = False
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compress(response.get_data()) + finish())
+
+        response.headers["Content-Encoding"] = encoding
+        return response
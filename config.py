@@ -0,0 +1,129 @@
+"""Configuration of the app, read from the environment, and the profiles create_app() builds it with.
+
+Every setting comes from an environment variable (or .env) as before. The profile then adjusts
+what differs between where the app runs, profile settings win over the environment:
+
+- "dev": debug mode and the debug toolbar
+- "test": inline jobs, cheap password hashes and no CSRF tokens so tests can drive the forms
+- "prod": neither the toolbar nor its imports, what gunicorn serves
+
+APP_PROFILE picks the profile when create_app() isn't given one, "prod" by default.
+"""
+import os
+
+PROFILES = {
+    "dev": {
+        "DEBUG": True,
+        "DEBUG_TB_ENABLED": True,
+        "DEBUG_TB_INTERCEPT_REDIRECTS": False,
+    },
+    "test": {
+        "TESTING": True,
+        "DEBUG_TB_ENABLED": False,
+        "WTF_CSRF_ENABLED": False,
+        "JOB_QUEUE_BACKEND": "inline",
+        "BCRYPT_LOG_ROUNDS": 4,
+    },
+    "prod": {
+        "DEBUG": False,
+        "DEBUG_TB_ENABLED": False,
+    },
+}
+
+
+def load_config(app, profile):
+    """Sets app.config from the environment, then from the profile"""
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown app profile: {profile}")
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgresql:///scribcraft-1'))
+    # read only routes read from this copy of the database when it's set
+    if os.environ.get('DATABASE_REPLICA_URL'):
+        app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['DATABASE_REPLICA_URL']}
+    # connections per engine and process: every request thread and job worker holds one while it queries,
+    # unset keeps SQLAlchemy's defaults (5 + 10 overflow)
+    for key in ('SQLALCHEMY_POOL_SIZE', 'SQLALCHEMY_MAX_OVERFLOW', 'SQLALCHEMY_POOL_TIMEOUT'):
+        if os.environ.get(key):
+            app.config[key] = int(os.environ[key])
+    # retire connections before a proxy/firewall drops them for being idle
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = int(os.environ.get('SQLALCHEMY_POOL_RECYCLE', 1800))
+    app.config['SQLALCHEMY_POOL_PRE_PING'] = os.environ.get('SQLALCHEMY_POOL_PRE_PING', '1') != '0'
+    # reads of a client who just wrote stay on the primary this long, longer than the replica lags
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    # "thread" runs generation jobs on a local worker pool, "inline" runs them on the request thread (tests)
+    app.config['JOB_QUEUE_BACKEND'] = os.environ.get('JOB_QUEUE_BACKEND', 'thread')
+    app.config['JOB_QUEUE_WORKERS'] = int(os.environ.get('JOB_QUEUE_WORKERS', 4))
+    app.config['S3_BUCKET_NAME'] = os.environ.get('S3_BUCKET_NAME', 'scribcraft.concept')
+    app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+    # every running job uploads its 3 images at once
+    app.config['S3_UPLOAD_WORKERS'] = int(os.environ.get('S3_UPLOAD_WORKERS', 3 * app.config['JOB_QUEUE_WORKERS']))
+    # concept art deletes run on their own workers, not the generation jobs'
+    if os.environ.get('S3_CLEANUP_WORKERS'):
+        app.config['S3_CLEANUP_WORKERS'] = int(os.environ['S3_CLEANUP_WORKERS'])
+    # generations of one /api/scribs/batch request running at once (clients may ask for fewer), all
+    # jobs of the process together are still capped by JOB_QUEUE_WORKERS and OPENAI_MAX_IN_FLIGHT
+    app.config['GENERATION_BATCH_CONCURRENCY'] = int(os.environ.get('GENERATION_BATCH_CONCURRENCY', 4))
+    app.config['GENERATION_BATCH_MAX_ITEMS'] = int(os.environ.get('GENERATION_BATCH_MAX_ITEMS', 50))
+    # generation slots/queue and per-user quotas, "sqlite" shares them between the processes using ADMISSION_PATH
+    app.config['ADMISSION_BACKEND'] = os.environ.get('ADMISSION_BACKEND', 'memory')
+    if os.environ.get('ADMISSION_PATH'):
+        app.config['ADMISSION_PATH'] = os.environ['ADMISSION_PATH']
+    app.config['ADMISSION_MAX_IN_FLIGHT'] = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 8))
+    app.config['ADMISSION_MAX_QUEUED'] = int(os.environ.get('ADMISSION_MAX_QUEUED', 16))
+    # generations admitted but not finished, waiting for a job worker included, past it creates get a 503
+    if os.environ.get('ADMISSION_MAX_PENDING'):
+        app.config['ADMISSION_MAX_PENDING'] = int(os.environ['ADMISSION_MAX_PENDING'])
+    # a user can start this many generations at once, then one more every ADMISSION_USER_REFILL_SECONDS
+    app.config['ADMISSION_USER_BURST'] = int(os.environ.get('ADMISSION_USER_BURST', 5))
+    app.config['ADMISSION_USER_REFILL_SECONDS'] = float(os.environ.get('ADMISSION_USER_REFILL_SECONDS', 60))
+    # seconds after which an unfinished generation job is taken for dead (its process died) and failed
+    if os.environ.get('GENERATION_JOB_TIMEOUT'):
+        app.config['GENERATION_JOB_TIMEOUT'] = int(os.environ['GENERATION_JOB_TIMEOUT'])
+    # "memory" (per process LRU, invalidated across the host's workers), "redis" (shared by every host,
+    # the default once RESPONSE_CACHE_URL or REDIS_URL is set) or "null" to disable
+    cache_url = os.environ.get('RESPONSE_CACHE_URL') or os.environ.get('REDIS_URL')
+    app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'redis' if cache_url else 'memory')
+    app.config['RESPONSE_CACHE_URL'] = cache_url or 'redis://localhost:6379/0'
+    # how long a memory backend entry may outlive an invalidation made on another host
+    if os.environ.get('RESPONSE_CACHE_TTL'):
+        app.config['RESPONSE_CACHE_TTL'] = int(os.environ['RESPONSE_CACHE_TTL'])
+    if os.environ.get('RESPONSE_CACHE_VERSIONS_PATH'):
+        app.config['RESPONSE_CACHE_VERSIONS_PATH'] = os.environ['RESPONSE_CACHE_VERSIONS_PATH']
+    # what OpenAI results may be reused for a repeated prompt: "text", "text_and_images" or "bypass"
+    app.config['GENERATION_CACHE_POLICY'] = os.environ.get('GENERATION_CACHE_POLICY', 'text')
+    app.config['OPENAI_API_KEY'] = os.environ.get('OPEN_AI_API_KEY')
+    app.config['OPENAI_API_BASE_URL'] = os.environ.get(
+        'OPEN_AI_API_BASE_URL', "https://api.openai.com/v1/")
+    # cap on concurrent OpenAI requests from this process, across all jobs
+    app.config['OPENAI_MAX_IN_FLIGHT'] = int(os.environ.get('OPENAI_MAX_IN_FLIGHT', 16))
+    # stream the story to the job page over SSE while it is generated
+    app.config['SCRIB_STREAMING'] = os.environ.get('SCRIB_STREAMING', '1') != '0'
+    # SSE streams one process serves at once, each holds a server thread, past it job pages poll
+    app.config['SSE_MAX_STREAMS'] = int(os.environ.get('SSE_MAX_STREAMS', 4))
+    # bcrypt cost, existing hashes are upgraded/downgraded as their users log in
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # concurrent bcrypt hashes per process, more than the number of cores only adds latency
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    # proxies in front of the app whose X-Forwarded-For/-Proto are trusted, the Heroku router (DYNO is
+    # set there) by default. request.remote_addr is then the client's address, which the login throttle counts
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 1 if 'DYNO' in os.environ else 0))
+    # bearer token required to scrape /metrics, unset leaves it open
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    # log requests slower than this many seconds with a per phase breakdown
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get(
+        'SLOW_REQUEST_SECONDS') else None
+    # max SQL statements per request, set in tests to catch N+1 regressions
+    app.config['SQL_QUERY_BUDGET'] = int(os.environ['SQL_QUERY_BUDGET']) if os.environ.get(
+        'SQL_QUERY_BUDGET') else None
+    # "orjson", "stdlib" or "auto" (orjson when installed)
+    app.config['JSON_ENCODER'] = os.environ.get('JSON_ENCODER', 'auto')
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+
+    app.config.update(PROFILES[profile])
+    app.config['APP_PROFILE'] = profile
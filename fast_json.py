@@ -0,0 +1,103 @@
+"""Fast JSON encoding for the api: orjson when it is installed, the stdlib json module otherwise.
+
+JSON_ENCODER picks "orjson", "stdlib" or "auto" (orjson if importable). Both write the same
+bytes, what Flask's jsonify writes once decoded: compact, sorted keys, datetimes as http dates
+(the api's "timestamp" format). Non-ASCII text is written as UTF-8 rather than \\u escapes,
+orjson can't escape it.
+
+stream_array() writes a document holding one big array row by row, so exporting a large
+collection only ever holds a batch of rows, never the whole payload, in memory.
+"""
+import json
+import uuid
+from datetime import date, datetime
+
+from flask import current_app, stream_with_context
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# stream_array() hands the server chunks of about this size rather than one per row
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _default(value):
+    """Types neither encoder handles the way the api always returned them (same as Flask's JSONEncoder)"""
+
+    if isinstance(value, datetime):
+        return http_date(value.utctimetuple())
+    if isinstance(value, date):
+        return http_date(value.timetuple())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, default=_default, separators=(",", ":"), sort_keys=True, ensure_ascii=False).encode()
+
+
+def orjson_dumps(obj):
+    # datetimes go through _default so they keep the http date format instead of orjson's RFC 3339
+    return orjson.dumps(obj, default=_default,
+                        option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class FastJSON:
+    """Small extension configured from app.config['JSON_ENCODER']"""
+
+    def __init__(self, app=None):
+        self.dumps = stdlib_dumps
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JSON_ENCODER", "auto")
+
+        encoder = app.config["JSON_ENCODER"]
+        if encoder == "auto":
+            encoder = "orjson" if orjson is not None else "stdlib"
+        if encoder == "orjson" and orjson is None:
+            raise RuntimeError("JSON_ENCODER='orjson' needs the orjson package installed")
+        if encoder not in ("orjson", "stdlib"):
+            raise ValueError(f"Unknown JSON encoder: {encoder}")
+
+        self.encoder = encoder
+        self.dumps = orjson_dumps if encoder == "orjson" else stdlib_dumps
+        app.extensions["fast_json"] = self
+
+    def response(self, *args, status=200, **kwargs):
+        """Drop in for jsonify(): response(obj) or response(key=value, ...)"""
+
+        return current_app.response_class(self.dumps(args[0] if args else kwargs), status=status,
+                                          mimetype="application/json")
+
+    def stream_array(self, key, rows, serialize, **fields):
+        """Streamed response of {**fields, key: [serialize(row) for row in rows]}. rows may be
+        any iterable (a generator paging through the db), it is consumed while the body is sent.
+        """
+
+        dumps = self.dumps
+
+        def generate():
+            # the fields, then the array as the last member of the same object
+            head = dumps(fields)[:-1]
+            buffer = bytearray(head + (b"," if fields else b"") + dumps(key) + b":[")
+            first = True
+            for row in rows:
+                if not first:
+                    buffer += b","
+                buffer += dumps(serialize(row))
+                first = False
+                if len(buffer) >= STREAM_CHUNK_BYTES:
+                    yield bytes(buffer)
+                    buffer.clear()
+            buffer += b"]}"
+            yield bytes(buffer)
+
+        return current_app.response_class(stream_with_context(generate()), mimetype="application/json")
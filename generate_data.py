@@ -0,0 +1,240 @@
+"""Bulk load synthetic users, scribs and concept images to scale-test the app.
+
+    python generate_data.py --users 100000 --scribs 1000000 --images-per-scrib 3
+
+Rows are generated in batches and written with one COPY per batch on Postgres (executemany
+elsewhere) instead of going through the ORM, with explicit ids so concept images can point at
+their scribs without reading anything back. The scribs search index is dropped for the load
+and built once at the end, indexing row by row is slower than generating the rows. Faker is only used to build pools of names and
+paragraphs up front, every row is then assembled from those pools, which keeps generation
+from being the bottleneck.
+
+Every generated user's password is GENERATED_PASSWORD. Rows are added to whatever is in the
+database already, pass --reset to drop and recreate the tables first.
+"""
+import io
+import csv
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from faker import Faker
+from flask_migrate import stamp
+
+from app import create_app, db
+from models import bcrypt, User, Scrib, ConceptImage
+from image_derivatives import DERIVATIVE_WIDTHS, DERIVATIVE_FORMATS
+from search import drop_search_index, rebuild_search_index
+
+GENERATED_PASSWORD = "password123"
+PARAGRAPH_POOL_SIZE = 5000
+WORD_POOL_SIZE = 5000
+# generated scrib_text is 750 tokens at most, real ones are 2-4k characters
+SCRIB_TEXT_CHARS = (1500, 4000)
+IMAGE_BASE_URL = "https://s3.amazonaws.com/scribcraft.concept/concept/"
+
+fake = Faker()
+
+
+class Pools:
+    """Faker output generated once and sampled from for every row"""
+
+    def __init__(self, seed):
+        fake.seed(seed)
+        random.seed(seed)
+        self.paragraphs = [fake.paragraph(nb_sentences=6) for _ in range(PARAGRAPH_POOL_SIZE)]
+        self.words = list({word for _ in range(WORD_POOL_SIZE // 10) for word in fake.words(nb=20)})
+        self.user_names = [fake.user_name()[:12] for _ in range(WORD_POOL_SIZE)]
+        self.email_domains = [fake.free_email_domain() for _ in range(50)]
+        self.avatars = ([f"https://randomuser.me/api/portraits/women/{n}.jpg" for n in range(100)] +
+                        [f"https://randomuser.me/api/portraits/men/{n}.jpg" for n in range(100)] +
+                        [User.image_url.default.arg])
+
+    def scrib_text(self):
+        length = random.randint(*SCRIB_TEXT_CHARS)
+        paragraphs = []
+        while length > 0:
+            paragraph = random.choice(self.paragraphs)
+            paragraphs.append(paragraph)
+            length -= len(paragraph)
+        return "\n\n".join(paragraphs)
+
+    def sentence(self, words):
+        return " ".join(random.sample(self.words, words)).capitalize()
+
+
+def user_rows(pools, first_id, count, password, started, span):
+    for user_id in range(first_id, first_id + count):
+        name = random.choice(pools.user_names)
+        joined = started + span * (user_id - first_id) / count
+        # the id keeps username (max 20 chars) and email unique
+        yield {
+            "id": user_id,
+            "username": f"{name}{user_id}"[-20:],
+            "email": f"{name}{user_id}@{random.choice(pools.email_domains)}",
+            "image_url": random.choice(pools.avatars),
+            "date_time": joined,
+            "updated_at": joined,
+            "about_me": random.choice(pools.paragraphs)[:300],
+            "password": password
+        }
+
+
+def scrib_rows(pools, first_id, count, first_user_id, user_count, started, span):
+    for scrib_id in range(first_id, first_id + count):
+        # a few prolific users write most scribs, like on the real site
+        user_id = first_user_id + int(user_count * random.random() ** 3)
+        yield {
+            "id": scrib_id,
+            "title": f"{pools.sentence(random.randint(2, 5))} {scrib_id}",
+            "prompt": pools.sentence(random.randint(12, 30)) + ".",
+            "scrib_text": pools.scrib_text(),
+            "date_time": started + span * (scrib_id - first_id) / count + timedelta(seconds=random.randint(0, 60)),
+            "user_id": user_id
+        }
+
+
+def concept_image_rows(first_id, first_scrib_id, scrib_count, images_per_scrib):
+    image_id = first_id
+    for scrib_id in range(first_scrib_id, first_scrib_id + scrib_count):
+        for _ in range(images_per_scrib):
+            digest = "%064x" % random.getrandbits(256)
+            variants = [{"url": f"{IMAGE_BASE_URL}{digest}/{width}w.{extension}", "width": width, "format": image_format}
+                        for width in DERIVATIVE_WIDTHS
+                        for image_format, (encoder, content_type, extension, options) in DERIVATIVE_FORMATS.items()]
+            yield {
+                "id": image_id,
+                "concept_image_url": f"{IMAGE_BASE_URL}{digest}/original.png",
+                "variants": json.dumps(variants),
+                "scrib_id": scrib_id
+            }
+            image_id += 1
+
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_batch(connection, table, batch):
+    """One COPY ... FROM STDIN for the whole batch, ~10x faster than executemany on Postgres"""
+
+    columns = list(batch[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([value.isoformat() if isinstance(value, datetime) else value
+                         for value in (row[column] for column in columns)])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load(table, rows, batch_size):
+    """Writes rows to table in batches of batch_size, each in its own transaction. Returns the row count"""
+
+    use_copy = db.engine.dialect.name == "postgresql"
+    started = time.monotonic()
+    total = 0
+
+    for batch in batches(rows, batch_size):
+        with db.engine.begin() as connection:
+            if use_copy:
+                copy_batch(connection, table, batch)
+            else:
+                connection.execute(table.insert(), batch)
+        total += len(batch)
+        elapsed = time.monotonic() - started
+        print(f"\r{table.name}: {total:,} rows, {total / elapsed:,.0f} rows/s", end="", flush=True)
+
+    print()
+    return total
+
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def reset_sequences():
+    """COPY/executemany with explicit ids leave Postgres' serial sequences behind"""
+
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in (User.__table__, Scrib.__table__, ConceptImage.__table__):
+        db.session.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE(MAX(id), 1)) FROM {table.name}")
+    db.session.commit()
+
+
+def generate(users, scribs, images_per_scrib=3, batch_size=10000, days=365, seed=0, reset=False,
+             keep_search_index=False):
+    """Loads the synthetic dataset, returns the id ranges generated ({"users": (first, last), ...})"""
+
+    if reset:
+        db.drop_all()
+        db.create_all()
+        stamp()
+
+    started = time.monotonic()
+    pools = Pools(seed)
+    password = bcrypt.generate_password_hash(GENERATED_PASSWORD).decode('UTF-8')
+    span = timedelta(days=days)
+    since = datetime.utcnow() - span
+
+    first_user_id = next_id(User)
+    first_scrib_id = next_id(Scrib)
+    first_image_id = next_id(ConceptImage)
+    if not keep_search_index:
+        drop_search_index()
+    db.session.remove()
+
+    load(User.__table__, user_rows(pools, first_user_id, users, password, since, span), batch_size)
+    if users:
+        load(Scrib.__table__, scrib_rows(pools, first_scrib_id, scribs, first_user_id, users, since, span),
+             batch_size)
+        load(ConceptImage.__table__, concept_image_rows(first_image_id, first_scrib_id, scribs,
+                                                        images_per_scrib), batch_size)
+    reset_sequences()
+
+    if not keep_search_index:
+        index_started = time.monotonic()
+        rebuild_search_index()
+        print(f"search index rebuilt in {time.monotonic() - index_started:.1f}s")
+
+    print(f"done in {time.monotonic() - started:.1f}s, every user's password is {GENERATED_PASSWORD!r}")
+    return {
+        "users": (first_user_id, first_user_id + users - 1),
+        "scribs": (first_scrib_id, first_scrib_id + (scribs if users else 0) - 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--scribs", type=int, default=100000)
+    parser.add_argument("--images-per-scrib", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=365, help="spread creation dates over this many days")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    parser.add_argument("--keep-search-index", action="store_true",
+                        help="index scribs as they are inserted instead of rebuilding the index afterwards")
+    args = parser.parse_args()
+
+    generate(args.users, args.scribs, images_per_scrib=args.images_per_scrib, batch_size=args.batch_size,
+             days=args.days, seed=args.seed, reset=args.reset, keep_search_index=args.keep_search_index)
+
+
+if __name__ == "__main__":
+    with create_app(migrations=True).app_context():
+        main()
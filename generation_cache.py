@@ -0,0 +1,136 @@
+"""Content addressed memoization of OpenAI generation results.
+
+A result is keyed by a hash of (kind, base prompt, normalized user prompt, model and request
+params), so resubmitting the same prompt (after a duplicate title error, a failed upload...)
+reuses the earlier result instead of paying for another generation.
+
+GENERATION_CACHE_POLICY decides what may be reused:
+    "text":            reuse generated scrib text only (default)
+    "text_and_images": also reuse concept art urls, only while OpenAI still serves them
+    "bypass":          always call OpenAI, store nothing
+"""
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from metrics import counter
+from models import db, GenerationCacheEntry
+
+logger = logging.getLogger(__name__)
+
+TEXT = "text"
+IMAGES = "images"
+
+generation_cache_lookups_total = counter(
+    "scribcraft_generation_cache_lookups_total", "Generation cache lookups", ["kind", "outcome"])
+
+POLICY_KINDS = {
+    "bypass": set(),
+    "text": {TEXT},
+    "text_and_images": {TEXT, IMAGES}
+}
+
+
+def normalize_prompt(prompt):
+    """Prompts that only differ in case or whitespace generate the same thing"""
+
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+
+def generation_key(kind, base_prompt, prompt, params):
+    """sha256 over everything that determines the generated result"""
+
+    material = json.dumps({
+        "kind": kind,
+        "base_prompt": base_prompt,
+        "prompt": normalize_prompt(prompt),
+        "params": params
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class GenerationCache:
+    """Small extension configured from app.config['GENERATION_CACHE_*']"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("GENERATION_CACHE_POLICY", "text")
+        app.config.setdefault("GENERATION_CACHE_MAX_ENTRIES", 10000)
+        # seconds, None keeps text until it is evicted for space
+        app.config.setdefault("GENERATION_CACHE_TEXT_TTL", None)
+        # image urls from OpenAI expire after an hour, stop handing them out well before that
+        app.config.setdefault("GENERATION_CACHE_IMAGES_TTL", 45 * 60)
+
+        policy = app.config["GENERATION_CACHE_POLICY"]
+        if policy not in POLICY_KINDS:
+            raise ValueError(f"Unknown generation cache policy: {policy}")
+
+        self.cached_kinds = POLICY_KINDS[policy]
+        self.max_entries = app.config["GENERATION_CACHE_MAX_ENTRIES"]
+        self.ttls = {TEXT: app.config["GENERATION_CACHE_TEXT_TTL"],
+                     IMAGES: app.config["GENERATION_CACHE_IMAGES_TTL"]}
+        app.extensions["generation_cache"] = self
+
+    def get(self, kind, key):
+        """Returns the memoized result for key, or None on a miss (or when policy doesn't reuse kind)"""
+
+        if kind not in self.cached_kinds:
+            return None
+
+        now = datetime.utcnow()
+        entry = GenerationCacheEntry.query.get(key)
+        if entry is None or (entry.expires_at is not None and entry.expires_at.replace(tzinfo=None) <= now):
+            generation_cache_lookups_total.inc(kind=kind, outcome="miss")
+            return None
+
+        entry.hits += 1
+        entry.last_hit_at = now
+        db.session.commit()
+
+        generation_cache_lookups_total.inc(kind=kind, outcome="hit")
+        logger.info("Generation cache hit for %s %s", kind, key[:12])
+        return json.loads(entry.payload)
+
+    def set(self, kind, key, result):
+        """Memoize result (json serializable) under key, then evict expired/least recently used entries"""
+
+        if kind not in self.cached_kinds:
+            return
+
+        now = datetime.utcnow()
+        ttl = self.ttls[kind]
+        db.session.merge(GenerationCacheEntry(key=key, kind=kind, payload=json.dumps(result), created_at=now,
+                                              last_hit_at=now, hits=0,
+                                              expires_at=now + timedelta(seconds=ttl) if ttl else None))
+        db.session.commit()
+        self.evict()
+
+    def evict(self):
+        """Delete expired entries, then the least recently used ones beyond GENERATION_CACHE_MAX_ENTRIES"""
+
+        GenerationCacheEntry.query.filter(
+            GenerationCacheEntry.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+
+        overflow = GenerationCacheEntry.query.count() - self.max_entries
+        if overflow > 0:
+            oldest = (db.session.query(GenerationCacheEntry.key)
+                      .order_by(GenerationCacheEntry.last_hit_at)
+                      .limit(overflow)
+                      .subquery())
+            GenerationCacheEntry.query.filter(GenerationCacheEntry.key.in_(
+                oldest)).delete(synchronize_session=False)
+
+        db.session.commit()
+
+    def stats(self):
+        """hit/miss counters per kind, the same values /metrics exports"""
+
+        return {
+            "hits": {kind: generation_cache_lookups_total.get(kind=kind, outcome="hit") for kind in (TEXT, IMAGES)},
+            "misses": {kind: generation_cache_lookups_total.get(kind=kind, outcome="miss") for kind in (TEXT, IMAGES)}
+        }
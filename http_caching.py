@@ -0,0 +1,119 @@
+"""HTTP caching helpers: validators (ETag/Last-Modified) for scrib resources and long lived,
+content hashed urls for static files.
+
+Scribs never change once created, so a scrib page is identified by the scrib, its author's
+profile (username/avatar are shown) and whoever is looking at it. Collections are identified
+by the response cache's "scribs" and "users" tag versions, which every write route bumps, and
+the max ids of scribs, users and concept images, primary key lookups that also catch rows added
+outside the app (bulk loads). No table is scanned, a 304 costs about as much as a cache hit.
+"""
+import os
+import time
+import hashlib
+
+from flask import current_app, request, session, g
+from sqlalchemy import select, func
+
+from models import db, User, Scrib, ConceptImage
+
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def make_etag(*parts):
+    """Hash of all parts, short enough for a header"""
+
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def collection_version():
+    """Version of the scribs and users collections, changes on any create/edit/delete"""
+
+    row = db.session.execute(select([
+        select([func.max(Scrib.id)]).as_scalar(),
+        select([func.max(User.id)]).as_scalar(),
+        # concept art is attached to a scrib after the scrib row is committed
+        select([func.max(ConceptImage.id)]).as_scalar()
+    ])).first()
+
+    response_cache = current_app.extensions["response_cache"]
+    versions = response_cache.versions(["scribs", "users"])
+    # invalidations made on another host reach the memory backend's entries within its TTL, expire with them
+    epoch = int(time.time() // response_cache.ttl) if response_cache.backend_name == "memory" else None
+    return make_etag(*row, *versions.values(), epoch)
+
+
+def viewer_etag_part():
+    """Pages embed the logged in user (sidebar, owner only buttons) so they are part of the validator"""
+
+    return tuple(g.user) if g.user else None
+
+
+def not_modified(etag, last_modified=None):
+    """Returns True when the client's cached copy identified by etag/last_modified is still good.
+    Pages with pending flash messages are never considered fresh.
+    """
+
+    if "_flashes" in session:
+        return False
+
+    # when both are sent If-None-Match wins (RFC 7232 section 6)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(tzinfo=None, microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+
+    return False
+
+
+def add_validators(response, etag, last_modified=None):
+    """Stamp validators on a response. Weak etags since the body may be re-encoded (compressed) on the way out"""
+
+    if "_flashes" in session:
+        return response
+
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def not_modified_response(etag, last_modified=None):
+    """Empty 304 carrying the same validators"""
+
+    response = current_app.response_class(status=304)
+    return add_validators(response, etag, last_modified)
+
+
+def init_static_versioning(app):
+    """Add ?v=<content hash> to every url_for('static') and let browsers cache those urls for a year"""
+
+    hashes = {}
+
+    def static_hash(filename):
+        path = os.path.join(app.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = hashes.get(filename)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as f:
+                cached = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+            hashes[filename] = cached
+        return cached[1]
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = static_hash(values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def cache_versioned_static(response):
+        if request.endpoint == "static" and "v" in request.args and response.status_code == 200:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        return response
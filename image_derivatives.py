@@ -0,0 +1,74 @@
+"""Resized, compressed copies of generated concept art for responsive <img srcset>.
+
+OpenAI hands back 512x512 PNGs of ~0.5MB, while most places show them much smaller. At upload
+time every image is re-encoded as WebP and JPEG at each of DERIVATIVE_WIDTHS (never upscaled),
+and every file is stored under a key derived from the sha256 of the original, so re-uploading the
+same image (retries, memoized prompts) overwrites identical objects instead of piling up copies.
+"""
+import io
+import hashlib
+from collections import namedtuple
+
+DERIVATIVE_WIDTHS = (128, 256, 512)
+
+# format -> (Pillow encoder, content type, file extension, encoder options)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", {"quality": 82, "optimize": True, "progressive": True})
+}
+
+Derivative = namedtuple(
+    "Derivative", ["key", "width", "format", "content_type", "data"])
+
+
+def content_hash(data):
+    """sha256 hex digest of the original image bytes"""
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def original_key(digest):
+    return f"concept/{digest}/original.png"
+
+
+def derivative_key(digest, width, image_format):
+    extension = DERIVATIVE_FORMATS[image_format][2]
+    return f"concept/{digest}/{width}w.{extension}"
+
+
+def image_group(key):
+    """Objects that are kept/removed together: "concept/<digest>/" for an original and its
+    derivatives, the key itself for images stored before content hash keys (scrib_<id>_<n>)
+    """
+
+    if key.startswith("concept/"):
+        return key.rsplit("/", 1)[0] + "/"
+    return key
+
+
+def make_derivatives(data, widths=DERIVATIVE_WIDTHS):
+    """Returns a Derivative for every width x format of the image in data (bytes)"""
+
+    # imported here so processes that never upload images don't load Pillow
+    from PIL import Image
+
+    digest = content_hash(data)
+    with Image.open(io.BytesIO(data)) as original:
+        # neither format takes an alpha channel the way we want it, concept art is opaque anyway
+        original = original.convert("RGB")
+
+        derivatives = []
+        for width in sorted(set(min(width, original.width) for width in widths)):
+            height = round(original.height * width / original.width)
+            resized = original if width == original.width else original.resize(
+                (width, height), Image.LANCZOS)
+
+            for image_format, (encoder, content_type, extension, options) in DERIVATIVE_FORMATS.items():
+                out = io.BytesIO()
+                resized.save(out, encoder, **options)
+                derivatives.append(Derivative(key=derivative_key(digest, width, image_format), width=width,
+                                              format=image_format, content_type=content_type,
+                                              data=out.getvalue()))
+
+    return derivatives
+
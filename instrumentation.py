@@ -0,0 +1,114 @@
+"""Always-on request instrumentation and the Prometheus /metrics endpoint.
+
+Every request records its latency per endpoint, how many SQL statements it ran and how long
+they took (counted by query_counter's engine events), and the time spent in named phases.
+Phases are measured with phase("name"), template rendering is measured from Flask's
+template signals. With SLOW_REQUEST_SECONDS set, slower requests are logged with that
+per-phase breakdown.
+
+OpenAI and S3 call metrics are recorded where the calls are made (openai_client.py,
+s3_uploads.py), /metrics exposes everything registered in metrics.py.
+"""
+import time
+import hmac
+import logging
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, before_render_template, template_rendered, Response
+
+from metrics import histogram, render_prometheus
+
+logger = logging.getLogger(__name__)
+
+SQL_QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+http_request_seconds = histogram(
+    "scribcraft_http_request_seconds", "Latency of http requests", ["method", "endpoint", "status"])
+request_sql_queries = histogram(
+    "scribcraft_request_sql_queries", "SQL statements issued per request", ["endpoint"], buckets=SQL_QUERY_BUCKETS)
+request_sql_seconds = histogram(
+    "scribcraft_request_sql_seconds", "Time spent in SQL per request", ["endpoint"])
+
+
+@contextmanager
+def phase(name):
+    """Adds the with block's duration to the current request's phase name (no-op outside requests)"""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            phases = g.setdefault("request_phases", {})
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - started
+
+
+def _start_render(app, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _end_render(app, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        phases = g.setdefault("request_phases", {})
+        phases["render"] = phases.get("render", 0.0) + time.perf_counter() - started
+
+
+def init_instrumentation(app):
+    """Record request metrics, log slow requests and serve METRICS_PATH"""
+
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.config.setdefault("METRICS_PATH", "/metrics")
+    # when set, scrapes must send "Authorization: Bearer <token>"
+    app.config.setdefault("METRICS_TOKEN", None)
+    # seconds, None disables the slow request log
+    app.config.setdefault("SLOW_REQUEST_SECONDS", None)
+
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+
+        duration = time.perf_counter() - started
+        # the endpoint name, not the path, keeps the number of label values bounded
+        endpoint = request.endpoint or "unmatched"
+        sql_count = g.get("sql_query_count", 0)
+        sql_seconds = g.get("sql_query_seconds", 0.0)
+
+        http_request_seconds.observe(duration, method=request.method, endpoint=endpoint,
+                                     status=str(response.status_code))
+        request_sql_queries.observe(sql_count, endpoint=endpoint)
+        request_sql_seconds.observe(sql_seconds, endpoint=endpoint)
+
+        slow_after = app.config["SLOW_REQUEST_SECONDS"]
+        if slow_after is not None and duration >= slow_after:
+            phases = dict(g.get("request_phases", {}), sql=sql_seconds)
+            other = duration - sum(phases.values())
+            breakdown = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in
+                                  sorted(phases.items(), key=lambda item: -item[1]))
+            logger.warning("Slow request %s %s -> %s in %.0fms (%s queries): %s, other %.0fms",
+                           request.method, request.full_path.rstrip("?"), response.status_code, duration * 1000,
+                           sql_count, breakdown, other * 1000)
+
+        return response
+
+    def metrics():
+        token = app.config["METRICS_TOKEN"]
+        if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return Response("Unauthorized\n", 401, mimetype="text/plain")
+
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4",
+                        headers={"Cache-Control": "no-store"})
+
+    app.add_url_rule(app.config["METRICS_PATH"], "metrics", metrics)
@@ -0,0 +1,82 @@
+"""Fails generation jobs that will never finish.
+
+Jobs run on the job queue of the process that accepted them, nothing survives that process. When
+it dies (a deploy, a crash, the OOM killer) its queued and running jobs would stay unfinished in
+the db forever, and keep the admission places admit() reserved for them until
+ADMISSION_PENDING_LEASE runs out. A job still unfinished GENERATION_JOB_TIMEOUT seconds after it
+was created is taken for dead: reap() marks it failed and gives its admission place back. A job
+that was only slow and finishes after all records its outcome over the failure.
+
+The job pages and apis reap the stale jobs they show. Run reap() periodically from cron or the
+platform's scheduler for the jobs nobody looks at:
+
+    FLASK_APP=app.py flask reap-stale-jobs
+"""
+import logging
+from datetime import datetime, timedelta
+
+import click
+
+from models import db, GenerationJob
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED = (GenerationJob.QUEUED, GenerationJob.RUNNING)
+REAPED_MESSAGE = "Generating this scrib took too long and was abandoned. Please try again."
+
+
+class JobReaper:
+    """Small extension configured from app.config['GENERATION_JOB_TIMEOUT'], works with the app's
+    admission extension
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # seconds, a live job is done by then: its admission place only lasts as long
+        app.config.setdefault("GENERATION_JOB_TIMEOUT", app.config.get("ADMISSION_PENDING_LEASE", 900))
+
+        self.app = app
+        self.timeout = app.config["GENERATION_JOB_TIMEOUT"]
+        app.extensions["job_reaper"] = self
+
+        @app.cli.command("reap-stale-jobs")
+        def reap_command():
+            """Fail the generation jobs a dead process left unfinished"""
+
+            click.echo(f"{len(self.reap())} stale jobs failed")
+
+    def cutoff(self):
+        return datetime.utcnow() - timedelta(seconds=self.timeout)
+
+    def is_stale(self, job):
+        return not job.is_finished and job.created_at < self.cutoff()
+
+    def reap(self, *criteria):
+        """Fails the unfinished jobs (matching criteria, if any) created more than
+        GENERATION_JOB_TIMEOUT ago and gives back their admission places. Returns their ids.
+        """
+
+        stale = (db.session.query(GenerationJob.id, GenerationJob.admission_ticket)
+                 .filter(GenerationJob.status.in_(UNFINISHED), GenerationJob.created_at < self.cutoff(), *criteria)
+                 .all())
+        if not stale:
+            return []
+
+        job_ids = [job_id for job_id, ticket in stale]
+        # a job finishing meanwhile keeps its outcome
+        (GenerationJob.query
+         .filter(GenerationJob.id.in_(job_ids), GenerationJob.status.in_(UNFINISHED))
+         .update({"status": GenerationJob.FAILED, "error_message": REAPED_MESSAGE,
+                  "finished_at": datetime.utcnow(), "partial_text": None}, synchronize_session=False))
+        db.session.commit()
+
+        admission = self.app.extensions["admission"]
+        for job_id, ticket in stale:
+            if ticket is not None:
+                admission.finish(ticket)
+        logger.warning("Failed %s stale generation jobs: %s", len(job_ids), job_ids)
+        return job_ids
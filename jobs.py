@@ -0,0 +1,125 @@
+"""Background job queue for Scribcraft.
+
+Long running work (talking to OpenAI, uploading to S3) is handed to a JobQueue
+so request threads can return right away. The queue runs each job inside an app
+context so jobs can use the db session like a normal view would.
+"""
+import logging
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import has_app_context
+
+logger = logging.getLogger(__name__)
+
+
+class InlineJobBackend:
+    """Runs jobs synchronously on the calling thread. Meant for tests/local debugging"""
+
+    def submit(self, fn):
+        fn()
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ThreadPoolJobBackend:
+    """Runs jobs on a fixed size pool of worker threads local to this process"""
+
+    def __init__(self, max_workers, thread_name_prefix="scribcraft-job"):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    def submit(self, fn):
+        return self.executor.submit(fn)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+JOB_BACKENDS = {
+    "inline": lambda queue, app: InlineJobBackend(),
+    "thread": lambda queue, app: ThreadPoolJobBackend(app.config[queue.workers_key],
+                                                      f"scribcraft-{queue.name.replace('_', '-')}")
+}
+
+
+class JobQueue:
+    """Small extension wrapping a job backend selected by app.config['JOB_QUEUE_BACKEND'].
+
+    The app's queue is app.extensions["job_queue"] with JOB_QUEUE_WORKERS workers. Work that
+    mustn't take those workers from the generation jobs gets its own queue, named after it and
+    sized by another workers_key.
+    """
+
+    def __init__(self, app=None, name="job_queue", workers_key="JOB_QUEUE_WORKERS"):
+        self.app = None
+        self.backend = None
+        self.name = name
+        self.workers_key = workers_key
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JOB_QUEUE_BACKEND", "thread")
+        app.config.setdefault(self.workers_key, 4)
+
+        backend_name = app.config["JOB_QUEUE_BACKEND"]
+        if backend_name not in JOB_BACKENDS:
+            raise ValueError(f"Unknown job queue backend: {backend_name}")
+
+        self.app = app
+        self.backend = JOB_BACKENDS[backend_name](self, app)
+        app.extensions[self.name] = self
+
+    def enqueue(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) to run in the background inside an app context"""
+
+        app = self.app
+
+        def run():
+            try:
+                # inline jobs already run inside the request's app context, pushing a
+                # second one would tear down (and detach) the request's db session
+                if has_app_context():
+                    fn(*args, **kwargs)
+                else:
+                    with app.app_context():
+                        fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Background job %s failed", fn.__name__)
+
+        return self.backend.submit(run)
+
+    def enqueue_many(self, fn, arg_lists, concurrency):
+        """Schedule fn(*args) for every args in arg_lists, at most concurrency of them at a time:
+        each call queues the next one when it finishes. The backend's worker count still caps
+        everything running in this process.
+        """
+
+        pending = deque(arg_lists)
+        lock = threading.Lock()
+
+        def start_next():
+            with lock:
+                if not pending:
+                    return
+                args = pending.popleft()
+
+            @functools.wraps(fn)
+            def run_then_next():
+                try:
+                    fn(*args)
+                finally:
+                    start_next()
+
+            self.enqueue(run_then_next)
+
+        for _ in range(min(concurrency, len(pending))):
+            start_next()
+
+    def shutdown(self, wait=True):
+        if self.backend is not None:
+            self.backend.shutdown(wait=wait)
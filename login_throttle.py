@@ -0,0 +1,92 @@
+"""Throttle for failed logins, checked before any bcrypt work is done.
+
+Failures are counted per username and per client ip in fixed windows of
+LOGIN_FAILURE_WINDOW seconds. Once either count reaches its limit, further attempts for that
+username/ip are refused with a Retry-After until the window ends, so guessing passwords (or
+stuffing credentials from one address) costs us no hashing. Counts are kept per process.
+The ip is request.remote_addr, behind a router or load balancer set TRUSTED_PROXIES so it is
+the client's address rather than the proxy's, which every client would share.
+"""
+import time
+import threading
+
+
+class LoginThrottle:
+    """Small extension configured from app.config['LOGIN_*']"""
+
+    def __init__(self, app=None):
+        # (kind, key) -> [window start, failures]
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LOGIN_MAX_FAILURES_PER_USERNAME", 5)
+        app.config.setdefault("LOGIN_MAX_FAILURES_PER_IP", 20)
+        app.config.setdefault("LOGIN_FAILURE_WINDOW", 15 * 60)
+        # bounds memory under a spray of made up usernames
+        app.config.setdefault("LOGIN_THROTTLE_MAX_ENTRIES", 100000)
+
+        self.limits = {"username": app.config["LOGIN_MAX_FAILURES_PER_USERNAME"],
+                       "ip": app.config["LOGIN_MAX_FAILURES_PER_IP"]}
+        self.window = app.config["LOGIN_FAILURE_WINDOW"]
+        self.max_entries = app.config["LOGIN_THROTTLE_MAX_ENTRIES"]
+        app.extensions["login_throttle"] = self
+
+    def _keys(self, username, ip):
+        return [("username", username.casefold()), ("ip", ip)]
+
+    def retry_after(self, username, ip):
+        """Seconds until username/ip may try again, or None if the attempt is allowed"""
+
+        now = time.monotonic()
+        waits = []
+        with self.lock:
+            for kind, key in self._keys(username, ip):
+                entry = self.failures.get((kind, key))
+                if entry is not None and entry[0] + self.window > now and entry[1] >= self.limits[kind]:
+                    waits.append(entry[0] + self.window - now)
+
+            if waits:
+                self.rejected += 1
+                return max(1, int(max(waits)))
+        return None
+
+    def record_failure(self, username, ip):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.failures) >= self.max_entries:
+                self._prune(now)
+
+            for kind, key in self._keys(username, ip):
+                entry = self.failures.get((kind, key))
+                if entry is None or entry[0] + self.window <= now:
+                    self.failures[(kind, key)] = [now, 1]
+                else:
+                    entry[1] += 1
+
+    def reset(self, username):
+        """Forget a username's failures after it logged in, the ip keeps its count"""
+
+        with self.lock:
+            self.failures.pop(("username", username.casefold()), None)
+
+    def _prune(self, now):
+        for key in [key for key, (window_start, failures) in self.failures.items()
+                    if window_start + self.window <= now]:
+            del self.failures[key]
+        # still full of live entries: drop the oldest windows
+        if len(self.failures) >= self.max_entries:
+            oldest = sorted(self.failures, key=lambda key: self.failures[key][0])
+            for key in oldest[:len(oldest) // 2]:
+                del self.failures[key]
+
+    def stats(self):
+        """counters for monitoring"""
+
+        return {
+            "rejected": self.rejected,
+            "size": len(self.failures)
+        }
@@ -0,0 +1,121 @@
+"""Minimal in-process metrics: labelled counters and histograms.
+
+Metrics are created once at import time with counter()/histogram() and are safe to update
+from any thread. render_prometheus() formats all of them in the Prometheus text format. Values
+are per process, with several gunicorn workers every scrape sees the worker that served it.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+# seconds, tuned for anything from a db query to a slow OpenAI generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REGISTRY = []
+
+
+class Counter:
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels.get(label, "") for label in self.labelnames), 0)
+
+
+class Histogram:
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count], sum
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labelnames)
+        with self.lock:
+            bucket_counts, total = self.values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[index] += 1
+            bucket_counts[-1] += 1
+            self.values[key] = (bucket_counts, total + value)
+
+    def count(self, **labels):
+        key = tuple(labels.get(label, "") for label in self.labelnames)
+        entry = self.values.get(key)
+        return entry[0][-1] if entry else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """observe how long the with block took, in seconds"""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+def counter(name, description, labelnames=()):
+    metric = Counter(name, description, labelnames)
+    REGISTRY.append(metric)
+    return metric
+
+
+def histogram(name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, description, labelnames, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render_prometheus(registry=None):
+    """Every metric in registry (default: all of them) in the Prometheus text exposition format"""
+
+    lines = []
+    for metric in (REGISTRY if registry is None else registry):
+        with metric.lock:
+            values = {key: (list(value[0]), value[1]) if isinstance(value, tuple) else value
+                      for key, value in metric.values.items()}
+
+        if isinstance(metric, Counter):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} counter")
+            for key, value in sorted(values.items()):
+                lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {value}")
+
+        elif isinstance(metric, Histogram):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} histogram")
+            for key, (bucket_counts, total) in sorted(values.items()):
+                # bucket counts are cumulative already
+                for bound, count in zip(metric.buckets + ("+Inf",), bucket_counts):
+                    lines.append(f"{metric.name}_bucket"
+                                 f"{_format_labels(metric.labelnames, key, [('le', bound)])} {count}")
+                lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, key)} {total}")
+                lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, key)} {bucket_counts[-1]}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+"""baseline schema, the users, scribs and concept_images tables of the original app
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 16:53:17.866697
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('username', sa.String(length=20), nullable=False),
+    sa.Column('email', sa.String(length=100), nullable=False),
+    sa.Column('image_url', sa.String(length=150), nullable=True),
+    sa.Column('date_time', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('about_me', sa.Text(), nullable=True),
+    sa.Column('password', sa.String(length=150), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('scribs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('title', sa.Text(), nullable=False),
+    sa.Column('prompt', sa.Text(), nullable=False),
+    sa.Column('scrib_text', sa.Text(), nullable=False),
+    sa.Column('date_time', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('title')
+    )
+    op.create_table('concept_images',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('concept_image_url', sa.Text(), nullable=False),
+    sa.Column('scrib_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['scrib_id'], ['scribs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('concept_images')
+    op.drop_table('scribs')
+    op.drop_table('users')
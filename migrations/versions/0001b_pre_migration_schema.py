@@ -0,0 +1,128 @@
+"""schema the app gained before migrations: jobs, generation cache, image variants, search index
+
+Also users.updated_at for profile edit times.
+
+Databases built by db.create_all() before migrations may already have any part of it, so every
+table, column and index is only created when it's missing.
+
+Revision ID: 0001b_pre_migration_schema
+Revises: 0001_baseline
+Create Date: 2026-10-19 09:12:44.301877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001b_pre_migration_schema'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+POSTGRES_SEARCH_INDEX = """
+CREATE INDEX IF NOT EXISTS ix_scribs_search ON scribs USING GIN ((
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(prompt, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(scrib_text, '')), 'C')
+))
+"""
+
+SQLITE_SEARCH_INDEX = [
+    """
+CREATE VIRTUAL TABLE IF NOT EXISTS scribs_fts USING fts5(
+    title, prompt, scrib_text, content='scribs', content_rowid='id', tokenize='porter unicode61'
+)""",
+    """
+CREATE TRIGGER IF NOT EXISTS scribs_fts_insert AFTER INSERT ON scribs BEGIN
+    INSERT INTO scribs_fts(rowid, title, prompt, scrib_text)
+    VALUES (new.id, new.title, new.prompt, new.scrib_text);
+END""",
+    """
+CREATE TRIGGER IF NOT EXISTS scribs_fts_delete AFTER DELETE ON scribs BEGIN
+    INSERT INTO scribs_fts(scribs_fts, rowid, title, prompt, scrib_text)
+    VALUES ('delete', old.id, old.title, old.prompt, old.scrib_text);
+END""",
+    """
+CREATE TRIGGER IF NOT EXISTS scribs_fts_update AFTER UPDATE ON scribs BEGIN
+    INSERT INTO scribs_fts(scribs_fts, rowid, title, prompt, scrib_text)
+    VALUES ('delete', old.id, old.title, old.prompt, old.scrib_text);
+    INSERT INTO scribs_fts(rowid, title, prompt, scrib_text)
+    VALUES (new.id, new.title, new.prompt, new.scrib_text);
+END""",
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'updated_at' not in {column['name'] for column in inspector.get_columns('users')}:
+        op.add_column('users', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+        # nobody edited their profile since, as far as the http validators are concerned
+        op.execute('UPDATE users SET updated_at = date_time')
+
+    if 'variants' not in {column['name'] for column in inspector.get_columns('concept_images')}:
+        # existing images have no derivatives, the server default fills them in
+        op.add_column('concept_images', sa.Column('variants', sa.Text(), nullable=False, server_default='[]'))
+        if bind.dialect.name == 'postgresql':
+            op.alter_column('concept_images', 'variants', server_default=None)
+
+    if 'generation_jobs' not in tables:
+        op.create_table('generation_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.Text(), nullable=False),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('partial_text', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('scrib_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['scrib_id'], ['scribs.id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+    elif 'partial_text' not in {column['name'] for column in inspector.get_columns('generation_jobs')}:
+        op.add_column('generation_jobs', sa.Column('partial_text', sa.Text(), nullable=True))
+
+    if 'generation_cache' not in tables:
+        op.create_table('generation_cache',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_hit_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('hits', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+        )
+
+    if bind.dialect.name == 'postgresql':
+        op.execute(POSTGRES_SEARCH_INDEX)
+    elif bind.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_INDEX:
+            op.execute(statement)
+        # the triggers only index new rows, fill the index with the scribs already there
+        op.execute("INSERT INTO scribs_fts(scribs_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_scribs_search")
+    elif dialect == 'sqlite':
+        for trigger in ('scribs_fts_insert', 'scribs_fts_delete', 'scribs_fts_update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS scribs_fts")
+
+    op.drop_table('generation_cache')
+    op.drop_table('generation_jobs')
+    with op.batch_alter_table('concept_images') as batch_op:
+        batch_op.drop_column('variants')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,37 @@
+"""indexes for scribs by author, images by scrib and newest first listings
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001b_pre_migration_schema
+Create Date: 2026-10-18 17:02:41.118203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_path_indexes'
+down_revision = '0001b_pre_migration_schema'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_scribs_user_id', 'scribs', ['user_id']),
+    ('ix_scribs_date_time', 'scribs', ['date_time']),
+    ('ix_concept_images_scrib_id', 'concept_images', ['scrib_id']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # build without locking writes to tables that are already large, outside a transaction
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
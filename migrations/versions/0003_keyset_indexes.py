@@ -0,0 +1,50 @@
+"""(date_time, id) indexes for newest first keyset pagination
+
+Revision ID: 0003_keyset_indexes
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-18 17:31:05.402719
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_keyset_indexes'
+down_revision = '0002_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+# the new indexes lead with the columns of the ones they replace
+NEW_INDEXES = [
+    ('ix_scribs_date_time_id', 'scribs', ['date_time', 'id']),
+    ('ix_scribs_user_id_date_time_id', 'scribs', ['user_id', 'date_time', 'id']),
+    ('ix_users_date_time_id', 'users', ['date_time', 'id']),
+]
+
+REPLACED_INDEXES = [
+    ('ix_scribs_date_time', 'scribs', ['date_time']),
+    ('ix_scribs_user_id', 'scribs', ['user_id']),
+]
+
+
+def create_indexes(indexes):
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in indexes:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        for name, table, columns in indexes:
+            op.create_index(name, table, columns, unique=False)
+
+
+def upgrade():
+    # build the replacements first so the queries always have an index to use
+    create_indexes(NEW_INDEXES)
+    for name, table, columns in REPLACED_INDEXES:
+        op.drop_index(name, table_name=table)
+
+
+def downgrade():
+    create_indexes(REPLACED_INDEXES)
+    for name, table, columns in reversed(NEW_INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,30 @@
+"""case-insensitive index on usernames for the username typeahead
+
+Revision ID: 0004_username_prefix_index
+Revises: 0003_keyset_indexes
+Create Date: 2026-10-18 21:14:09.530412
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_username_prefix_index'
+down_revision = '0003_keyset_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # same DDL as search.py runs on db.create_all()
+    if op.get_bind().dialect.name == 'postgresql':
+        # build without locking signups out, outside a transaction
+        with op.get_context().autocommit_block():
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_lower '
+                       'ON users ((lower(username) COLLATE "C"))')
+    else:
+        op.execute('CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_users_username_lower')
@@ -0,0 +1,37 @@
+"""indexes on the generation_jobs foreign keys
+
+Revision ID: 0005_generation_job_fk_indexes
+Revises: 0004_username_prefix_index
+Create Date: 2026-10-18 23:02:47.118306
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_generation_job_fk_indexes'
+down_revision = '0004_username_prefix_index'
+branch_labels = None
+depends_on = None
+
+# deleting a user or scrib cascades to its jobs, without these it scans generation_jobs
+INDEXES = [
+    ('ix_generation_jobs_user_id', 'generation_jobs', ['user_id']),
+    ('ix_generation_jobs_scrib_id', 'generation_jobs', ['scrib_id']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # build without locking job inserts out, outside a transaction
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
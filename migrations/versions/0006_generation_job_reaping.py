@@ -0,0 +1,38 @@
+"""admission ticket of generation jobs and an index to find the unfinished ones by age
+
+Revision ID: 0006_generation_job_reaping
+Revises: 0005_generation_job_fk_indexes
+Create Date: 2026-10-18 23:41:12.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_generation_job_reaping'
+down_revision = '0005_generation_job_fk_indexes'
+branch_labels = None
+depends_on = None
+
+INDEX = ('ix_generation_jobs_status_created_at', 'generation_jobs', ['status', 'created_at'])
+
+
+def upgrade():
+    # nullable without a default, Postgres adds it without rewriting the table
+    op.add_column('generation_jobs', sa.Column('admission_ticket', sa.String(length=32), nullable=True))
+
+    name, table, columns = INDEX
+    if op.get_bind().dialect.name == 'postgresql':
+        # build without locking job inserts out, outside a transaction
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    name, table, columns = INDEX
+    op.drop_index(name, table_name=table)
+    with op.batch_alter_table('generation_jobs') as batch_op:
+        batch_op.drop_column('admission_ticket')
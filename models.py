@@ -1,12 +1,20 @@
 """SQLAlchemy models for Scribcraft"""
+import json
+import sqlite3
 from datetime import datetime
 
+from sqlalchemy import select, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import column_property
 from sqlalchemy.sql import func
+from flask import current_app
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+
+from password_hashing import password_hash_pool, hash_log_rounds, PasswordHashPoolFull
+from read_replica import RoutingSQLAlchemy
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 def connect_db(app):
@@ -14,6 +22,16 @@ def connect_db(app):
     db.app = app
     db.init_app(app)
 
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys, and with them ON DELETE CASCADE, unless every connection asks"""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 # CLASS MODELS
 
 
@@ -21,6 +39,8 @@ class User(db.Model):
     """User on the site"""
 
     __tablename__ = "users"
+    # the users list pages newest first on (date_time, id), see pagination.py
+    __table_args__ = (db.Index("ix_users_date_time_id", "date_time", "id"),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(20), nullable=False, unique=True)
@@ -29,33 +49,43 @@ class User(db.Model):
         db.String(150), default="/static/images/quill_and_ink.png")
     date_time = db.Column(db.DateTime(timezone=True),
                           default=datetime.utcnow)
+    # bumped on every profile edit, feeds http cache validators
+    updated_at = db.Column(db.DateTime(timezone=True),
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
     about_me = db.Column(
         db.Text, default="Edit profile to write bio!")
     password = db.Column(db.String(150), nullable=False)
+    # the database cascades deletes (ON DELETE CASCADE), the ORM doesn't load scribs just to delete them
     scribs = db.relationship(
-        'Scrib', backref="user", cascade='all, delete, delete-orphan', single_parent=True)
+        'Scrib', backref="user", cascade='all, delete, delete-orphan', single_parent=True, passive_deletes=True)
 
     def __repr__(self):
         """for debugging purposes return clear user string"""
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
-    def serialize_user(self):
-        """return dictionary representation of user object"""
+    # field name -> how to read it off a user, drives the ?fields= projection of the api
+    SERIALIZERS = {
+        "id": lambda user, scrib_fields: user.id,
+        "username": lambda user, scrib_fields: user.username,
+        "email": lambda user, scrib_fields: user.email,
+        "image_url": lambda user, scrib_fields: user.image_url,
+        "timestamp": lambda user, scrib_fields: user.date_time,
+        "bio": lambda user, scrib_fields: user.about_me,
+        "scribs": lambda user, scrib_fields: [scrib.serialize_scrib(scrib_fields) for scrib in user.scribs]
+    }
 
-        return {
-            "id": self.id,
-            "username": self.username,
-            "email": self.email,
-            "image_url": self.image_url,
-            "timestamp": self.date_time,
-            "bio": self.about_me,
-            "scribs": [scrib.serialize_scrib() for scrib in self.scribs]
-        }
+    def serialize_user(self, fields=None, scrib_fields=None):
+        """return dictionary representation of user object, limited to fields if given"""
+
+        return {field: self.SERIALIZERS[field](self, scrib_fields) for field in (fields or self.SERIALIZERS)}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
-        """Sign up user. Handles password hashing and db session adding logic"""
-        hashed_pw = bcrypt.generate_password_hash(password).decode('UTF-8')
+        """Sign up user. Handles password hashing and db session adding logic.
+        Raises PasswordHashPoolFull when too many hashes are already in progress.
+        """
+        hashed_pw = password_hash_pool.run(
+            bcrypt.generate_password_hash, password).decode('UTF-8')
 
         user = User(username=username, email=email,
                     password=hashed_pw, image_url=image_url)
@@ -65,16 +95,32 @@ class User(db.Model):
 
     @classmethod
     def authenticate(cls, username, password):
-        """find and authenticate user from db with given username and password, returns false is authentication fails"""
+        """find and authenticate user from db with given username and password, returns false is authentication fails.
+        Passwords hashed with another cost than BCRYPT_LOG_ROUNDS are rehashed on the way.
+        Raises PasswordHashPoolFull when too many hashes are already in progress.
+        """
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hash_pool.run(
+                bcrypt.check_password_hash, user.password, password)
             if is_auth:
+                if hash_log_rounds(user.password) != current_app.config['BCRYPT_LOG_ROUNDS']:
+                    user.rehash_password(password)
                 return user
 
         return False
 
+    def rehash_password(self, password):
+        """Store password hashed with the current cost. Best effort, the login goes on if the pool is busy"""
+
+        try:
+            self.password = password_hash_pool.run(
+                bcrypt.generate_password_hash, password).decode('UTF-8')
+        except PasswordHashPoolFull:
+            return
+        db.session.commit()
+
 
 class ConceptImage(db.Model):
     """Model for generated AI images to be stored"""
@@ -82,14 +128,30 @@ class ConceptImage(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     concept_image_url = db.Column(db.Text, nullable=False)
+    # json list of resized copies, [{"url", "width", "format"}, ...], empty for images stored before derivatives
+    variants = db.Column(db.Text, nullable=False, default="[]")
+    # every scrib page/serialization loads images by scrib
     scrib_id = db.Column(db.Integer, db.ForeignKey(
-        'scribs.id', ondelete='CASCADE'), nullable=False)
+        'scribs.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    def get_variants(self):
+        return json.loads(self.variants or "[]")
+
+    def srcset(self, image_format):
+        """srcset attribute value listing this image's variants in image_format ("webp"/"jpeg")"""
+
+        return ", ".join(f"{variant['url']} {variant['width']}w"
+                         for variant in sorted(self.get_variants(), key=lambda variant: variant["width"])
+                         if variant["format"] == image_format)
 
 
 class Scrib(db.Model):
     """Model for scribs generated from AI API"""
 
     __tablename__ = "scribs"
+    # listings page newest first on (date_time, id), profiles and scrib counts filter by author first
+    __table_args__ = (db.Index("ix_scribs_date_time_id", "date_time", "id"),
+                      db.Index("ix_scribs_user_id_date_time_id", "user_id", "date_time", "id"))
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.Text, nullable=False, unique=True)
@@ -98,21 +160,109 @@ class Scrib(db.Model):
     date_time = db.Column(db.DateTime(timezone=True),
                           default=datetime.utcnow)
     concept_images = db.relationship(
-        'ConceptImage', backref="scrib", cascade='all, delete, delete-orphan', single_parent=True)
+        'ConceptImage', backref="scrib", cascade='all, delete, delete-orphan', single_parent=True,
+        passive_deletes=True)
     user_id = db.Column(db.Integer, db.ForeignKey(
         'users.id', ondelete='CASCADE'), nullable=False)
 
-    def serialize_scrib(self):
-        """return dictionary representation of user object"""
+    # field name -> how to read it off a scrib, drives the ?fields= projection of the api
+    SERIALIZERS = {
+        "id": lambda scrib: scrib.id,
+        "title": lambda scrib: scrib.title,
+        "prompt": lambda scrib: scrib.prompt,
+        "scrib_text": lambda scrib: scrib.scrib_text,
+        "timestamp": lambda scrib: scrib.date_time,
+        "concept_images": lambda scrib: [concept_image.concept_image_url for concept_image in scrib.concept_images],
+        "concept_image_variants": lambda scrib: [concept_image.get_variants() for concept_image in scrib.concept_images],
+        "user_id": lambda scrib: scrib.user_id,
+        "user_username": lambda scrib: scrib.user.username,
+        "user_image_url": lambda scrib: scrib.user.image_url
+    }
+
+    def serialize_scrib(self, fields=None):
+        """return dictionary representation of scrib object, limited to fields if given"""
+
+        return {field: self.SERIALIZERS[field](self) for field in (fields or self.SERIALIZERS)}
+
+
+# number of scribs per user as a correlated subquery, undefer it when listing users instead of
+# loading every user's scribs just to count them
+User.scrib_count = column_property(
+    select([func.count(Scrib.id)]).where(
+        Scrib.user_id == User.id).correlate_except(Scrib).label("scrib_count"),
+    deferred=True)
+
+
+class GenerationJob(db.Model):
+    """Background job that generates a scrib (text + concept art) from a user's prompt"""
+
+    __tablename__ = "generation_jobs"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    title = db.Column(db.Text, nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    error_message = db.Column(db.Text)
+    # text streamed so far, flushed periodically while generating for readers in other processes
+    partial_text = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           default=datetime.utcnow)
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+    # indexed for the cascades when a user or scrib is deleted
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'users.id', ondelete='CASCADE'), nullable=False, index=True)
+    scrib_id = db.Column(db.Integer, db.ForeignKey(
+        'scribs.id', ondelete='SET NULL'), index=True)
+    # admission place held until the job finishes, job_reaper gives it back if the job's process dies
+    admission_ticket = db.Column(db.String(32))
+
+    # the reaper looks for unfinished jobs by age
+    __table_args__ = (db.Index("ix_generation_jobs_status_created_at", "status", "created_at"),)
+
+    def __repr__(self):
+        return f"<GenerationJob #{self.id}: {self.status}>"
+
+    @property
+    def is_finished(self):
+        """True once the job has either produced a scrib or failed"""
+        return self.status in (self.DONE, self.FAILED)
+
+    def serialize_job(self):
+        """return dictionary representation of job object"""
 
         return {
             "id": self.id,
             "title": self.title,
-            "prompt": self.prompt,
-            "scrib_text": self.scrib_text,
-            "timestamp": self.date_time,
-            "concept_images": [concept_image.concept_image_url for concept_image in self.concept_images],
-            "user_id": self.user_id,
-            "user_username": self.user.username,
-            "user_image_url": self.user.image_url
+            "status": self.status,
+            "error_message": self.error_message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "scrib_id": self.scrib_id
         }
+
+
+class GenerationCacheEntry(db.Model):
+    """Memoized OpenAI generation result, keyed by a hash of the prompts, model and params that produced it"""
+
+    __tablename__ = "generation_cache"
+
+    key = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    # json encoded result: the generated text, or the list of image urls
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime(timezone=True))
+    last_hit_at = db.Column(db.DateTime(timezone=True),
+                            default=datetime.utcnow)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<GenerationCacheEntry {self.kind} {self.key[:12]}: {self.hits} hits>"
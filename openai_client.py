@@ -0,0 +1,231 @@
+"""Process wide client for the OpenAI REST api.
+
+All OpenAI traffic goes through one long lived aiohttp session running on one event loop in a
+background thread, so TLS connections are kept alive and reused across scribs. Sync code
+submits coroutines with run()/submit(). On top of the session the client adds:
+
+    - a per attempt timeout and a total deadline per call (retries included)
+    - retries with full jitter exponential backoff on 429/5xx and connection errors,
+      honouring Retry-After
+    - a global cap on in-flight requests (OPENAI_MAX_IN_FLIGHT)
+    - latency histograms and error counters per endpoint
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+openai_request_seconds = histogram(
+    "scribcraft_openai_request_seconds", "Latency of OpenAI api calls, retries included", ["endpoint"])
+openai_attempts_total = counter(
+    "scribcraft_openai_attempts_total", "OpenAI api attempts by outcome", ["endpoint", "outcome"])
+openai_errors_total = counter(
+    "scribcraft_openai_errors_total", "OpenAI api calls that failed for good", ["endpoint"])
+
+
+class OpenAIError(Exception):
+    """OpenAI answered with an error, or the call ran out of attempts/time"""
+
+    def __init__(self, message, error_type=None, status=None):
+        super().__init__(message)
+        self.message = message
+        self.error_type = error_type
+        self.status = status
+
+
+class OpenAIClient:
+    """Small extension configured from app.config['OPENAI_*']"""
+
+    def __init__(self, app=None):
+        self.loop = None
+        self.session = None
+        self.semaphore = None
+        self.start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("OPENAI_API_BASE_URL", "https://api.openai.com/v1/")
+        app.config.setdefault("OPENAI_API_KEY", None)
+        app.config.setdefault("OPENAI_MAX_IN_FLIGHT", 16)
+        app.config.setdefault("OPENAI_CONNECT_TIMEOUT", 5)
+        # seconds for one attempt, image generation routinely takes 10-20s
+        app.config.setdefault("OPENAI_REQUEST_TIMEOUT", 60)
+        # seconds for a whole call, every retry included
+        app.config.setdefault("OPENAI_TOTAL_DEADLINE", 120)
+        app.config.setdefault("OPENAI_MAX_RETRIES", 3)
+
+        self.base_url = app.config["OPENAI_API_BASE_URL"]
+        self.api_key = app.config["OPENAI_API_KEY"]
+        self.max_in_flight = app.config["OPENAI_MAX_IN_FLIGHT"]
+        self.connect_timeout = app.config["OPENAI_CONNECT_TIMEOUT"]
+        self.request_timeout = app.config["OPENAI_REQUEST_TIMEOUT"]
+        self.total_deadline = app.config["OPENAI_TOTAL_DEADLINE"]
+        self.max_retries = app.config["OPENAI_MAX_RETRIES"]
+        app.extensions["openai_client"] = self
+
+    # event loop plumbing
+
+    def start(self):
+        """Starts the loop thread and the shared session, once per process"""
+
+        with self.start_lock:
+            if self.loop is not None:
+                return
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(self._open_session())
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run_loop, name="scribcraft-openai", daemon=True).start()
+            ready.wait()
+            self.loop = loop
+
+    async def _open_session(self):
+        # aiohttp is slow to import, it is loaded with the session instead of with the app
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, headers={
+            'Authorization': f"Bearer {self.api_key}",
+            'Content-Type': 'application/json'})
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    def submit(self, coro):
+        """Schedules coro on the client's loop, returns a concurrent.futures.Future"""
+
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Runs coro on the client's loop and blocks the calling thread for its result"""
+
+        return self.submit(coro).result(timeout or self.total_deadline)
+
+    # requests
+
+    def _backoff(self, attempt, retry_after=None):
+        """full jitter exponential backoff, or what the server asked for"""
+
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(2 ** attempt, 20))
+
+    async def _attempts(self, endpoint, payload, handle_response):
+        """Runs handle_response(res) for successive attempts until one succeeds, retrying what's retryable"""
+
+        import aiohttp
+
+        started = time.monotonic()
+        deadline = started + self.total_deadline
+        attempt = 0
+
+        try:
+            while True:
+                attempt += 1
+                remaining = deadline - time.monotonic()
+                timeout = aiohttp.ClientTimeout(
+                    total=min(self.request_timeout, remaining), connect=self.connect_timeout)
+                retry_after = None
+
+                try:
+                    async with self.semaphore:
+                        async with self.session.post(f"{self.base_url}{endpoint}", json=payload, timeout=timeout) as res:
+                            if res.status in RETRYABLE_STATUSES:
+                                retry_after = res.headers.get("Retry-After")
+                                error = OpenAIError(
+                                    f"OpenAI answered {res.status}", status=res.status)
+                            else:
+                                result = await handle_response(res)
+                                openai_attempts_total.inc(
+                                    endpoint=endpoint, outcome="ok")
+                                return result
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = OpenAIError(
+                        f"Could not reach OpenAI: {e.__class__.__name__} {e}")
+
+                openai_attempts_total.inc(endpoint=endpoint, outcome="retryable_error")
+                backoff = self._backoff(attempt, retry_after)
+                if attempt > self.max_retries or time.monotonic() + backoff >= deadline:
+                    raise error
+
+                logger.warning("Retrying OpenAI %s in %.1fs (attempt %s): %s",
+                               endpoint, backoff, attempt, error)
+                await asyncio.sleep(backoff)
+
+        except OpenAIError:
+            openai_errors_total.inc(endpoint=endpoint)
+            raise
+
+        finally:
+            openai_request_seconds.observe(
+                time.monotonic() - started, endpoint=endpoint)
+
+    async def post_json(self, endpoint, payload):
+        """POST payload to endpoint (eg. "completions"), returns the decoded json body.
+        Raises OpenAIError for api errors and exhausted retries.
+        """
+
+        async def read_json(res):
+            body = await res.json()
+            if "error" in body:
+                raise OpenAIError(body["error"].get("message"), body["error"].get("type"), res.status)
+            return body
+
+        return await self._attempts(endpoint, payload, read_json)
+
+    async def post_stream(self, endpoint, payload, on_event):
+        """POST a streaming request, on_event(data) is called with every decoded server-sent event.
+        Only attempts that fail before the first event are retried, so on_event never sees duplicates.
+        """
+
+        import aiohttp
+
+        async def read_events(res):
+            if res.status != 200:
+                body = await res.json()
+                error = body.get("error", {})
+                raise OpenAIError(error.get("message"), error.get("type"), res.status)
+
+            received = False
+            try:
+                # server-sent events, one "data: {json}" line per chunk and "data: [DONE]" at the end
+                async for line in res.content:
+                    line = line.decode('utf-8').strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    event = json.loads(data)
+                    if "error" in event:
+                        raise OpenAIError(event["error"].get("message"), event["error"].get("type"), res.status)
+                    received = True
+                    on_event(event)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not received:
+                    raise
+                # part of the text is already out, a retry would send it twice
+                raise OpenAIError(f"OpenAI stream broke off: {e.__class__.__name__} {e}")
+
+        return await self._attempts(endpoint, {**payload, "stream": True}, read_events)
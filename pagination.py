@@ -0,0 +1,52 @@
+"""Keyset pagination for the server rendered lists (dashboard, users, profile scribs).
+
+Lists are newest first on (date_time, id), the id breaks ties between rows created in the same
+instant so every row lands on exactly one page. The cursor of the next page is the (date_time,
+id) of the last row shown, packed into an opaque url safe string. A page is "the rows older than
+the cursor", which the (date_time, id) indexes answer without reading the rows before it, so
+page 1000 costs what page 1 does, unlike OFFSET.
+"""
+import json
+import base64
+from datetime import datetime
+
+from sqlalchemy import or_
+
+
+def encode_cursor(date_time, row_id):
+    raw = json.dumps([date_time.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(date_time, id) from encode_cursor(), None for no cursor. Raises ValueError for anything else"""
+
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_time, row_id = json.loads(raw)
+        return datetime.fromisoformat(date_time), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid page cursor") from e
+
+
+def newest_first_page(query, model, cursor, limit):
+    """One page of query over model (which has date_time and id columns), newest first, starting
+    after cursor (a decode_cursor() result or None). Returns (rows, cursor string of the next page or None)
+    """
+
+    if cursor is not None:
+        date_time, row_id = cursor
+        # the plain range on date_time is what lets the planner walk the index
+        query = query.filter(model.date_time <= date_time,
+                             or_(model.date_time < date_time, model.id < row_id))
+
+    # fetch one extra row to know whether there is a next page
+    rows = query.order_by(model.date_time.desc(), model.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.date_time, last.id)
@@ -0,0 +1,72 @@
+"""Bounded pool for bcrypt work.
+
+bcrypt is deliberately slow (~250ms of CPU at cost 12), so a burst of logins hashing inline
+would pin every web thread. All hashing goes through one PasswordHashPool per process: at most
+PASSWORD_HASH_WORKERS hashes run at once and at most PASSWORD_HASH_MAX_QUEUE more wait for a
+worker. Past that, run() raises PasswordHashPoolFull right away and the route answers 503 with
+a Retry-After instead of queueing requests it can't serve in time. bcrypt releases the GIL, so
+the workers do use separate cores.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import phase
+
+
+class PasswordHashPoolFull(Exception):
+    """Raised when the pool and its queue are full"""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many password hashes in progress")
+        self.retry_after = retry_after
+
+
+def hash_log_rounds(pw_hash):
+    """bcrypt cost factor a hash was made with, from its "$2b$<cost>$..." prefix"""
+
+    try:
+        return int(pw_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHashPool:
+    """Small extension configured from app.config['PASSWORD_HASH_*']"""
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # default to the number of cores, more workers than that only adds latency
+        app.config.setdefault("PASSWORD_HASH_WORKERS", os.cpu_count() or 1)
+        app.config.setdefault("PASSWORD_HASH_MAX_QUEUE", 8)
+        # seconds a shed client is told to wait before retrying
+        app.config.setdefault("PASSWORD_HASH_RETRY_AFTER", 2)
+
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.retry_after = app.config["PASSWORD_HASH_RETRY_AFTER"]
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="scribcraft-bcrypt")
+        self.slots = threading.BoundedSemaphore(
+            self.workers + app.config["PASSWORD_HASH_MAX_QUEUE"])
+        app.extensions["password_hash_pool"] = self
+
+    def run(self, fn, *args):
+        """Runs fn(*args) on the pool and blocks for its result. Raises PasswordHashPoolFull if
+        PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE calls are already in progress.
+        """
+
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHashPoolFull(self.retry_after)
+        try:
+            with phase("bcrypt"):
+                return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+
+password_hash_pool = PasswordHashPool()
@@ -0,0 +1,83 @@
+"""Counts and times SQL statements issued while handling a request.
+
+Used to catch N+1 query regressions: with SQL_QUERY_BUDGET set, a request that issues more
+statements than the budget raises QueryBudgetExceeded when TESTING (logged otherwise). A route
+whose query count grows with the number of rows it renders will blow any fixed budget once the
+test db holds more rows than the budget.
+"""
+import time
+import logging
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in testing when a request issues more SQL statements than SQL_QUERY_BUDGET"""
+
+
+class QueryCounter:
+    """Context manager counting statements run on any engine, usable outside of requests too.
+
+        with QueryCounter() as counter:
+            client.get('/')
+        assert counter.count <= 5
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "before_cursor_execute", self._count)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_request_query(conn, cursor, statement, parameters, context, executemany):
+    """Tallies statements against the current request"""
+
+    if has_request_context():
+        g.sql_query_count = g.get("sql_query_count", 0) + 1
+        if context is not None:
+            context._request_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_request_query(conn, cursor, statement, parameters, context, executemany):
+    """Adds the statement's duration to the current request's g.sql_query_seconds"""
+
+    started = getattr(context, "_request_query_started", None)
+    if started is not None and has_request_context():
+        g.sql_query_seconds = g.get("sql_query_seconds", 0.0) + time.perf_counter() - started
+
+
+def init_query_guard(app):
+    """Enforce SQL_QUERY_BUDGET per request, and optionally report the count in a response header"""
+
+    app.config.setdefault("SQL_QUERY_BUDGET", None)
+    app.config.setdefault("SQL_QUERY_COUNT_HEADER", False)
+
+    @app.after_request
+    def check_query_budget(response):
+        count = g.get("sql_query_count", 0)
+        budget = app.config["SQL_QUERY_BUDGET"]
+
+        if app.config["SQL_QUERY_COUNT_HEADER"]:
+            response.headers["X-SQL-Queries"] = str(count)
+
+        if budget is not None and count > budget:
+            message = f"{request.method} {request.path} issued {count} SQL queries (budget {budget})"
+            if app.config["TESTING"]:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
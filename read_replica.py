@@ -0,0 +1,108 @@
+"""Connection pool settings and read replica routing for the database.
+
+Pooling: the SQLALCHEMY_POOL_* settings apply to every engine, the primary and the replica.
+SQLALCHEMY_POOL_PRE_PING checks a pooled connection before handing it out, so a connection the
+database or a proxy dropped while idle is replaced instead of failing the request, and
+SQLALCHEMY_POOL_RECYCLE retires connections before such timeouts. SQLite has no server to pool
+connections to, its engines ignore the size/overflow/timeout settings.
+
+Replica: with a "replica" bind in SQLALCHEMY_BINDS (DATABASE_REPLICA_URL), a request that
+calls use_replica() before touching the db reads from the replica. Everything else uses the
+primary: other requests, background jobs, and the rest of a request from its first write on
+(a flush or a bulk UPDATE/DELETE). The replica lags the primary, so a client stays on the primary
+for REPLICA_STICKY_SECONDS after a request of theirs committed a write and sees what they just
+did. Cached pages built from the replica are only kept for REPLICA_CACHE_TTL, they may be
+missing a write another client made a moment ago.
+
+Without a replica bind use_replica() does nothing and every query goes to the primary.
+"""
+import time
+
+from flask import current_app, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import UpdateBase
+
+REPLICA_BIND = "replica"
+# flask session key holding when the client last committed a write
+LAST_WRITE_KEY = "db_last_write"
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to the replica when the request asked for it and hasn't written"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+        elif self.info.get("replica") and not self.info.get("wrote"):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def remember_write(db_session):
+    """Keeps the client that wrote on the primary for a while, jobs have no client to keep"""
+
+    if db_session.info.get("wrote") and has_request_context():
+        session[LAST_WRITE_KEY] = time.time()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with RoutingSession and the pre-ping pool option"""
+
+    def init_app(self, app):
+        app.config.setdefault("SQLALCHEMY_POOL_PRE_PING", True)
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        super().apply_pool_defaults(app, options)
+        options["pool_pre_ping"] = app.config["SQLALCHEMY_POOL_PRE_PING"]
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith("sqlite"):
+            # SQLite gets a NullPool/StaticPool, neither takes these
+            for option in ("pool_size", "max_overflow", "pool_timeout"):
+                options.pop(option, None)
+        super().apply_driver_hacks(app, info, options)
+
+
+class ReadReplica:
+    """Small extension configured from app.config['REPLICA_*'], the replica is SQLALCHEMY_BINDS['replica']"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # longer than the replica usually lags behind the primary
+        app.config.setdefault("REPLICA_STICKY_SECONDS", 5)
+        app.config.setdefault("REPLICA_CACHE_TTL", 30)
+
+        self.enabled = REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+        self.sticky_seconds = app.config["REPLICA_STICKY_SECONDS"]
+        self.cache_ttl = app.config["REPLICA_CACHE_TTL"]
+        app.extensions["read_replica"] = self
+
+    def db_session(self):
+        return current_app.extensions["sqlalchemy"].db.session
+
+    def use_replica(self):
+        """Reads of this request go to the replica, unless its client wrote in the last REPLICA_STICKY_SECONDS"""
+
+        if self.enabled and time.time() - session.get(LAST_WRITE_KEY, 0) >= self.sticky_seconds:
+            self.db_session().info["replica"] = True
+
+    def use_primary(self):
+        """Reads of the rest of this request go to the primary"""
+
+        self.db_session().info.pop("replica", None)
+
+    def in_use(self):
+        """Whether reads of this request go to the replica"""
+
+        info = self.db_session().info
+        return bool(info.get("replica") and not info.get("wrote"))
@@ -0,0 +1,269 @@
+"""Response/fragment cache for pages and list apis built from scribs.
+
+Scribs are immutable, so rendered scrib pages and listings only go stale when a scrib is
+created/deleted or an author edits their profile. Every cache entry records the version of
+each tag it was built from ("scribs", "users", "scrib:<id>", "user:<id>"). Write routes bump
+the tags they touch with invalidate(), and an entry is only served while all its tag
+versions are current. Editing one user therefore only drops pages showing that user's cards.
+
+Backends:
+    memory: per process LRU bounded by entry count and total size, with a TTL. The tag versions
+            live in a SQLite file (RESPONSE_CACHE_VERSIONS_PATH) shared by every worker on the
+            host, so an invalidation drops the entries of all of them. Other hosts don't see it,
+            they serve what they cached for up to RESPONSE_CACHE_TTL (60s by default).
+    redis:  any Redis compatible server (RESPONSE_CACHE_URL), shared by all workers and hosts
+    null:   caching disabled
+"""
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+from metrics import counter
+
+try:
+    import redis
+except ImportError:  # optional, only needed for the redis backend
+    redis = None
+
+response_cache_lookups_total = counter(
+    "scribcraft_response_cache_lookups_total", "Response cache lookups", ["outcome"])
+response_cache_evictions_total = counter(
+    "scribcraft_response_cache_evictions_total", "Memory response cache entries evicted for space")
+
+
+class NullCacheBackend:
+    """Never stores anything"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry, ttl):
+        pass
+
+    def get_versions(self, tags):
+        return [0 for tag in tags]
+
+    def bump(self, tags):
+        pass
+
+    def size(self):
+        return 0
+
+
+class SQLiteTagVersions:
+    """Tag versions in a SQLite database, path ":memory:" keeps them private to the process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        # a connection inherited through gunicorn's fork must not be used by the child
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            if self.path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_tag_versions (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    def get(self, tags):
+        with self.lock:
+            rows = dict(self.connect().execute(
+                f"SELECT tag, version FROM cache_tag_versions WHERE tag IN ({', '.join('?' * len(tags))})",
+                list(tags)).fetchall()) if tags else {}
+        return [rows.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for tag in tags:
+                    connection.execute("INSERT OR IGNORE INTO cache_tag_versions VALUES (?, 0)", (tag,))
+                    connection.execute("UPDATE cache_tag_versions SET version = version + 1 WHERE tag = ?", (tag,))
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+
+class MemoryCacheBackend:
+    """LRU dict with a TTL per entry, evicts least recently used entries past max_entries/max_bytes.
+    Tag versions are kept in SQLite at versions_path, shared by the processes using the same file.
+    """
+
+    def __init__(self, max_entries, max_bytes, versions_path=":memory:"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.versions = SQLiteTagVersions(versions_path)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at, size = item
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        # max_bytes bounds memory, count the encoded body rather than its characters
+        size = len(entry["body"].encode())
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (entry, time.monotonic() + ttl, size)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                response_cache_evictions_total.inc()
+
+    def _remove(self, key):
+        entry, expires_at, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def get_versions(self, tags):
+        return self.versions.get(tags)
+
+    def bump(self, tags):
+        self.versions.bump(tags)
+
+    def size(self):
+        return len(self.entries)
+
+
+class RedisCacheBackend:
+    """Entries stored as json with a redis TTL, redis' own maxmemory policy bounds the size"""
+
+    PREFIX = "scribcraft:cache:"
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND='redis' needs the redis package installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self.client.get(self.PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, entry, ttl):
+        self.client.set(self.PREFIX + key, json.dumps(entry), ex=ttl)
+
+    def get_versions(self, tags):
+        raw_versions = self.client.mget(
+            [self.PREFIX + "tag:" + tag for tag in tags])
+        return [int(version or 0) for version in raw_versions]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.PREFIX + "tag:" + tag)
+        pipe.execute()
+
+    def size(self):
+        return None
+
+
+class ResponseCache:
+    """Small extension configured from app.config['RESPONSE_CACHE_*']"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+        app.config.setdefault("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+        # entries of the memory backend outlive invalidations on other hosts for up to this long
+        app.config.setdefault("RESPONSE_CACHE_TTL", 300 if app.config["RESPONSE_CACHE_BACKEND"] == "redis" else 60)
+        app.config.setdefault("RESPONSE_CACHE_MAX_ENTRIES", 2048)
+        app.config.setdefault("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        # ":memory:" keeps the memory backend's tag versions private to the process
+        app.config.setdefault("RESPONSE_CACHE_VERSIONS_PATH",
+                              os.path.join(tempfile.gettempdir(), "scribcraft-cache-versions.sqlite3"))
+
+        backend_name = app.config["RESPONSE_CACHE_BACKEND"]
+        if backend_name == "memory":
+            self.backend = MemoryCacheBackend(app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+                                              app.config["RESPONSE_CACHE_MAX_BYTES"],
+                                              app.config["RESPONSE_CACHE_VERSIONS_PATH"])
+        elif backend_name == "redis":
+            self.backend = RedisCacheBackend(app.config["RESPONSE_CACHE_URL"])
+        elif backend_name == "null":
+            self.backend = NullCacheBackend()
+        else:
+            raise ValueError(f"Unknown response cache backend: {backend_name}")
+
+        self.backend_name = backend_name
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+        app.extensions["response_cache"] = self
+
+    def get(self, key):
+        """Returns the cached entry for key ({"body": ..., plus whatever was stored}) if none of its tags changed"""
+
+        entry = self.backend.get(key)
+        if entry is None:
+            response_cache_lookups_total.inc(outcome="miss")
+            return None
+
+        tags = list(entry["tags"])
+        if self.backend.get_versions(tags) != [entry["tags"][tag] for tag in tags]:
+            response_cache_lookups_total.inc(outcome="stale")
+            return None
+
+        response_cache_lookups_total.inc(outcome="hit")
+        return entry
+
+    def versions(self, tags):
+        """Snapshot of tag versions, take it *before* reading the db so a concurrent write can't be cached as current"""
+
+        tags = sorted(set(tags))
+        return dict(zip(tags, self.backend.get_versions(tags)))
+
+    def set(self, key, body, versions, ttl=None, **extra):
+        """Store body (str) under key, tagged with the versions snapshot taken before it was built.
+        ttl shortens RESPONSE_CACHE_TTL for this entry.
+        """
+
+        entry = dict(extra, body=body, tags=versions)
+        self.backend.set(key, entry, int(min(ttl, self.ttl)) if ttl is not None else self.ttl)
+
+    def invalidate(self, *tags):
+        """Drop every entry built from any of tags"""
+
+        self.backend.bump(tags)
+
+    def stats(self):
+        """hit-rate counters, the same values /metrics exports. Stale entries count as misses"""
+
+        hits = response_cache_lookups_total.get(outcome="hit")
+        stale = response_cache_lookups_total.get(outcome="stale")
+        misses = response_cache_lookups_total.get(outcome="miss") + stale
+        return {
+            "hits": hits,
+            "misses": misses,
+            "stale": stale,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evictions": response_cache_evictions_total.get(),
+            "size": self.backend.size()
+        }
@@ -0,0 +1,132 @@
+"""Removes concept art from the s3 bucket once no concept_images row points at it.
+
+Deleting a scrib or a user is a single DELETE that the database cascades to their scribs and
+concept images (ON DELETE CASCADE, passive_deletes on the relationships). The routes read the
+urls of the images about to go with concept_art_of() first and hand them to
+S3Cleanup.enqueue(), which deletes the objects in the background with DeleteObjects requests of
+up to 1000 keys. Deletes run on a queue of their own (S3_CLEANUP_WORKERS workers), a user with
+thousands of images never holds up the generation jobs' workers, and nobody waits on a delete. Content hash keys are shared by every scrib that got the same image, so
+images another row still references are kept.
+
+Objects can still leak: a crash between the DELETE and the cleanup job, or an upload whose
+scrib was never saved. sweep() lists the bucket and removes objects that nothing references
+and that are older than S3_ORPHAN_GRACE_SECONDS (younger ones may belong to a generation in
+progress). Run it periodically from cron or the platform's scheduler:
+
+    FLASK_APP=app.py flask sweep-concept-art
+"""
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+import click
+
+from models import db, ConceptImage, Scrib
+from image_derivatives import image_group
+from jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# urls per IN (...) when checking which images are still referenced, below SQLite's 999 parameters
+REFERENCE_CHECK_CHUNK = 500
+
+
+def concept_art_of(*criteria):
+    """[(concept_image_url, variants json)] of the concept images of scribs matching criteria,
+    read before a delete cascades the rows away
+    """
+
+    return (db.session.query(ConceptImage.concept_image_url, ConceptImage.variants)
+            .join(Scrib, ConceptImage.scrib_id == Scrib.id)
+            .filter(*criteria)
+            .all())
+
+
+class S3Cleanup:
+    """Small extension configured from app.config['S3_ORPHAN_*'] and app.config['S3_CLEANUP_*'],
+    works with the app's s3_uploader extension
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.queue = JobQueue(name="s3_cleanup_queue", workers_key="S3_CLEANUP_WORKERS")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # objects younger than this are never swept, their db rows may not be committed yet
+        app.config.setdefault("S3_ORPHAN_GRACE_SECONDS", 24 * 60 * 60)
+        # deletes aren't urgent, one worker keeps up with the deletes of a process
+        app.config.setdefault("S3_CLEANUP_WORKERS", 1)
+
+        self.app = app
+        self.grace = app.config["S3_ORPHAN_GRACE_SECONDS"]
+        self.queue.init_app(app)
+        app.extensions["s3_cleanup"] = self
+
+        @app.cli.command("sweep-concept-art")
+        @click.option("--dry-run", is_flag=True, help="only report what would be deleted")
+        def sweep_command(dry_run):
+            """Delete concept art objects no scrib references anymore"""
+
+            orphans, deleted = self.sweep(dry_run=dry_run)
+            if dry_run:
+                click.echo("\n".join(orphans))
+            click.echo(f"{len(orphans)} orphaned objects found, {deleted} deleted")
+
+    @property
+    def uploader(self):
+        return self.app.extensions["s3_uploader"]
+
+    def image_keys(self, url, variants):
+        """keys of an image's original and its derivatives"""
+
+        urls = [url] + [variant["url"] for variant in json.loads(variants or "[]")]
+        return [key for key in map(self.uploader.key_for_url, urls) if key is not None]
+
+    def enqueue(self, images):
+        """Delete the objects of images (as returned by concept_art_of()) in the background"""
+
+        if images:
+            self.queue.enqueue(self.delete_images, list(images))
+
+    def delete_images(self, images):
+        """Deletes the objects of images that no concept_images row references anymore"""
+
+        urls = list({url for url, variants in images})
+        referenced = set()
+        for start in range(0, len(urls), REFERENCE_CHECK_CHUNK):
+            referenced.update(url for (url,) in db.session.query(ConceptImage.concept_image_url).filter(
+                ConceptImage.concept_image_url.in_(urls[start:start + REFERENCE_CHECK_CHUNK])))
+
+        keys = [key for url, variants in images if url not in referenced
+                for key in self.image_keys(url, variants)]
+        deleted = self.uploader.delete_keys(keys)
+        logger.info("Deleted %s of %s concept art objects (%s images still referenced)",
+                    deleted, len(keys), len(referenced))
+        return deleted
+
+    def referenced_groups(self):
+        """image_group() of every object some concept_images row points at"""
+
+        groups = set()
+        for (url,) in db.session.query(ConceptImage.concept_image_url).yield_per(10000):
+            key = self.uploader.key_for_url(url)
+            if key is not None:
+                groups.add(image_group(key))
+        return groups
+
+    def sweep(self, dry_run=False):
+        """Deletes bucket objects older than S3_ORPHAN_GRACE_SECONDS that no row references.
+        Returns (orphaned keys, number of objects deleted).
+        """
+
+        # list the bucket after reading the db, an image saved in between is younger than the grace period
+        referenced = self.referenced_groups()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace)
+
+        orphans = [obj["Key"] for obj in self.uploader.iter_objects()
+                   if obj["LastModified"] < cutoff and image_group(obj["Key"]) not in referenced]
+        if dry_run:
+            return orphans, 0
+        return orphans, self.uploader.delete_keys(orphans)
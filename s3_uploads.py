@@ -0,0 +1,258 @@
+"""Concurrent uploader that copies generated concept art into the Scribcraft s3 bucket.
+
+One S3Uploader lives for the whole process: it keeps a single boto3 client (clients are
+thread safe and pool their own connections), a requests session for downloading images
+from OpenAI and a bounded thread pool so all images of a scrib transfer at the same time.
+Concept images are stored under content hash keys together with their resized derivatives
+(see image_derivatives.py). Removing objects again, in batches, is up to s3_cleanup.py.
+"""
+import io
+import os
+import math
+import time
+import random
+import logging
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from image_derivatives import content_hash, original_key, make_derivatives
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# content hash keys never change content, so caches may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+s3_request_seconds = histogram(
+    "scribcraft_s3_request_seconds", "Duration of concept image downloads and s3 requests", ["operation"])
+s3_errors_total = counter(
+    "scribcraft_s3_errors_total", "Failed concept image downloads and s3 requests, retried ones included", ["operation"])
+s3_deleted_objects_total = counter(
+    "scribcraft_s3_deleted_objects_total", "Objects removed from the concept art bucket")
+
+# most keys a single DeleteObjects request takes
+MAX_DELETE_BATCH = 1000
+
+
+class S3UploadError(Exception):
+    """Raised when an image could not be copied to s3 within its attempts/time budget"""
+
+
+class S3Uploader:
+    """Small extension configured from app.config['S3_*']"""
+
+    def __init__(self, app=None):
+        self.client = None
+        self.http = None
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("S3_BUCKET_NAME", "scribcraft.concept")
+        # point at a local stand-in (moto_server, minio...) for tests/benchmarks
+        app.config.setdefault("S3_ENDPOINT_URL", None)
+        app.config.setdefault("S3_UPLOAD_WORKERS", 3)
+        app.config.setdefault("S3_UPLOAD_MAX_ATTEMPTS", 3)
+        # seconds allowed for one image, download + upload + retries included
+        app.config.setdefault("S3_UPLOAD_TIMEOUT", 30)
+        # store resized webp/jpeg copies next to every concept image
+        app.config.setdefault("S3_IMAGE_DERIVATIVES", True)
+        app.config.setdefault("S3_DELETE_BATCH_SIZE", MAX_DELETE_BATCH)
+
+        self.bucket_name = app.config["S3_BUCKET_NAME"]
+        self.endpoint_url = app.config["S3_ENDPOINT_URL"]
+        self.max_workers = app.config["S3_UPLOAD_WORKERS"]
+        self.max_attempts = app.config["S3_UPLOAD_MAX_ATTEMPTS"]
+        self.timeout = app.config["S3_UPLOAD_TIMEOUT"]
+        self.make_derivatives = app.config["S3_IMAGE_DERIVATIVES"]
+        self.delete_batch_size = min(app.config["S3_DELETE_BATCH_SIZE"], MAX_DELETE_BATCH)
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="scribcraft-s3")
+        app.extensions["s3_uploader"] = self
+
+    def get_client(self):
+        """Returns the process wide boto3 client, creating it on first use"""
+
+        if self.client is None:
+            # boto3 takes a third of a second to import, only pay for it once s3 is actually used
+            import boto3
+            from botocore.config import Config
+
+            session = boto3.Session(aws_access_key_id=os.environ.get('ACCESS_KEY'),
+                                    aws_secret_access_key=os.environ.get('SECRET_ACCESS_KEY_AWS'))
+            self.client = session.client("s3", endpoint_url=self.endpoint_url, config=Config(
+                max_pool_connections=self.max_workers,
+                connect_timeout=5,
+                read_timeout=self.timeout,
+                # we retry whole download+upload cycles ourselves
+                retries={"max_attempts": 0}))
+        return self.client
+
+    def get_http(self):
+        """Returns the keep-alive session used to download images from OpenAI"""
+
+        if self.http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.http = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            self.http.mount("https://", adapter)
+            self.http.mount("http://", adapter)
+        return self.http
+
+    def public_url(self, key):
+        """url to display an uploaded object publically"""
+
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket_name}/{key}"
+        return f"https://s3.amazonaws.com/{self.bucket_name}/{key}"
+
+    def key_for_url(self, url):
+        """Inverse of public_url(), None for urls outside the bucket"""
+
+        path = urlparse(url).path
+        prefix = f"/{self.bucket_name}/"
+        if not path.startswith(prefix):
+            return None
+        return unquote(path[len(prefix):])
+
+    def iter_objects(self, prefix=""):
+        """Yields {"Key", "LastModified", "Size", ...} for every object in the bucket under prefix"""
+
+        paginator = self.get_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def delete_keys(self, keys):
+        """Deletes keys from the bucket in DeleteObjects requests of up to S3_DELETE_BATCH_SIZE keys.
+        Failed keys are logged and left for the orphan sweep. Returns the number of keys deleted.
+        """
+
+        keys = list(dict.fromkeys(keys))
+        deleted = 0
+        for start in range(0, len(keys), self.delete_batch_size):
+            batch = keys[start:start + self.delete_batch_size]
+            try:
+                with s3_request_seconds.time(operation="delete"):
+                    res = self.get_client().delete_objects(Bucket=self.bucket_name, Delete={
+                        "Objects": [{"Key": key} for key in batch], "Quiet": True})
+            except Exception:
+                s3_errors_total.inc(operation="delete")
+                logger.exception("Could not delete %s objects from %s", len(batch), self.bucket_name)
+                continue
+
+            # quiet mode only reports the failures
+            errors = res.get("Errors", [])
+            for error in errors[:10]:
+                logger.warning("Could not delete %s: %s %s", error.get("Key"), error.get("Code"),
+                               error.get("Message"))
+            if errors:
+                s3_errors_total.inc(len(errors), operation="delete")
+            deleted += len(batch) - len(errors)
+
+        s3_deleted_objects_total.inc(deleted)
+        return deleted
+
+    def _retrying(self, description, deadline, action):
+        """Runs action(remaining_seconds) until it succeeds, retrying with backoff until
+        S3_UPLOAD_MAX_ATTEMPTS or the deadline runs out
+        """
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return action(deadline - time.monotonic())
+
+            except Exception as e:
+                backoff = min(2 ** attempt, 8) * random.uniform(0.5, 1)
+                if attempt >= self.max_attempts or time.monotonic() + backoff >= deadline:
+                    raise S3UploadError(
+                        f"Could not {description} after {attempt} attempt(s): {e}") from e
+
+                logger.warning("Retrying %s (attempt %s): %s",
+                               description, attempt, e)
+                time.sleep(backoff)
+
+    def _download(self, url, remaining):
+        try:
+            with s3_request_seconds.time(operation="download"):
+                # read the whole image (~0.5MB) so a failed put can be retried, a raw stream can't be replayed
+                res = self.get_http().get(url, timeout=(5, max(remaining, 1)))
+                res.raise_for_status()
+                return res.content
+        except Exception:
+            s3_errors_total.inc(operation="download")
+            raise
+
+    def _put(self, key, data, content_type, **extra):
+        try:
+            with s3_request_seconds.time(operation="put"):
+                self.get_client().put_object(Bucket=self.bucket_name, Key=key,
+                                             Body=io.BytesIO(data), ContentType=content_type, **extra)
+        except Exception:
+            s3_errors_total.inc(operation="put")
+            raise
+        return self.public_url(key)
+
+    def upload_from_url(self, url, key):
+        """Downloads image at url and puts it in the bucket under key. Retries with backoff until
+        S3_UPLOAD_MAX_ATTEMPTS or S3_UPLOAD_TIMEOUT runs out. Returns the public url of the object.
+        """
+
+        deadline = time.monotonic() + self.timeout
+        return self._retrying(f"upload concept image {key}", deadline,
+                              lambda remaining: self._put(key, self._download(url, remaining), "image/png"))
+
+    def upload_concept_image(self, url):
+        """Downloads image at url and stores it, plus its derivatives, under content hash keys.
+        Returns {"url": original's public url, "variants": [{"url", "width", "format"}, ...]}
+        """
+
+        deadline = time.monotonic() + self.timeout
+        data = self._retrying(f"download concept image {url}", deadline,
+                              lambda remaining: self._download(url, remaining))
+
+        digest = content_hash(data)
+        try:
+            derivatives = make_derivatives(data) if self.make_derivatives else []
+        except Exception as e:
+            raise S3UploadError(
+                f"Could not resize concept image {digest[:12]}: {e}") from e
+
+        def put(key, body, content_type):
+            return self._retrying(f"upload concept image {key}", deadline,
+                                  lambda remaining: self._put(key, body, content_type,
+                                                              CacheControl=IMMUTABLE_CACHE_CONTROL))
+
+        return {
+            "url": put(original_key(digest), data, "image/png"),
+            "variants": [{"url": put(derivative.key, derivative.data, derivative.content_type),
+                          "width": derivative.width,
+                          "format": derivative.format}
+                         for derivative in derivatives]
+        }
+
+    def upload_concept_images(self, image_urls, scrib_id):
+        """Uploads all concept images of a scrib concurrently.
+        Returns what upload_concept_image() returns for every url, in the same order as image_urls.
+        Raises S3UploadError if any image fails.
+        """
+
+        futures = [self.executor.submit(self.upload_concept_image, url)
+                   for url in image_urls]
+
+        # every image has its own deadline, images queued behind a full pool get another round of it
+        rounds = math.ceil(len(futures) / self.max_workers)
+        done, not_done = wait(futures, timeout=self.timeout * rounds + 1)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            raise S3UploadError(
+                f"Timed out uploading {len(not_done)} concept image(s) for scrib {scrib_id}")
+
+        return [future.result() for future in futures]
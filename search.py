@@ -0,0 +1,179 @@
+"""Full-text search over scribs (title, prompt and scrib_text), and username prefix search.
+
+Postgres: a GIN index over a weighted to_tsvector() expression. Postgres keeps the index up
+to date on insert/update/delete by itself and queries use the exact same expression so the
+planner picks the index.
+
+SQLite (local dev/tests): an FTS5 external content table mirroring scribs, kept in sync by
+triggers on insert/update/delete.
+
+Both are created with the scribs table (db.create_all) through DDL events. For databases
+created before search existed run rebuild_search_index() once.
+
+Other databases have no search index: scribs are matched with ILIKE over the three columns, a
+full table scan, and listed newest first.
+
+Username typeahead matches case-insensitively by prefix: a range scan of an index over
+lower(username), which also returns the matches already sorted. On Postgres the index and the
+query use the "C" collation (byte order, like SQLite's) since prefix ranges don't hold under
+linguistic collations. The index is created with the users table, and by migration 0004 on
+existing databases.
+"""
+import re
+
+from sqlalchemy import DDL, event, desc, func, literal_column, or_, text
+from sqlalchemy.sql import table, column
+
+from models import db, Scrib, User
+
+# title matches count the most, then the prompt, then the generated text
+SCRIB_SEARCH_VECTOR = func.setweight(func.to_tsvector('english', func.coalesce(Scrib.title, '')), 'A').op('||')(
+    func.setweight(func.to_tsvector('english', func.coalesce(Scrib.prompt, '')), 'B')).op('||')(
+    func.setweight(func.to_tsvector('english', func.coalesce(Scrib.scrib_text, '')), 'C'))
+
+POSTGRES_SEARCH_INDEX = DDL("""
+CREATE INDEX IF NOT EXISTS ix_scribs_search ON scribs USING GIN ((
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(prompt, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(scrib_text, '')), 'C')
+))
+""")
+
+SQLITE_SEARCH_INDEX = [
+    DDL("""
+CREATE VIRTUAL TABLE IF NOT EXISTS scribs_fts USING fts5(
+    title, prompt, scrib_text, content='scribs', content_rowid='id', tokenize='porter unicode61'
+)"""),
+    DDL("""
+CREATE TRIGGER IF NOT EXISTS scribs_fts_insert AFTER INSERT ON scribs BEGIN
+    INSERT INTO scribs_fts(rowid, title, prompt, scrib_text)
+    VALUES (new.id, new.title, new.prompt, new.scrib_text);
+END"""),
+    DDL("""
+CREATE TRIGGER IF NOT EXISTS scribs_fts_delete AFTER DELETE ON scribs BEGIN
+    INSERT INTO scribs_fts(scribs_fts, rowid, title, prompt, scrib_text)
+    VALUES ('delete', old.id, old.title, old.prompt, old.scrib_text);
+END"""),
+    DDL("""
+CREATE TRIGGER IF NOT EXISTS scribs_fts_update AFTER UPDATE ON scribs BEGIN
+    INSERT INTO scribs_fts(scribs_fts, rowid, title, prompt, scrib_text)
+    VALUES ('delete', old.id, old.title, old.prompt, old.scrib_text);
+    INSERT INTO scribs_fts(rowid, title, prompt, scrib_text)
+    VALUES (new.id, new.title, new.prompt, new.scrib_text);
+END"""),
+]
+
+SQLITE_DROP_SEARCH_INDEX = [
+    DDL("DROP TRIGGER IF EXISTS scribs_fts_insert"),
+    DDL("DROP TRIGGER IF EXISTS scribs_fts_delete"),
+    DDL("DROP TRIGGER IF EXISTS scribs_fts_update"),
+    DDL("DROP TABLE IF EXISTS scribs_fts"),
+]
+
+POSTGRES_USERNAME_INDEX = DDL(
+    'CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users ((lower(username) COLLATE "C"))')
+SQLITE_USERNAME_INDEX = DDL(
+    "CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))")
+
+# largest code point, every string starting with a prefix sorts below prefix + this
+MAX_CHAR = "\U0010ffff"
+
+scribs_fts = table("scribs_fts", column("rowid"))
+
+event.listen(Scrib.__table__, "after_create",
+             POSTGRES_SEARCH_INDEX.execute_if(dialect="postgresql"))
+for ddl in SQLITE_SEARCH_INDEX:
+    event.listen(Scrib.__table__, "after_create",
+                 ddl.execute_if(dialect="sqlite"))
+for ddl in SQLITE_DROP_SEARCH_INDEX:
+    event.listen(Scrib.__table__, "before_drop",
+                 ddl.execute_if(dialect="sqlite"))
+event.listen(User.__table__, "after_create",
+             POSTGRES_USERNAME_INDEX.execute_if(dialect="postgresql"))
+event.listen(User.__table__, "after_create",
+             SQLITE_USERNAME_INDEX.execute_if(dialect="sqlite"))
+
+
+def search_terms(q):
+    """Splits user input into plain word terms, everything else is dropped so input can't inject query syntax"""
+
+    return re.findall(r"\w+", q.lower())
+
+
+def search_scribs_query(q):
+    """Returns a Scrib query matching every term of q (last term as a prefix so it works while typing),
+    best matches first. Returns None when q holds no searchable terms.
+    """
+
+    terms = search_terms(q)
+    if not terms:
+        return None
+
+    if db.engine.dialect.name == "postgresql":
+        tsquery = func.to_tsquery('english', " & ".join(
+            terms[:-1] + [terms[-1] + ":*"]))
+        return (Scrib.query
+                .filter(SCRIB_SEARCH_VECTOR.op('@@')(tsquery))
+                .order_by(desc(func.ts_rank(SCRIB_SEARCH_VECTOR, tsquery)), Scrib.id.desc()))
+
+    if db.engine.dialect.name == "sqlite":
+        match = " ".join(
+            [f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        # bm25 is lower for better matches, column weights mirror the postgres A/B/C weights
+        return (Scrib.query
+                .join(scribs_fts, scribs_fts.c.rowid == Scrib.id)
+                .filter(text("scribs_fts MATCH :match"))
+                .order_by(literal_column("bm25(scribs_fts, 10.0, 4.0, 1.0)"), Scrib.id.desc())
+                .params(match=match))
+
+    # every term appears somewhere in the scrib, as a substring so the last one works while typing
+    query = Scrib.query
+    for term in terms:
+        # "_" is a word character but a LIKE wildcard
+        pattern = "%" + term.replace("_", "\\_") + "%"
+        query = query.filter(or_(Scrib.title.ilike(pattern, escape="\\"),
+                                 Scrib.prompt.ilike(pattern, escape="\\"),
+                                 Scrib.scrib_text.ilike(pattern, escape="\\")))
+    return query.order_by(Scrib.id.desc())
+
+
+def username_prefix_query(prefix):
+    """Returns a query of (id, username, image_url) of the users whose username starts with prefix,
+    ignoring case, in username order
+    """
+
+    lowered = func.lower(User.username)
+    if db.engine.dialect.name == "postgresql":
+        # the exact expression of the index
+        lowered = lowered.collate("C")
+
+    prefix = prefix.lower()
+    return (db.session.query(User.id, User.username, User.image_url)
+            .filter(lowered >= prefix, lowered < prefix + MAX_CHAR)
+            .order_by(lowered))
+
+
+def rebuild_search_index():
+    """Creates the search index on an existing database and (re)fills it from the scribs table"""
+
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(POSTGRES_SEARCH_INDEX.statement)
+    elif db.engine.dialect.name == "sqlite":
+        for ddl in SQLITE_SEARCH_INDEX:
+            db.session.execute(ddl.statement)
+        db.session.execute(
+            "INSERT INTO scribs_fts(scribs_fts) VALUES ('rebuild')")
+
+    db.session.commit()
+
+
+def drop_search_index():
+    """Drops the search index (and on SQLite its triggers), for bulk loads that rebuild it afterwards"""
+
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute("DROP INDEX IF EXISTS ix_scribs_search")
+    elif db.engine.dialect.name == "sqlite":
+        for ddl in SQLITE_DROP_SEARCH_INDEX:
+            db.session.execute(ddl.statement)
+
+    db.session.commit()
@@ -1,6 +1,12 @@
-from app import db
+from flask_migrate import stamp
+
+from app import create_app, db
 from models import User, Scrib, connect_db
 
+app = create_app(migrations=True)
 
 db.drop_all()
 db.create_all()
+# create_all built the latest schema, record that so `flask db upgrade` starts from here
+with app.app_context():
+    stamp()
@@ -5,11 +5,23 @@ const scribsList = document.querySelector(".scribs-list");
 const scribsFilterInput = document.querySelector("#scribs-filter-search");
 const allScribsBtn = document.querySelector("#all-btn");
 const myScribsBtn = document.querySelector("#mine-btn");
-const loggedInUser = document.querySelector("#logged-in-user")?.textContent;
+const loggedInUserId = document.querySelector("#logged-in-user")?.dataset.userId;
+const jobStatus = document.querySelector(".job-status");
+const jobStateValue = document.querySelector(".job-state-value");
+const streamedScrib = document.querySelector(".streamed-scrib");
+const streamedText = document.querySelector(".streamed-text");
+const usersFilterInput = document.querySelector("#users-filter-search");
+const usersList = document.querySelector(".users-list");
+const usersSearchResults = document.querySelector(".users-search-results");
 
-const baseAPIurl = "https://scribcraft.onrender.com";
-
-let scribs_list = [];
+// same origin so the session cookie is sent along to auth'd endpoints
+const baseAPIurl = window.location.origin;
+const JOB_POLL_INTERVAL_MS = 1500;
+const SEARCH_DEBOUNCE_MS = 250;
+const SCRIBS_PAGE_SIZE = 24;
+// only what a scrib card shows, keeps scrib_text and concept images out of list payloads
+const SCRIB_CARD_FIELDS = "id,title,timestamp,user_image_url";
+const USER_SUGGESTIONS_LIMIT = 12;
 
 // form submit loading
 const toggle = (elem) => {
@@ -21,49 +33,150 @@ createScribForm?.addEventListener("submit", () => {
   toggle(loadingGif);
 });
 
-// Filter scribs
-scribsFilterInput?.addEventListener("input", async (e) => {
-  scribsList.innerHTML = "";
-  const searchValue = e.currentTarget.value.toLowerCase();
-  if (scribs_list.length === 0) {
-    scribs = await getScribs();
-    scribs_list = [...scribs.scribs];
-    console.log(scribs_list);
+// poll generation job until it's done, then let the job page redirect to the scrib (or error page)
+const pollJob = async (jobId) => {
+  const res = await axios.get(`${baseAPIurl}/api/jobs/${jobId}`);
+  const job = res.data.job;
+  jobStateValue.textContent = job.status;
+  if (job.status === "done" || job.status === "failed") {
+    window.location.reload();
+    return;
   }
-  const filtered_list = scribs_list
-    .filter((scrib) => scrib.title.toLowerCase().includes(searchValue))
-    .forEach((scrib) => {
-      addScribToDom(createScribCardTemplate(scrib));
+  setTimeout(() => pollJob(jobId), JOB_POLL_INTERVAL_MS);
+};
+
+// render the story as it streams in, same paragraph markup as a finished scrib
+const renderStreamedText = (text) => {
+  streamedText.innerHTML = "";
+  text.split("\n\n").forEach((paragraph) => {
+    const p = document.createElement("p");
+    p.className = "details";
+    p.textContent = paragraph;
+    streamedText.append(p);
+  });
+};
+
+// follow the job over server-sent events, fall back to polling if the stream can't be used
+const streamJob = (jobId) => {
+  const source = new EventSource(`${baseAPIurl}/jobs/${jobId}/stream`);
+  let text = "";
+
+  // every (re)connection replays the text from the start
+  source.addEventListener("open", () => {
+    text = "";
+  });
+  source.addEventListener("text", (e) => {
+    text += JSON.parse(e.data);
+    if (!streamedScrib.classList.contains("is-visible")) {
+      toggle(jobStatus);
+      toggle(streamedScrib);
+    }
+    renderStreamedText(text);
+  });
+  ["done", "failed"].forEach((event) => {
+    source.addEventListener(event, () => {
+      source.close();
+      window.location.reload();
     });
-});
+  });
+  source.addEventListener("error", () => {
+    if (source.readyState === EventSource.CLOSED) {
+      setTimeout(() => pollJob(jobId), JOB_POLL_INTERVAL_MS);
+    }
+  });
+};
 
-allScribsBtn?.addEventListener("click", async (e) => {
-  scribsList.innerHTML = "";
-  if (scribs_list.length === 0) {
-    scribs = await getScribs();
-    scribs_list = [...scribs.scribs];
+if (jobStatus) {
+  if (window.EventSource) {
+    streamJob(jobStatus.dataset.jobId);
+  } else {
+    setTimeout(() => pollJob(jobStatus.dataset.jobId), JOB_POLL_INTERVAL_MS);
   }
-  scribs_list.forEach((scrib) => {
+}
+
+// Server rendered lists end in a "next page" link: swap it for the next page's html
+// fragment (which ends in the following link) as it scrolls into view
+const NEXT_PAGE_MARGIN = "600px";
+
+const loadNextPage = async (link) => {
+  nextPageObserver.unobserve(link);
+  const res = await fetch(link.dataset.fragmentUrl, { credentials: "same-origin" });
+  // a filter may have replaced the list while the page was loading
+  if (!res.ok || !link.isConnected) return;
+  const list = link.parentElement;
+  link.insertAdjacentHTML("afterend", await res.text());
+  link.remove();
+  list.querySelectorAll(".next-page").forEach((next) => nextPageObserver.observe(next));
+};
+
+// without IntersectionObserver the links just open the next page
+const nextPageObserver = window.IntersectionObserver
+  ? new IntersectionObserver(
+      (entries) => {
+        entries.forEach((entry) => entry.isIntersecting && loadNextPage(entry.target));
+      },
+      { rootMargin: NEXT_PAGE_MARGIN }
+    )
+  : null;
+
+nextPageObserver && document.querySelectorAll(".next-page").forEach((link) => nextPageObserver.observe(link));
+
+// Filter scribs: every filter is evaluated by the api, one page at a time
+let currentFilters = {};
+let nextCursor = null;
+let searchTimeout = null;
+
+const loadMoreBtn = document.createElement("button");
+loadMoreBtn.className = "btn load-more-btn toggle-content";
+loadMoreBtn.textContent = "Load more";
+loadMoreBtn.addEventListener("click", () => {
+  renderScribsPage(currentFilters, nextCursor);
+});
+scribsFilterInput && scribsList?.insertAdjacentElement("afterend", loadMoreBtn);
+
+const renderScribsPage = async (filters, after = null) => {
+  const page = filters.q ? await searchScribs(filters.q, after) : await getScribs({ ...filters, after });
+  if (after === null) scribsList.innerHTML = "";
+  page.scribs.forEach((scrib) => {
     addScribToDom(createScribCardTemplate(scrib));
   });
+  // search pages by offset (results are ranked), listings by keyset cursor
+  nextCursor = filters.q ? page.next_offset : page.next_cursor;
+  loadMoreBtn.classList.toggle("is-visible", nextCursor !== null);
+};
+
+const applyFilters = (filters) => {
+  currentFilters = filters;
+  renderScribsPage(currentFilters);
+};
+
+scribsFilterInput?.addEventListener("input", (e) => {
+  const searchValue = e.currentTarget.value.trim();
+  clearTimeout(searchTimeout);
+  searchTimeout = setTimeout(() => {
+    applyFilters(searchValue ? { q: searchValue } : {});
+  }, SEARCH_DEBOUNCE_MS);
 });
 
-myScribsBtn?.addEventListener("click", async (e) => {
-  scribsList.innerHTML = "";
-  if (scribs_list.length === 0) {
-    scribs = await getScribs();
-    scribs_list = [...scribs.scribs];
-  }
-  scribs_list
-    .filter((scrib) => scrib.user_username === loggedInUser)
-    .forEach((scrib) => {
-      addScribToDom(createScribCardTemplate(scrib));
-    });
+allScribsBtn?.addEventListener("click", () => {
+  applyFilters({});
 });
 
-const getScribs = async () => {
-  const res = await axios.get(`${baseAPIurl}/api/scribs`);
-  console.log("api call");
+myScribsBtn?.addEventListener("click", () => {
+  applyFilters({ user_id: loggedInUserId });
+});
+
+const getScribs = async ({ after = null, ...filters } = {}) => {
+  const params = { ...filters, fields: SCRIB_CARD_FIELDS, limit: SCRIBS_PAGE_SIZE };
+  if (after !== null) params.after = after;
+  const res = await axios.get(`${baseAPIurl}/api/scribs`, { params });
+  return res.data;
+};
+
+const searchScribs = async (q, offset = null) => {
+  const params = { q, fields: SCRIB_CARD_FIELDS, limit: SCRIBS_PAGE_SIZE };
+  if (offset !== null) params.offset = offset;
+  const res = await axios.get(`${baseAPIurl}/api/scribs/search`, { params });
   return res.data;
 };
 
@@ -89,3 +202,60 @@ const createScribCardTemplate = (scrib) => {
         </a>
 </div>`;
 };
+
+// Username typeahead: the api matches usernames by prefix, its matches replace the paginated list
+let usersSearchTimeout = null;
+let usersSearchPrefix = "";
+
+const searchUsernames = async (prefix) => {
+  const params = { prefix, limit: USER_SUGGESTIONS_LIMIT };
+  const res = await axios.get(`${baseAPIurl}/api/users/search`, { params });
+  return res.data.users;
+};
+
+// built with DOM nodes, usernames are user input
+const createUserCard = (user) => {
+  const card = document.createElement("div");
+  card.className = "user-card";
+  const link = document.createElement("a");
+  link.href = `/users/${user.id}`;
+  const avatar = document.createElement("div");
+  avatar.className = "avatar";
+  const img = document.createElement("img");
+  img.src = user.image_url;
+  img.alt = "user's avatar";
+  const name = document.createElement("p");
+  name.className = "card-user";
+  name.textContent = user.username;
+  avatar.append(img);
+  link.append(avatar, name);
+  card.append(link);
+  return card;
+};
+
+const renderUserSuggestions = async (prefix) => {
+  const users = await searchUsernames(prefix);
+  // a later keystroke already asked for another prefix
+  if (prefix !== usersSearchPrefix) return;
+  usersSearchResults.replaceChildren(...users.map(createUserCard));
+  if (!users.length) {
+    const empty = document.createElement("p");
+    empty.className = "no-results";
+    empty.textContent = "No users found";
+    usersSearchResults.append(empty);
+  }
+  usersList.hidden = true;
+  usersSearchResults.hidden = false;
+};
+
+usersFilterInput?.addEventListener("input", (e) => {
+  usersSearchPrefix = e.currentTarget.value.trim();
+  clearTimeout(usersSearchTimeout);
+  if (!usersSearchPrefix) {
+    usersSearchResults.hidden = true;
+    usersList.hidden = false;
+    return;
+  }
+  const prefix = usersSearchPrefix;
+  usersSearchTimeout = setTimeout(() => renderUserSuggestions(prefix), SEARCH_DEBOUNCE_MS);
+});
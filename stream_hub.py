@@ -0,0 +1,94 @@
+"""In-process fan out of generated text from a running job to Server-Sent Events readers.
+
+The generation worker publish()es chunks of text as OpenAI streams them, SSE requests for the
+same job wait() for whatever arrived after the part they already sent. Streams live in the
+process running the job; readers served by another process fall back to the partial text the
+job periodically flushes to the db.
+
+Every reader holds a server thread while its stream is open, so a process serves at most
+SSE_MAX_STREAMS of them at once (acquire_reader()), the job page polls when refused one.
+"""
+import time
+import threading
+
+# keep finished streams around a little so a reader connecting late still gets the ending
+FINISHED_STREAM_TTL = 60
+
+
+class TextStream:
+    def __init__(self):
+        self.text = ""
+        self.finished = False
+        self.error = None
+        self.finished_at = None
+        self.changed = threading.Condition()
+
+
+class StreamHub:
+    def __init__(self, app=None):
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.readers = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # leave most of a gthread worker's threads (8 in the Procfile) to the other requests
+        app.config.setdefault("SSE_MAX_STREAMS", 4)
+
+        self.readers = threading.BoundedSemaphore(app.config["SSE_MAX_STREAMS"])
+        app.extensions["stream_hub"] = self
+
+    def acquire_reader(self):
+        """Takes one of the process' reader slots, False when they are all in use"""
+
+        return self.readers.acquire(blocking=False)
+
+    def release_reader(self):
+        self.readers.release()
+
+    def open(self, stream_id):
+        with self.lock:
+            self._prune()
+            self.streams[stream_id] = TextStream()
+
+    def get(self, stream_id):
+        with self.lock:
+            return self.streams.get(stream_id)
+
+    def publish(self, stream_id, chunk):
+        stream = self.get(stream_id)
+        if stream is None:
+            return
+        with stream.changed:
+            stream.text += chunk
+            stream.changed.notify_all()
+
+    def close(self, stream_id, error=None):
+        stream = self.get(stream_id)
+        if stream is None:
+            return
+        with stream.changed:
+            stream.finished = True
+            stream.error = error
+            stream.finished_at = time.monotonic()
+            stream.changed.notify_all()
+
+    def wait(self, stream_id, offset, timeout):
+        """Blocks until text past offset arrives, the stream finishes or timeout passes.
+        Returns (new_text, finished, error), or None if this process doesn't know the stream.
+        """
+
+        stream = self.get(stream_id)
+        if stream is None:
+            return None
+        with stream.changed:
+            stream.changed.wait_for(lambda: len(
+                stream.text) > offset or stream.finished, timeout=timeout)
+            return stream.text[offset:], stream.finished, stream.error
+
+    def _prune(self):
+        now = time.monotonic()
+        for stream_id in [stream_id for stream_id, stream in self.streams.items()
+                          if stream.finished and now - stream.finished_at > FINISHED_STREAM_TTL]:
+            del self.streams[stream_id]
@@ -0,0 +1,117 @@
+"""App, client and data fixtures shared by the tests.
+
+Every test gets its own app built with the "test" profile (inline jobs, cheap bcrypt, no CSRF)
+on a fresh SQLite database in tmp_path, talking to benchmarks/fake_openai.py instead of OpenAI.
+The response cache is off so every request runs its queries. make_app() takes environment
+variables for tests that need a different configuration.
+"""
+import os
+import sys
+import socket
+import itertools
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_openai import FakeOpenAI  # noqa: E402
+from app import create_app, CURRENT_USER_KEY  # noqa: E402
+from models import db, User, Scrib, ConceptImage  # noqa: E402
+
+# scrib titles are unique
+scrib_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    server = FakeOpenAI(latency=0, images=3).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    """url of a local moto S3 server, tests using it are skipped when moto isn't installed"""
+
+    moto_server = pytest.importorskip("moto.server")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch, fake_openai):
+    apps = []
+
+    def make_app(**env):
+        env = {
+            "SECRET_KEY": "test",
+            "DATABASE_URL": f"sqlite:///{tmp_path / 'scribcraft.sqlite3'}",
+            "RESPONSE_CACHE_BACKEND": "null",
+            "RESPONSE_CACHE_VERSIONS_PATH": str(tmp_path / "cache-versions.sqlite3"),
+            "OPEN_AI_API_BASE_URL": fake_openai.base_url,
+            "OPEN_AI_API_KEY": "test",
+            "ACCESS_KEY": "test",
+            "SECRET_ACCESS_KEY_AWS": "test",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            **env,
+        }
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        app = create_app("test")
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield make_app
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    """id of a user the client can log in as"""
+
+    with app.app_context():
+        return add_user("viewer").id
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session[CURRENT_USER_KEY] = user_id
+
+
+def add_user(username):
+    user = User(username=username, email=f"{username}@example.com", password="not a hash",
+                image_url=User.image_url.default.arg)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_scrib(user_id, title=None, prompt="a prompt", scrib_text="Once upon a time", images=2):
+    scrib = Scrib(title=title or f"Scrib {next(scrib_numbers)}", prompt=prompt, scrib_text=scrib_text,
+                  user_id=user_id)
+    scrib.concept_images = [ConceptImage(concept_image_url=f"https://example.com/{n}.png") for n in range(images)]
+    db.session.add(scrib)
+    db.session.commit()
+    return scrib
@@ -0,0 +1,198 @@
+"""Admission control: places for pending generations, slots around the OpenAI calls and per-user quotas."""
+import time
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from admission import AdmissionControl, GenerationRejected
+from app import admission, s3_uploader, openai_client
+from models import GenerationJob
+from s3_uploads import S3UploadError
+from conftest import login, add_user
+
+
+@pytest.fixture
+def control(app):
+    """AdmissionControl with 1 slot, a line of 1 and quick polling"""
+
+    app.config.update(ADMISSION_MAX_IN_FLIGHT=1, ADMISSION_MAX_QUEUED=1, ADMISSION_MAX_PENDING=3,
+                      ADMISSION_USER_BURST=2, ADMISSION_USER_REFILL_SECONDS=60,
+                      ADMISSION_QUEUE_TIMEOUT=0.5, ADMISSION_POLL_INTERVAL=0.01)
+    return AdmissionControl(app)
+
+
+class SlotHolder:
+    """Holds one of control's slots on another thread until released"""
+
+    def __init__(self, control):
+        self.control = control
+        self.acquired = threading.Event()
+        self.release = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        try:
+            with self.control.slot():
+                self.acquired.set()
+                self.release.wait(5)
+        except GenerationRejected as e:
+            self.error = e
+
+    def done(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def test_slots_queue_then_reject(control):
+    running = SlotHolder(control)
+    assert running.acquired.wait(5)
+    waiting = SlotHolder(control)
+    while control.stats()["waiting"] == 0:
+        time.sleep(0.01)
+
+    # one running, one in line: no room left
+    with pytest.raises(GenerationRejected) as rejected:
+        with control.slot():
+            pass
+    assert rejected.value.reason == "busy"
+
+    running.done()
+    assert waiting.acquired.wait(5)
+    waiting.done()
+    assert waiting.error is None
+    assert control.stats()["running"] == 0
+
+
+def test_waiting_too_long_for_a_slot_is_rejected(control):
+    running = SlotHolder(control)
+    assert running.acquired.wait(5)
+
+    with pytest.raises(GenerationRejected) as rejected:
+        with control.slot():
+            pass
+
+    running.done()
+    assert rejected.value.reason == "timeout"
+    assert control.stats()["waiting"] == 0
+
+
+def test_slot_is_released_when_the_generation_fails(control):
+    with pytest.raises(RuntimeError):
+        with control.slot():
+            raise RuntimeError("openai is down")
+
+    assert control.stats()["running"] == 0
+
+
+def test_pending_places_run_out_until_generations_finish(control):
+    tickets = []
+    for user_id in range(3):
+        (ticket,), reason = control.admit(user_id)
+        tickets.append(ticket)
+        assert reason is None
+    assert control.stats()["pending"] == 3
+
+    with pytest.raises(GenerationRejected) as rejected:
+        control.admit(4)
+    assert rejected.value.reason == "busy"
+
+    control.finish(tickets[0])
+    assert control.stats()["pending"] == 2
+    control.admit(4)
+
+
+def test_batches_get_the_places_left(control):
+    tickets, reason = control.admit(1, count=5)
+
+    # 3 places, the user's burst of 2 tokens takes 2 of them
+    assert (len(tickets), reason) == (2, "quota")
+    assert control.stats()["pending"] == 2
+
+
+def test_users_exhaust_their_burst_then_refill(control, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("admission.time.time", lambda: now[0])
+    for _ in range(2):
+        (ticket,), _ = control.admit(1)
+        control.finish(ticket)
+
+    with pytest.raises(GenerationRejected) as rejected:
+        control.admit(1)
+    assert rejected.value.reason == "quota"
+    assert rejected.value.retry_after == pytest.approx(60)
+    # other users have their own bucket
+    control.admit(2)
+
+    now[0] += 60
+    control.admit(1)
+    with pytest.raises(GenerationRejected):
+        control.admit(1)
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    monkeypatch.setattr(s3_uploader, "upload_concept_images",
+                        lambda image_urls, scrib_id: [{"url": url, "variants": []} for url in image_urls])
+
+
+def create_scrib(client, title):
+    return client.post("/create-scrib", data={"title": title, "prompt": "a prompt"})
+
+
+def test_create_scrib_past_the_quota_is_429_with_retry_after(make_app, uploads):
+    app = make_app(ADMISSION_USER_BURST="1", ADMISSION_USER_REFILL_SECONDS="120")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+
+    assert create_scrib(client, "First").status_code == 302
+    response = create_scrib(client, "Second")
+
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 120
+
+
+def test_create_scrib_when_saturated_is_503_with_retry_after(make_app, uploads):
+    app = make_app(ADMISSION_MAX_PENDING="1")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+    admission.admit("someone else")
+
+    response = create_scrib(client, "First")
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) == app.config["ADMISSION_RETRY_AFTER"]
+
+
+def fail_openai(monkeypatch):
+    def submit(coroutine):
+        coroutine.close()
+        future = Future()
+        future.set_exception(RuntimeError("openai is down"))
+        return future
+
+    monkeypatch.setattr(openai_client, "submit", submit)
+
+
+def fail_upload(monkeypatch):
+    def upload_concept_images(image_urls, scrib_id):
+        raise S3UploadError("bucket unavailable")
+
+    monkeypatch.setattr(s3_uploader, "upload_concept_images", upload_concept_images)
+
+
+@pytest.mark.parametrize("fail", [fail_openai, fail_upload])
+def test_failed_jobs_give_back_their_place_and_slot(app, client, user, monkeypatch, fail):
+    fail(monkeypatch)
+    login(client, user)
+
+    create_scrib(client, "First")
+
+    with app.app_context():
+        assert GenerationJob.query.one().status == GenerationJob.FAILED
+    stats = admission.stats()
+    assert (stats["pending"], stats["running"], stats["waiting"]) == (0, 0, 0)
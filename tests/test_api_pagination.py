@@ -0,0 +1,96 @@
+"""The api's keyset pages (?after=<id> cursors) and ?fields= projections."""
+import pytest
+
+from models import Scrib
+from conftest import add_user, add_scrib
+
+
+@pytest.fixture
+def scribs(app, user):
+    """ids of 5 scribs, oldest first"""
+
+    with app.app_context():
+        return [add_scrib(user, title=f"Scrib {n}").id for n in range(5)]
+
+
+def api_pages(client, url):
+    """every page of a paginated api url, following next_cursor"""
+
+    pages = []
+    cursor = None
+    while True:
+        body = client.get(url + (f"&after={cursor}" if cursor else "")).get_json()
+        pages.append(body)
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_api_scribs_pages_newest_first(client, scribs):
+    pages = api_pages(client, "/api/scribs?limit=2")
+
+    assert [[scrib["id"] for scrib in page["scribs"]] for page in pages] == [
+        scribs[:2:-1], scribs[2:0:-1], scribs[:1]]
+    assert pages[0]["next_cursor"] == scribs[3]
+
+
+def test_api_users_pages_oldest_first(app, client):
+    with app.app_context():
+        user_ids = [add_user(f"user{n}").id for n in range(3)]
+
+    pages = api_pages(client, "/api/users?limit=2&fields=id")
+
+    assert [[user["id"] for user in page["users"]] for page in pages] == [user_ids[:2], user_ids[2:]]
+
+
+def test_a_full_last_page_has_no_cursor(client, scribs):
+    assert client.get("/api/scribs?limit=5").get_json()["next_cursor"] is None
+
+
+@pytest.mark.parametrize("url", ["/api/scribs?limit=0", "/api/users?limit=-1"])
+def test_limit_must_be_positive(client, url):
+    assert client.get(url).status_code == 400
+
+
+def test_limit_is_capped(client, monkeypatch, scribs):
+    monkeypatch.setattr("app.API_MAX_PAGE_SIZE", 3)
+
+    assert len(client.get("/api/scribs?limit=1000").get_json()["scribs"]) == 3
+
+
+def test_fields_project_the_scribs(client, scribs):
+    scrib = client.get("/api/scribs?fields=id, title,user_username&limit=1").get_json()["scribs"][0]
+
+    assert scrib == {"id": scribs[-1], "title": "Scrib 4", "user_username": "viewer"}
+
+
+def test_every_field_without_a_projection(client, scribs):
+    scrib = client.get("/api/scribs?limit=1").get_json()["scribs"][0]
+
+    assert set(scrib) == set(Scrib.SERIALIZERS)
+    assert scrib["concept_images"] == ["https://example.com/0.png", "https://example.com/1.png"]
+
+
+def test_fields_project_users_and_their_scribs(client, scribs):
+    users = client.get("/api/users?fields=username,scribs&scrib_fields=title").get_json()["users"]
+
+    assert users == [{"username": "viewer", "scribs": [{"title": f"Scrib {n}"} for n in range(5)]}]
+
+
+def test_users_without_their_scribs(client, scribs):
+    user = client.get("/api/users?fields=id,username,bio").get_json()["users"][0]
+
+    assert set(user) == {"id", "username", "bio"}
+
+
+@pytest.mark.parametrize("url, error", [
+    ("/api/scribs?fields=id,password", "Unknown fields: password"),
+    ("/api/scribs/export?fields=title,nope", "Unknown fields: nope"),
+    ("/api/users?fields=password,email_hash", "Unknown fields: password, email_hash"),
+    ("/api/users?scrib_fields=secret", "Unknown scrib_fields: secret"),
+])
+def test_unknown_fields_are_rejected(client, url, error):
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
@@ -0,0 +1,160 @@
+"""POST /api/scribs/batch: every item is queued or rejected on its own, and failures stay with their item."""
+import pytest
+
+from app import s3_uploader, admission
+from models import Scrib, GenerationJob
+from s3_uploads import S3UploadError
+from admission import GenerationRejected
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    monkeypatch.setattr(s3_uploader, "upload_concept_images",
+                        lambda image_urls, scrib_id: [{"url": url, "variants": []} for url in image_urls])
+
+
+def post_batch(client, items, **body):
+    return client.post("/api/scribs/batch", json={"items": items, **body})
+
+
+def items(*titles):
+    return [{"title": title, "prompt": f"a prompt about {title}"} for title in titles]
+
+
+def statuses(response):
+    return [(item["title"], item["status"]) for item in response.get_json()["items"]]
+
+
+def test_batch_queues_each_item(app, client, user, uploads):
+    login(client, user)
+
+    response = post_batch(client, items("One", "Two", "Three"), concurrency=2)
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert statuses(response) == [("One", "queued"), ("Two", "queued"), ("Three", "queued")]
+    assert body["concurrency"] == 2
+    job_ids = [item["job_id"] for item in body["items"]]
+    jobs = client.get(body["status_url"]).get_json()["jobs"]
+    assert [job["id"] for job in jobs] == job_ids
+    assert {job["status"] for job in jobs} == {"done"}
+    with app.app_context():
+        assert sorted(scrib.title for scrib in Scrib.query) == ["One", "Three", "Two"]
+
+
+def test_invalid_items_are_rejected_and_the_rest_queued(app, client, user, uploads):
+    with app.app_context():
+        add_scrib(user, title="Taken")
+    login(client, user)
+
+    response = post_batch(client, [{"title": "Fine", "prompt": "a prompt"}, {"title": "", "prompt": "a prompt"},
+                                   {"title": "No prompt"}, "not an object", {"title": "Taken", "prompt": "a prompt"},
+                                   {"title": "Fine", "prompt": "the same title again"}])
+
+    assert response.status_code == 202
+    assert statuses(response) == [("Fine", "queued"), ("", "rejected"), ("No prompt", "rejected"),
+                                  (None, "rejected"), ("Taken", "rejected"), ("Fine", "rejected")]
+    errors = [item.get("error") for item in response.get_json()["items"]]
+    assert errors[4] == errors[5] == "A scrib with that title already exists. Please pick another title."
+    with app.app_context():
+        assert GenerationJob.query.count() == 1
+
+
+@pytest.mark.parametrize("body", [None, {}, {"items": []}, {"items": "One"}])
+def test_batch_needs_a_list_of_items(client, user, body):
+    login(client, user)
+
+    assert client.post("/api/scribs/batch", json=body).status_code == 400
+
+
+def test_batch_needs_a_login(client):
+    assert post_batch(client, items("One")).status_code == 401
+
+
+@pytest.mark.parametrize("concurrency", [0, -1, "2", 1.5])
+def test_concurrency_must_be_a_positive_number(client, user, concurrency):
+    login(client, user)
+
+    assert post_batch(client, items("One"), concurrency=concurrency).status_code == 400
+
+
+def test_concurrency_is_capped(make_app, uploads):
+    app = make_app(GENERATION_BATCH_CONCURRENCY="2")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+
+    assert post_batch(client, items("One"), concurrency=10).get_json()["concurrency"] == 2
+
+
+def test_batches_over_the_item_limit_are_refused(make_app, uploads):
+    app = make_app(GENERATION_BATCH_MAX_ITEMS="2")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+
+    response = post_batch(client, items("One", "Two", "Three"))
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "At most 2 items per batch"
+    with app.app_context():
+        assert GenerationJob.query.count() == 0
+    assert post_batch(client, items("One", "Two")).status_code == 202
+
+
+def test_items_past_the_quota_are_rejected(make_app, uploads):
+    app = make_app(ADMISSION_USER_BURST="2", ADMISSION_USER_REFILL_SECONDS="120")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+
+    response = post_batch(client, items("One", "Two", "Three"))
+
+    assert response.status_code == 202
+    assert statuses(response) == [("One", "queued"), ("Two", "queued"), ("Three", "rejected")]
+    assert response.get_json()["items"][2]["error"] == GenerationRejected.MESSAGES["quota"]
+    with app.app_context():
+        assert GenerationJob.query.count() == 2
+
+    # nothing left to admit
+    refused = post_batch(client, items("Four"))
+    assert refused.status_code == 429
+    assert 1 <= int(refused.headers["Retry-After"]) <= 120
+
+
+def test_items_past_the_pending_places_are_rejected(make_app, uploads):
+    app = make_app(ADMISSION_MAX_PENDING="2")
+    client = app.test_client()
+    with app.app_context():
+        login(client, add_user("viewer").id)
+    admission.admit("someone else")
+
+    response = post_batch(client, items("One", "Two"))
+
+    assert statuses(response) == [("One", "queued"), ("Two", "rejected")]
+    assert response.get_json()["items"][1]["error"] == GenerationRejected.MESSAGES["busy"]
+    # "One" ran inline and gave its place back
+    admission.admit("someone else")
+    assert post_batch(client, items("Three")).status_code == 503
+
+
+def test_a_failed_generation_leaves_the_others_alone(app, client, user, monkeypatch):
+    calls = []
+
+    def upload_concept_images(image_urls, scrib_id):
+        calls.append(scrib_id)
+        if len(calls) == 2:
+            raise S3UploadError("bucket unavailable")
+        return [{"url": url, "variants": []} for url in image_urls]
+
+    monkeypatch.setattr(s3_uploader, "upload_concept_images", upload_concept_images)
+    login(client, user)
+
+    response = post_batch(client, items("One", "Two", "Three"), concurrency=1)
+
+    assert response.status_code == 202
+    jobs = client.get(response.get_json()["status_url"]).get_json()["jobs"]
+    assert [job["status"] for job in jobs] == ["done", "failed", "done"]
+    stats = admission.stats()
+    assert (stats["pending"], stats["running"], stats["waiting"]) == (0, 0, 0)
@@ -0,0 +1,174 @@
+"""Response compression negotiated from Accept-Encoding, and the api's JSON encoders."""
+import gzip
+import json
+import uuid
+from datetime import datetime
+
+import brotli
+import pytest
+from flask import Markup
+
+import fast_json
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def scribs(app, user):
+    """enough scribs for /api/scribs to be worth compressing"""
+
+    with app.app_context():
+        return [add_scrib(user).id for _ in range(5)]
+
+
+def get(client, url, accept_encoding=None):
+    return client.get(url, headers={"Accept-Encoding": accept_encoding} if accept_encoding else {})
+
+
+def test_json_is_gzipped_for_clients_accepting_it(client, user, scribs):
+    login(client, user)
+    plain = get(client, "/api/scribs")
+
+    response = get(client, "/api/scribs", "gzip, deflate")
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("gzip;q=0, br", "br"),
+    ("identity", None),
+    ("*;q=0", None),
+])
+def test_best_accepted_encoding_is_chosen(client, user, scribs, accept_encoding, encoding):
+    response = get(client, "/api/scribs", accept_encoding)
+
+    assert response.headers.get("Content-Encoding") == encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_brotli_decodes_to_the_same_body(client, scribs):
+    plain = get(client, "/api/scribs")
+
+    response = get(client, "/api/scribs", "br")
+
+    assert brotli.decompress(response.data) == plain.data
+
+
+def test_bodies_below_the_minimum_size_are_left_alone(make_app):
+    app = make_app(COMPRESS_MIN_SIZE="100000")
+    client = app.test_client()
+
+    response = get(client, "/api/scribs", "gzip")
+
+    assert "Content-Encoding" not in response.headers
+    # the next, bigger, page may be compressed
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_images_are_not_compressed(app, client, tmp_path):
+    (tmp_path / "concept.png").write_bytes(b"\x89PNG" + b"\0" * 2000)
+    app.static_folder = str(tmp_path)
+
+    response = get(client, "/static/concept.png", "gzip")
+
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+
+
+@pytest.fixture
+def stylesheet(app, tmp_path):
+    (tmp_path / "app.css").write_text("body { color: black; }\n" * 100)
+    app.static_folder = str(tmp_path)
+    return "/static/app.css"
+
+
+def test_compressed_static_files_get_a_weak_etag(client, stylesheet):
+    plain = get(client, stylesheet)
+    etag, weak = plain.get_etag()
+    assert not weak
+
+    response = get(client, stylesheet, "gzip")
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.get_etag() == (etag, True)
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_static_files_revalidate_across_encodings(client, stylesheet):
+    strong = get(client, stylesheet).headers["ETag"]
+    weak = get(client, stylesheet, "gzip").headers["ETag"]
+
+    compressed = client.get(stylesheet, headers={"Accept-Encoding": "gzip", "If-None-Match": weak})
+    assert compressed.status_code == 304
+    assert compressed.headers["ETag"] == weak
+
+    plain = client.get(stylesheet, headers={"If-None-Match": weak})
+    assert plain.status_code == 304
+    assert plain.headers["ETag"] == strong
+
+
+def test_export_is_a_streamed_json_document(app, client, user, scribs, monkeypatch):
+    # several db batches and several chunks
+    monkeypatch.setattr("app.API_EXPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(fast_json, "STREAM_CHUNK_BYTES", 100)
+    login(client, user)
+
+    response = client.get("/api/scribs/export?fields=id,title", buffered=False)
+
+    assert response.is_streamed
+    assert len(list(response.response)) > 1
+    exported = client.get("/api/scribs/export?fields=id,title").get_json()
+    listed = client.get("/api/scribs?fields=id,title").get_json()
+    assert exported == {"scribs": listed["scribs"]}
+    assert [scrib["id"] for scrib in exported["scribs"]] == scribs[::-1]
+
+
+def test_empty_export(client):
+    assert client.get("/api/scribs/export").get_json() == {"scribs": []}
+
+
+def test_streamed_export_is_compressed_chunk_by_chunk(client, user, scribs):
+    plain = get(client, "/api/scribs/export")
+
+    response = get(client, "/api/scribs/export", "gzip")
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == plain.data
+
+
+VALUES = {
+    "text": "Once upon a time, ünïcödé and \"quotes\"\n",
+    "numbers": [0, -1, 2 ** 40, 1.5],
+    "nested": {"b": None, "a": [True, False]},
+    "timestamp": datetime(2023, 3, 1, 12, 30, 5),
+    "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    "markup": Markup("<b>bold</b>"),
+}
+
+
+def test_orjson_and_stdlib_write_the_same_json():
+    assert fast_json.orjson_dumps(VALUES) == fast_json.stdlib_dumps(VALUES)
+
+    decoded = json.loads(fast_json.stdlib_dumps(VALUES))
+    assert decoded["timestamp"] == "Wed, 01 Mar 2023 12:30:05 GMT"
+    assert list(decoded) == sorted(VALUES)
+
+
+@pytest.mark.parametrize("url", ["/api/scribs", "/api/users", "/api/scribs/export?fields=id,timestamp,concept_images"])
+def test_api_responses_are_the_same_with_either_encoder(make_app, url):
+    bodies = []
+    for encoder in ("stdlib", "orjson"):
+        # the second app shares the database file, and takes over the extensions
+        app = make_app(JSON_ENCODER=encoder)
+        if not bodies:
+            with app.app_context():
+                add_scrib(add_user("writer").id)
+        assert app.extensions["fast_json"].encoder == encoder
+        bodies.append(app.test_client().get(url).data)
+
+    assert bodies[0] == bodies[1]
@@ -0,0 +1,91 @@
+"""Repeated prompts reuse memoized OpenAI results as GENERATION_CACHE_POLICY allows.
+
+OpenAI is benchmarks/fake_openai.py, which counts the calls it gets.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import generate_scrib_bundle, generation_cache
+from models import db, GenerationCacheEntry
+from generation_cache import GenerationCache, generation_key, TEXT, IMAGES
+
+PROMPT = "A lighthouse keeper who collects storms"
+
+
+def openai_calls(fake_openai):
+    return {TEXT: fake_openai.calls.get("completions", 0), IMAGES: fake_openai.calls.get("images/generations", 0)}
+
+
+def generate_twice(app, fake_openai):
+    """Generates the same prompt twice, spelled differently the second time.
+    Returns both results and the OpenAI calls made per kind
+    """
+
+    before = openai_calls(fake_openai)
+    with app.app_context():
+        first = generate_scrib_bundle(PROMPT)
+        second = generate_scrib_bundle(f"  {PROMPT.upper()}\n")
+    after = openai_calls(fake_openai)
+    return first, second, {kind: after[kind] - before[kind] for kind in after}
+
+
+@pytest.mark.parametrize("policy, calls, entries", [
+    ("text", {TEXT: 1, IMAGES: 2}, 1),
+    ("text_and_images", {TEXT: 1, IMAGES: 1}, 2),
+    ("bypass", {TEXT: 2, IMAGES: 2}, 0),
+])
+def test_policy_decides_what_is_reused(make_app, fake_openai, policy, calls, entries):
+    app = make_app(GENERATION_CACHE_POLICY=policy)
+
+    [first_urls, first_text], [second_urls, second_text], made = generate_twice(app, fake_openai)
+
+    assert made == calls
+    assert second_text == first_text
+    if calls[IMAGES] == 1:
+        assert second_urls == first_urls
+    with app.app_context():
+        assert GenerationCacheEntry.query.count() == entries
+
+
+def test_lookups_are_counted_in_metrics(app, client, fake_openai):
+    before = generation_cache.stats()
+
+    generate_twice(app, fake_openai)
+
+    after = generation_cache.stats()
+    assert after["hits"][TEXT] - before["hits"][TEXT] == 1
+    assert after["misses"][TEXT] - before["misses"][TEXT] == 1
+    assert "scribcraft_generation_cache_lookups_total" in client.get("/metrics").get_data(as_text=True)
+
+
+def test_expired_entries_are_misses(app):
+    key = generation_key(TEXT, "base", PROMPT, {})
+    with app.app_context():
+        generation_cache.set(TEXT, key, "story")
+        assert generation_cache.get(TEXT, key) == "story"
+
+        GenerationCacheEntry.query.get(key).expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert generation_cache.get(TEXT, key) is None
+
+
+def test_least_recently_used_entries_are_evicted(app):
+    app.config["GENERATION_CACHE_MAX_ENTRIES"] = 2
+    cache = GenerationCache(app)
+    keys = [generation_key(TEXT, "base", f"prompt {n}", {}) for n in range(3)]
+
+    with app.app_context():
+        cache.set(TEXT, keys[0], "first")
+        cache.set(TEXT, keys[1], "second")
+        # a hit keeps the first entry around
+        assert cache.get(TEXT, keys[0]) == "first"
+        cache.set(TEXT, keys[2], "third")
+
+        assert {entry.key for entry in GenerationCacheEntry.query} == {keys[0], keys[2]}
+
+
+def test_key_ignores_case_and_whitespace_but_not_params():
+    assert generation_key(TEXT, "base", "A  Prompt", {"n": 1}) == generation_key(TEXT, "base", " a prompt\n", {"n": 1})
+    assert generation_key(TEXT, "base", "a prompt", {"n": 1}) != generation_key(TEXT, "base", "a prompt", {"n": 2})
+    assert generation_key(TEXT, "base", "a prompt", {}) != generation_key(IMAGES, "base", "a prompt", {})
@@ -0,0 +1,140 @@
+"""Conditional GETs answered with a 304 and content hashed, long lived static urls."""
+import os
+from datetime import timedelta
+
+import pytest
+from flask import url_for
+from werkzeug.http import http_date
+
+from app import s3_uploader
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def app(make_app):
+    # collection versions come from the cache's tag versions, which the null backend doesn't keep
+    return make_app(RESPONSE_CACHE_BACKEND="memory")
+
+
+@pytest.fixture
+def reader(app, user):
+    """a logged in client that never has flash messages pending"""
+
+    client = app.test_client()
+    login(client, user)
+    return client
+
+
+@pytest.fixture
+def scrib(app, user):
+    with app.app_context():
+        return add_scrib(user).id
+
+
+def test_api_scribs_revalidates_with_a_304(reader, scrib):
+    response = reader.get("/api/scribs")
+    etag = response.headers["ETag"]
+
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    revalidated = reader.get("/api/scribs", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+    assert revalidated.headers["ETag"] == etag
+
+
+def test_scrib_page_revalidates_with_a_304(reader, scrib):
+    response = reader.get(f"/scribs/{scrib}")
+    etag, last_modified = response.headers["ETag"], response.last_modified
+
+    assert reader.get(f"/scribs/{scrib}", headers={"If-None-Match": etag}).status_code == 304
+    assert reader.get(f"/scribs/{scrib}", headers={"If-Modified-Since": http_date(last_modified)}).status_code == 304
+    earlier = http_date(last_modified - timedelta(seconds=1))
+    assert reader.get(f"/scribs/{scrib}", headers={"If-Modified-Since": earlier}).status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    assert reader.get(f"/scribs/{scrib}", headers={"If-None-Match": '"stale"',
+                                                   "If-Modified-Since": http_date(last_modified)}).status_code == 200
+
+
+def test_pending_flash_messages_are_never_a_304(app, client, user, scrib):
+    login(client, user)
+    etag = client.get(f"/scribs/{scrib}").headers["ETag"]
+    with client.session_transaction() as session:
+        session["_flashes"] = [("success", "Scrib deleted!")]
+
+    assert client.get(f"/scribs/{scrib}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_create_changes_the_collection_etag(app, client, user, reader, scrib, monkeypatch):
+    monkeypatch.setattr(s3_uploader, "upload_concept_images",
+                        lambda image_urls, scrib_id: [{"url": url, "variants": []} for url in image_urls])
+    etag = reader.get("/api/scribs").headers["ETag"]
+    login(client, user)
+
+    client.post("/create-scrib", data={"title": "New", "prompt": "a new scrib"})
+
+    assert reader.get("/api/scribs", headers={"If-None-Match": etag}).status_code == 200
+    assert reader.get("/api/scribs").headers["ETag"] != etag
+
+
+def test_delete_changes_the_collection_etag(app, client, user, reader, scrib):
+    # the deleted scrib isn't the newest, max(id) stays the same
+    with app.app_context():
+        add_scrib(user)
+    etag = reader.get("/api/scribs").headers["ETag"]
+    login(client, user)
+
+    client.post(f"/scribs/delete/{scrib}")
+
+    assert reader.get("/api/scribs", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_profile_edit_changes_the_scrib_page_etag(app, client, user, scrib):
+    with app.app_context():
+        reader_id = add_user("reader").id
+    reader = app.test_client()
+    login(reader, reader_id)
+    etag = reader.get(f"/scribs/{scrib}").headers["ETag"]
+    login(client, user)
+
+    client.post(f"/users/edit/{user}", data={"username": "renamed", "email": "viewer@example.com",
+                                             "image_url": "https://example.com/me.png", "about_me": ""})
+
+    assert reader.get(f"/scribs/{scrib}", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.fixture
+def static_folder(app, tmp_path):
+    (tmp_path / "app.css").write_text("body { color: black; }")
+    app.static_folder = str(tmp_path)
+    return tmp_path
+
+
+def static_url(app, filename):
+    with app.test_request_context():
+        return url_for("static", filename=filename)
+
+
+def test_static_urls_carry_the_content_hash(app, client, static_folder):
+    url = static_url(app, "app.css")
+
+    assert "?v=" in url
+    response = client.get(url)
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert static_url(app, "app.css") == url
+
+    (static_folder / "app.css").write_text("body { color: red; }")
+    # hashes are recomputed when the mtime changes, don't depend on the filesystem's resolution
+    mtime = os.path.getmtime(static_folder / "app.css")
+    os.utime(static_folder / "app.css", (mtime + 1, mtime + 1))
+    assert static_url(app, "app.css") != url
+
+
+def test_unversioned_static_urls_are_revalidated(app, client, static_folder):
+    assert static_url(app, "missing.css") == "/static/missing.css"
+
+    response = client.get("/static/app.css")
+
+    assert response.status_code == 200
+    assert "immutable" not in response.headers.get("Cache-Control", "")
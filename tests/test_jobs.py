@@ -0,0 +1,198 @@
+"""Scrib generation runs as a background job: the POST queues it, the job page reports its status.
+
+The test profile runs jobs inline, OpenAI is benchmarks/fake_openai.py and the S3 upload is stubbed.
+"""
+import time
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from flask import current_app
+
+from app import s3_uploader, admission, job_reaper, run_scrib_generation_job
+from jobs import JobQueue
+from models import db, Scrib, GenerationJob
+from s3_uploads import S3UploadError
+from fake_openai import STORY_PARAGRAPHS
+from conftest import login, add_user
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """urls handed to the (stubbed) s3 upload"""
+
+    uploaded = []
+
+    def upload_concept_images(image_urls, scrib_id):
+        uploaded.extend(image_urls)
+        return [{"url": f"https://s3.example.com/{scrib_id}/{n}.png", "variants": []}
+                for n in range(len(image_urls))]
+
+    monkeypatch.setattr(s3_uploader, "upload_concept_images", upload_concept_images)
+    return uploaded
+
+
+def create_scrib(client, title="The cartographer"):
+    return client.post("/create-scrib", data={"title": title, "prompt": "a map of a place that doesn't exist"})
+
+
+def test_create_scrib_queues_a_job_that_generates_the_scrib(app, client, user, uploads):
+    login(client, user)
+
+    response = create_scrib(client)
+
+    assert response.status_code == 302
+    with app.app_context():
+        job = GenerationJob.query.one()
+        assert response.headers["Location"].endswith(f"/jobs/{job.id}")
+        assert job.status == GenerationJob.DONE
+        assert job.started_at is not None and job.finished_at is not None
+
+        scrib = Scrib.query.get(job.scrib_id)
+        assert scrib.title == "The cartographer"
+        assert scrib.user_id == user
+        assert scrib.scrib_text.strip() == "\n\n".join(STORY_PARAGRAPHS)
+        assert [image.concept_image_url for image in scrib.concept_images] == [
+            f"https://s3.example.com/{scrib.id}/{n}.png" for n in range(3)]
+    assert len(uploads) == 3
+
+    status = client.get(f"/api/jobs/{job.id}").get_json()["job"]
+    assert status["status"] == "done"
+    assert status["scrib_id"] == scrib.id
+
+
+def test_failed_upload_fails_the_job(app, client, user, monkeypatch):
+    def upload_concept_images(image_urls, scrib_id):
+        raise S3UploadError("bucket unavailable")
+
+    monkeypatch.setattr(s3_uploader, "upload_concept_images", upload_concept_images)
+    login(client, user)
+
+    create_scrib(client)
+
+    with app.app_context():
+        job = GenerationJob.query.one()
+        assert job.status == GenerationJob.FAILED
+        assert job.error_message == "bucket unavailable"
+    assert client.get(f"/api/jobs/{job.id}").get_json()["job"]["status"] == "failed"
+
+
+def test_duplicate_title_fails_the_job(app, client, user, uploads):
+    login(client, user)
+
+    create_scrib(client)
+    create_scrib(client)
+
+    with app.app_context():
+        first, second = GenerationJob.query.order_by(GenerationJob.id).all()
+        assert first.status == GenerationJob.DONE
+        assert second.status == GenerationJob.FAILED
+        assert "already exists" in second.error_message
+        assert Scrib.query.count() == 1
+
+
+def test_jobs_of_other_users_are_hidden(app, client, user, uploads):
+    with app.app_context():
+        other = add_user("other").id
+    login(client, other)
+    create_scrib(client)
+    with app.app_context():
+        job_id = GenerationJob.query.one().id
+
+    login(client, user)
+    assert client.get(f"/api/jobs/{job_id}").status_code == 403
+
+
+def test_thread_backend_runs_jobs_in_an_app_context_off_the_calling_thread(app):
+    app.config["JOB_QUEUE_BACKEND"] = "thread"
+    queue = JobQueue(app)
+    ran = []
+
+    def job(value):
+        ran.append((value, current_app.name, threading.current_thread().name))
+
+    queue.enqueue(job, 1).result(timeout=5)
+    queue.shutdown()
+
+    [(value, app_name, thread_name)] = ran
+    assert (value, app_name) == (1, app.name)
+    assert thread_name.startswith("scribcraft-job")
+
+
+def test_enqueue_many_caps_concurrency(app):
+    app.config["JOB_QUEUE_BACKEND"] = "thread"
+    app.config["JOB_QUEUE_WORKERS"] = 8
+    queue = JobQueue(app)
+    lock = threading.Lock()
+    running = []
+    peak = []
+    finished = threading.Semaphore(0)
+
+    def job(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(n)
+        finished.release()
+
+    queue.enqueue_many(job, [(n,) for n in range(10)], concurrency=3)
+    for _ in range(10):
+        assert finished.acquire(timeout=5)
+    queue.shutdown()
+
+    assert max(peak) <= 3
+    assert len(peak) == 10
+
+
+def add_job(app, user_id, status=GenerationJob.QUEUED, age=0):
+    """id of a job created age seconds ago holding an admission place, like create_scrib's"""
+
+    with app.app_context():
+        (ticket,), _ = admission.admit(user_id)
+        job = GenerationJob(title=f"Job {status} {age}", prompt="a prompt", user_id=user_id, status=status,
+                            admission_ticket=ticket, created_at=datetime.utcnow() - timedelta(seconds=age))
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+
+def test_reaper_fails_stale_jobs_and_gives_back_their_places(app, user):
+    timeout = app.config["GENERATION_JOB_TIMEOUT"]
+    stale_queued = add_job(app, user, age=timeout + 1)
+    stale_running = add_job(app, user, GenerationJob.RUNNING, age=timeout + 1)
+    fresh = add_job(app, user, GenerationJob.RUNNING, age=timeout - 60)
+    assert admission.stats()["pending"] == 3
+
+    with app.app_context():
+        assert sorted(job_reaper.reap()) == [stale_queued, stale_running]
+
+        assert GenerationJob.query.get(stale_queued).status == GenerationJob.FAILED
+        assert GenerationJob.query.get(stale_running).status == GenerationJob.FAILED
+        assert GenerationJob.query.get(stale_running).finished_at is not None
+        assert GenerationJob.query.get(fresh).status == GenerationJob.RUNNING
+        assert job_reaper.reap() == []
+    assert admission.stats()["pending"] == 1
+
+
+def test_job_apis_report_stale_jobs_as_failed(app, client, user):
+    job_id = add_job(app, user, age=app.config["GENERATION_JOB_TIMEOUT"] + 1)
+    login(client, user)
+
+    status = client.get(f"/api/jobs/{job_id}").get_json()["job"]
+
+    assert status["status"] == "failed"
+    assert admission.stats()["pending"] == 0
+
+
+def test_reaped_jobs_are_not_run(app, user, uploads):
+    job_id = add_job(app, user, age=app.config["GENERATION_JOB_TIMEOUT"] + 1)
+
+    with app.app_context():
+        job_reaper.reap()
+        run_scrib_generation_job(job_id)
+
+        assert GenerationJob.query.get(job_id).status == GenerationJob.FAILED
+        assert Scrib.query.count() == 0
+    assert uploads == []
@@ -0,0 +1,165 @@
+"""Logins: failed attempts are throttled per username and per client address before any bcrypt
+work, bcrypt runs on a bounded pool that sheds load, and hashes follow BCRYPT_LOG_ROUNDS.
+"""
+import threading
+
+import pytest
+
+from app import password_hash_pool, login_throttle
+from models import db, bcrypt, User
+from password_hashing import PasswordHashPool, PasswordHashPoolFull, hash_log_rounds
+
+PASSWORD = "correct horse battery"
+
+
+@pytest.fixture(autouse=True)
+def forget_failures(monkeypatch):
+    """login_throttle lives as long as the process, start each test with no failures counted"""
+
+    monkeypatch.setattr(login_throttle, "failures", {})
+
+
+@pytest.fixture
+def member(app):
+    """username of a user with PASSWORD"""
+
+    with app.app_context():
+        User.signup(username="member", email="member@example.com", password=PASSWORD,
+                    image_url=User.image_url.default.arg)
+        db.session.commit()
+    return "member"
+
+
+def log_in(client, username, password=PASSWORD, **headers):
+    return client.post("/login", data={"username": username, "password": password}, headers=headers)
+
+
+def fail(client, username, times, **headers):
+    for _ in range(times):
+        assert log_in(client, username, "wrong password", **headers).status_code == 200
+
+
+def test_valid_login_redirects(client, member):
+    assert log_in(client, member).status_code == 302
+
+
+def test_failures_lock_the_username_out(app, client, member):
+    fail(client, member, app.config["LOGIN_MAX_FAILURES_PER_USERNAME"])
+
+    # even the right password is refused, without hashing it
+    response = log_in(client, member)
+
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= app.config["LOGIN_FAILURE_WINDOW"]
+    assert log_in(client, "someone", "wrong password").status_code == 200
+
+
+def test_a_login_forgets_the_username_failures(app, client, member):
+    fail(client, member, app.config["LOGIN_MAX_FAILURES_PER_USERNAME"] - 1)
+    assert log_in(client, member).status_code == 302
+    client.get("/logout")
+
+    fail(client, member, app.config["LOGIN_MAX_FAILURES_PER_USERNAME"] - 1)
+    assert log_in(client, member).status_code == 302
+
+
+def test_failures_lock_the_address_out(app, member):
+    client = app.test_client()
+    for n in range(app.config["LOGIN_MAX_FAILURES_PER_IP"]):
+        fail(client, f"user{n}", 1)
+
+    assert log_in(client, member).status_code == 429
+    other_address = app.test_client()
+    other_address.environ_base["REMOTE_ADDR"] = "198.51.100.7"
+    assert log_in(other_address, member).status_code == 302
+
+
+@pytest.mark.parametrize("trusted_proxies, other_client_locked_out", [("1", False), ("0", True)])
+def test_client_address_behind_a_proxy(make_app, trusted_proxies, other_client_locked_out):
+    app = make_app(TRUSTED_PROXIES=trusted_proxies)
+    with app.app_context():
+        User.signup(username="member", email="member@example.com", password=PASSWORD,
+                    image_url=User.image_url.default.arg)
+        db.session.commit()
+    # every request comes from the proxy's address
+    client = app.test_client()
+
+    for n in range(app.config["LOGIN_MAX_FAILURES_PER_IP"]):
+        fail(client, f"user{n}", 1, **{"X-Forwarded-For": "203.0.113.1"})
+
+    assert log_in(client, "member", **{"X-Forwarded-For": "203.0.113.1"}).status_code == 429
+    # with the proxy trusted it's another client, otherwise the same address
+    response = log_in(client, "member", **{"X-Forwarded-For": "203.0.113.2"})
+    assert response.status_code == (429 if other_client_locked_out else 302)
+
+
+@pytest.fixture
+def full_pool(monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(password_hash_pool, "slots", slots)
+
+
+def test_login_is_shed_with_503_when_the_hash_pool_is_full(app, client, member, full_pool):
+    response = log_in(client, member)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app.config["PASSWORD_HASH_RETRY_AFTER"])
+    # shedding isn't a failed attempt
+    assert login_throttle.stats()["size"] == 0
+
+
+def test_signup_is_shed_with_503_when_the_hash_pool_is_full(app, client, full_pool):
+    response = client.post("/signup", data={"username": "newcomer", "email": "newcomer@example.com",
+                                            "password": PASSWORD, "password_confirm": PASSWORD})
+
+    assert response.status_code == 503
+    with app.app_context():
+        assert User.query.filter_by(username="newcomer").count() == 0
+
+
+def test_pool_refuses_past_its_workers_and_queue(app):
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_QUEUE=1)
+    pool = PasswordHashPool(app)
+    release = threading.Event()
+    threads = [threading.Thread(target=pool.run, args=(release.wait, 5)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    # one hashing, one waiting for the worker
+    while pool.slots._value:
+        pass
+
+    with pytest.raises(PasswordHashPoolFull):
+        pool.run(len, "")
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert pool.run(len, "abc") == 3
+
+
+def stored_hash(app, username):
+    with app.app_context():
+        return User.query.filter_by(username=username).one().password
+
+
+def test_login_rehashes_with_the_current_cost(app, client):
+    with app.app_context():
+        db.session.add(User(username="veteran", email="veteran@example.com",
+                            password=bcrypt.generate_password_hash(PASSWORD, 5).decode(),
+                            image_url=User.image_url.default.arg))
+        db.session.commit()
+
+    assert log_in(client, "veteran").status_code == 302
+
+    pw_hash = stored_hash(app, "veteran")
+    assert hash_log_rounds(pw_hash) == app.config["BCRYPT_LOG_ROUNDS"] == 4
+    assert bcrypt.check_password_hash(pw_hash, PASSWORD)
+
+
+def test_login_keeps_the_hash_with_the_current_cost(app, client, member):
+    before = stored_hash(app, member)
+
+    assert log_in(client, member).status_code == 302
+
+    assert stored_hash(app, member) == before
@@ -0,0 +1,134 @@
+"""Keyset pagination of the server rendered lists: (date_time, id) cursors and the html
+fragments infinite scroll loads the next pages with.
+"""
+import re
+import html
+from datetime import datetime
+
+import pytest
+
+from models import db, User, Scrib
+from pagination import encode_cursor, decode_cursor, newest_first_page
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def scribs(app, user):
+    """ids of 5 scribs, oldest first"""
+
+    with app.app_context():
+        return [add_scrib(user, title=f"Scrib {n}").id for n in range(5)]
+
+
+def test_cursors_round_trip():
+    date_time = datetime(2023, 3, 1, 12, 30, 5, 123456)
+
+    assert decode_cursor(encode_cursor(date_time, 42)) == (date_time, 42)
+    assert decode_cursor(None) is None and decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor(datetime(2023, 3, 1), 1)[:-2], "WyJub3QgYSBkYXRlIiwgMV0"])
+def test_bad_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.fixture
+def tied_scribs(app, user):
+    """ids of 5 scribs created in the same instant"""
+
+    with app.app_context():
+        ids = [add_scrib(user).id for _ in range(5)]
+        Scrib.query.update({"date_time": datetime(2023, 3, 1, 12, 0)})
+        db.session.commit()
+    return ids
+
+
+def test_rows_created_in_the_same_instant_land_on_exactly_one_page(app, tied_scribs):
+    with app.app_context():
+        # an older one after the ties
+        older = add_scrib(Scrib.query.first().user_id)
+        older.date_time = datetime(2023, 2, 1)
+        db.session.commit()
+
+        pages, cursor = [], None
+        while True:
+            rows, next_cursor = newest_first_page(Scrib.query, Scrib, decode_cursor(cursor), 2)
+            pages.append([row.id for row in rows])
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+
+        assert pages == [tied_scribs[:2:-1], tied_scribs[2:0:-1], [tied_scribs[0], older.id]]
+
+
+def fragment_pages(client, url):
+    """titles of every page of an infinite scroll list, following its next page links"""
+
+    pages = []
+    while url:
+        body = client.get(url).get_data(as_text=True)
+        pages.append(re.findall(r"<h4>(.*?)</h4>|<p class=\"card-user\">(.*?)</p>", body))
+        next_url = re.search(r'data-fragment-url="([^"]*)"', body)
+        url = html.unescape(next_url.group(1)) if next_url else None
+    return [[title or username for title, username in page] for page in pages]
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    monkeypatch.setattr("app.HTML_PAGE_SIZE", 2)
+
+
+def test_dashboard_fragments_walk_every_scrib(client, user, tied_scribs, small_pages):
+    login(client, user)
+
+    pages = fragment_pages(client, "/fragments/scribs")
+
+    titles = [title for page in pages for title in page]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert len(set(titles)) == 5
+
+
+def test_dashboard_links_the_next_page(client, user, scribs, small_pages):
+    login(client, user)
+
+    body = client.get("/").get_data(as_text=True)
+
+    assert re.findall(r"<h4>(.*?)</h4>", body) == ["Scrib 4", "Scrib 3"]
+    page_url = html.unescape(re.search(r'class="next-page" href="([^"]*)"', body).group(1))
+    assert re.findall(r"<h4>(.*?)</h4>", client.get(page_url).get_data(as_text=True)) == ["Scrib 2", "Scrib 1"]
+
+
+def test_profile_fragments_walk_the_users_scribs(app, client, user, scribs, small_pages):
+    with app.app_context():
+        add_scrib(add_user("other").id, title="Not theirs")
+    login(client, user)
+
+    pages = fragment_pages(client, f"/fragments/users/{user}/scribs")
+
+    assert pages == [["Scrib 4", "Scrib 3"], ["Scrib 2", "Scrib 1"], ["Scrib 0"]]
+
+
+def test_users_fragments_walk_every_user(app, client, user, small_pages):
+    with app.app_context():
+        for n in range(3):
+            add_user(f"user{n}")
+        User.query.update({"date_time": datetime(2023, 3, 1)})
+        db.session.commit()
+    login(client, user)
+
+    pages = fragment_pages(client, "/fragments/users")
+
+    assert sorted(username for page in pages for username in page) == ["user0", "user1", "user2", "viewer"]
+    assert [len(page) for page in pages] == [2, 2]
+
+
+@pytest.mark.parametrize("url", ["/fragments/scribs?after=garbage", "/users?after=garbage"])
+def test_bad_cursors_are_a_400(client, user, url):
+    login(client, user)
+
+    assert client.get(url).status_code == 400
+
+
+def test_fragments_need_a_login(client):
+    assert client.get("/fragments/scribs").status_code == 401
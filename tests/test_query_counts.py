@@ -0,0 +1,45 @@
+"""The list pages and APIs issue a fixed number of SQL statements, however many rows they render.
+
+Each route is requested against N users and scribs and again against 2N: a query per rendered
+row (N+1) shows up as a different count.
+"""
+import pytest
+
+from conftest import login, add_user, add_scrib
+
+ROUTES = ["/", "/api/scribs?limit=100", "/api/users?limit=100", "/users/{user}"]
+ROWS = 10
+
+
+@pytest.fixture
+def app(app):
+    app.config["SQL_QUERY_COUNT_HEADER"] = True
+    return app
+
+
+def seed(app, first, count, viewer_id):
+    """count more users with a scrib each, and count more scribs of the viewer"""
+
+    with app.app_context():
+        for n in range(first, first + count):
+            add_scrib(add_user(f"user{n}").id)
+            add_scrib(viewer_id)
+
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return int(response.headers["X-SQL-Queries"])
+
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_query_count_does_not_grow_with_rows(app, client, user, route):
+    url = route.format(user=user)
+    login(client, user)
+
+    seed(app, 0, ROWS, user)
+    with_n = query_count(client, url)
+    seed(app, ROWS, ROWS, user)
+    with_2n = query_count(client, url)
+
+    assert with_2n == with_n, f"{url} issued {with_n} queries for {ROWS} rows, {with_2n} for {2 * ROWS}"
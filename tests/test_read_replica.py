@@ -0,0 +1,124 @@
+"""Read only routes read from the replica bind, writes and the client's reads right after them use the primary.
+
+The primary and the replica are two SQLite files, the replica a copy of the primary taken after
+seeding, so rows added later only exist on the primary.
+"""
+import os
+import time
+import shutil
+import contextlib
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from read_replica import LAST_WRITE_KEY
+from conftest import login, add_user, add_scrib
+
+PRIMARY = "scribcraft.sqlite3"
+REPLICA = "replica.sqlite3"
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    # SQLite has no pool to size, the setting must not break its engines
+    app = make_app(DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / REPLICA}", SQLALCHEMY_POOL_SIZE="3")
+    with app.app_context():
+        user = add_user("viewer")
+        add_user("other")
+        add_scrib(user.id, title="On both")
+    shutil.copy(tmp_path / PRIMARY, tmp_path / REPLICA)
+    return app
+
+
+@pytest.fixture
+def user(app):
+    return 1
+
+
+@pytest.fixture
+def other_user(app):
+    return 2
+
+
+@contextlib.contextmanager
+def databases_used():
+    """Collects the file names of the databases statements run on"""
+
+    used = set()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        used.add(os.path.basename(conn.engine.url.database))
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield used
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+
+def titles(client):
+    return [scrib["title"] for scrib in client.get("/api/scribs").get_json()["scribs"]]
+
+
+def test_read_only_routes_use_the_replica(app, client, user):
+    login(client, user)
+    with app.app_context():
+        add_scrib(user, title="Only on the primary")
+
+    for url in ["/", "/api/scribs", "/api/users", f"/users/{user}", "/api/scribs/search?q=both"]:
+        with databases_used() as used:
+            assert client.get(url).status_code == 200
+        assert used == {REPLICA}, url
+
+    assert titles(client) == ["On both"]
+
+
+def test_other_routes_use_the_primary(app, client, user):
+    login(client, user)
+
+    with databases_used() as used:
+        assert client.get("/api/jobs?ids=1").status_code == 200
+
+    assert used == {PRIMARY}
+
+
+def test_reads_stay_on_the_primary_after_a_write(app, client, user, other_user):
+    login(client, user)
+
+    with databases_used() as used:
+        client.post(f"/users/edit/{user}", data={"username": "renamed", "email": "viewer@example.com",
+                                                 "image_url": "https://example.com/me.png", "about_me": ""})
+    assert used == {PRIMARY}
+
+    with databases_used() as used:
+        profile = client.get(f"/users/{user}")
+    assert used == {PRIMARY}
+    assert b"renamed" in profile.data
+
+    # other clients read from the replica, which hasn't seen the write yet
+    other = app.test_client()
+    login(other, other_user)
+    with databases_used() as used:
+        profile = other.get(f"/users/{user}")
+    assert used == {REPLICA}
+    assert profile.status_code == 200
+    assert b"renamed" not in profile.data
+
+    # and so does the writer once the sticky window is over
+    with client.session_transaction() as session:
+        session[LAST_WRITE_KEY] = time.time() - app.config["REPLICA_STICKY_SECONDS"] - 1
+    with databases_used() as used:
+        client.get(f"/users/{user}")
+    assert used == {REPLICA}
+
+
+def test_scrib_missing_from_the_replica_is_read_from_the_primary(app, client, user):
+    login(client, user)
+    with app.app_context():
+        scrib_id = add_scrib(user, title="Just generated").id
+
+    response = client.get(f"/scribs/{scrib_id}")
+
+    assert response.status_code == 200
+    assert b"Just generated" in response.data
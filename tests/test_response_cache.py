@@ -0,0 +1,117 @@
+"""The memory response cache: write routes drop exactly the entries built from what they changed,
+and the LRU stays within its entry and byte bounds.
+"""
+import pytest
+
+from app import s3_uploader
+from response_cache import MemoryCacheBackend
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(RESPONSE_CACHE_BACKEND="memory")
+
+
+@pytest.fixture
+def seeded(app, user):
+    """ids of the viewer's scrib, the other user and their scrib"""
+
+    with app.app_context():
+        other = add_user("other").id
+        return {"mine": add_scrib(user).id, "other": other, "theirs": add_scrib(other).id}
+
+
+@pytest.fixture
+def warm(client, user, seeded):
+    """Requests every cached page once, returns the keys of their entries"""
+
+    login(client, user)
+    urls = ["/", "/api/scribs", f"/api/scribs?user_id={seeded['other']}", "/api/users",
+            "/api/users?fields=username", f"/scribs/{seeded['mine']}", f"/scribs/{seeded['theirs']}"]
+    for url in urls:
+        assert client.get(url).status_code == 200
+    return {
+        "dashboard": "fragment:dashboard:scribs_list:",
+        "scribs": "api:/api/scribs?",
+        "their scribs": f"api:/api/scribs?user_id={seeded['other']}",
+        "users": "api:/api/users?",
+        "usernames": "api:/api/users?fields=username",
+        "my scrib": f"fragment:scrib:{seeded['mine']}:author",
+        "their scrib": f"fragment:scrib:{seeded['theirs']}",
+    }
+
+
+def fresh(app, keys):
+    """names of the entries in keys the cache would still serve"""
+
+    cache = app.extensions["response_cache"]
+    return {name for name, key in keys.items() if cache.get(key) is not None}
+
+
+def test_every_page_is_cached(app, warm):
+    assert fresh(app, warm) == set(warm)
+
+
+def test_create_scrib_drops_the_listings(app, client, warm, monkeypatch):
+    monkeypatch.setattr(s3_uploader, "upload_concept_images",
+                        lambda image_urls, scrib_id: [{"url": url, "variants": []} for url in image_urls])
+
+    client.post("/create-scrib", data={"title": "New", "prompt": "a new scrib"})
+
+    assert fresh(app, warm) == {"usernames", "my scrib", "their scrib"}
+
+
+def test_delete_scrib_drops_the_listings_and_the_scrib(app, client, warm, seeded):
+    client.post(f"/scribs/delete/{seeded['mine']}")
+
+    assert fresh(app, warm) == {"usernames", "their scrib"}
+
+
+def test_profile_edit_drops_the_pages_showing_the_user(app, client, user, warm):
+    client.post(f"/users/edit/{user}", data={"username": "renamed", "email": "viewer@example.com",
+                                             "image_url": "https://example.com/me.png", "about_me": ""})
+
+    assert fresh(app, warm) == {"their scribs", "their scrib"}
+
+
+def test_delete_user_keeps_only_other_users_scribs(app, client, warm):
+    client.post("/users/delete")
+
+    assert fresh(app, warm) == {"their scrib"}
+
+
+def entry(body):
+    return {"body": body, "tags": {}}
+
+
+def test_least_recently_used_entries_are_evicted_past_max_entries():
+    backend = MemoryCacheBackend(max_entries=2, max_bytes=1024)
+    backend.set("a", entry("a"), ttl=60)
+    backend.set("b", entry("b"), ttl=60)
+    # a hit keeps "a" around
+    assert backend.get("a") is not None
+    backend.set("c", entry("c"), ttl=60)
+
+    assert list(backend.entries) == ["a", "c"]
+
+
+def test_least_recently_used_entries_are_evicted_past_max_bytes():
+    backend = MemoryCacheBackend(max_entries=100, max_bytes=10)
+    # 6 and 4 bytes in UTF-8, 3 and 2 characters
+    backend.set("a", entry("ééé"), ttl=60)
+    backend.set("b", entry("éé"), ttl=60)
+    assert backend.total_bytes == 10
+
+    backend.set("c", entry("c"), ttl=60)
+
+    assert list(backend.entries) == ["b", "c"]
+    assert backend.total_bytes == 5
+
+
+def test_entries_larger_than_max_bytes_are_not_stored():
+    backend = MemoryCacheBackend(max_entries=100, max_bytes=10)
+    backend.set("a", entry("é" * 6), ttl=60)
+
+    assert backend.size() == 0
+    assert backend.total_bytes == 0
@@ -0,0 +1,135 @@
+"""Deleting scribs and users: one DELETE the database cascades, then the concept art goes from
+the bucket on the cleanup queue in DeleteObjects batches.
+"""
+import threading
+
+import pytest
+
+from app import s3_uploader, s3_cleanup
+from models import db, User, Scrib, ConceptImage, GenerationJob
+from conftest import login, add_user, add_scrib
+
+
+class FakeS3Client:
+    """records the keys of every DeleteObjects request"""
+
+    def __init__(self):
+        self.batches = []
+
+    def delete_objects(self, Bucket, Delete):
+        self.batches.append([obj["Key"] for obj in Delete["Objects"]])
+        return {}
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    client = FakeS3Client()
+    monkeypatch.setattr(s3_uploader, "get_client", lambda: client)
+    return client
+
+
+def deleted_keys(s3_client):
+    return sorted(key for batch in s3_client.batches for key in batch)
+
+
+def add_art(user_id, *keys):
+    """scrib whose concept art is the bucket objects keys"""
+
+    scrib = add_scrib(user_id, images=0)
+    scrib.concept_images = [ConceptImage(concept_image_url=s3_uploader.public_url(key)) for key in keys]
+    db.session.commit()
+    return scrib.id
+
+
+def test_sqlite_enforces_foreign_keys(app):
+    with app.app_context():
+        assert db.session.execute("PRAGMA foreign_keys").scalar() == 1
+
+
+def test_delete_scrib_cascades_to_its_images(app, client, user, s3_client):
+    with app.app_context():
+        scrib = add_art(user, "a.png", "shared.png")
+        other = add_art(user, "b.png", "shared.png")
+    login(client, user)
+
+    client.post(f"/scribs/delete/{scrib}")
+
+    with app.app_context():
+        assert Scrib.query.get(scrib) is None
+        assert ConceptImage.query.filter_by(scrib_id=scrib).count() == 0
+        assert ConceptImage.query.filter_by(scrib_id=other).count() == 2
+    # the other scrib still shows shared.png
+    assert deleted_keys(s3_client) == ["a.png"]
+
+
+def test_delete_user_cascades_to_scribs_images_and_jobs(app, client, user, s3_client):
+    with app.app_context():
+        add_art(user, "a.png")
+        add_art(user, "b.png")
+        db.session.add(GenerationJob(title="Queued", prompt="a prompt", user_id=user))
+        other = add_user("other").id
+        theirs = add_art(other, "c.png")
+        db.session.add(GenerationJob(title="Theirs", prompt="a prompt", user_id=other))
+        db.session.commit()
+    login(client, user)
+
+    client.post("/users/delete")
+
+    with app.app_context():
+        assert User.query.get(user) is None
+        assert Scrib.query.filter_by(user_id=user).count() == 0
+        assert [image.scrib_id for image in ConceptImage.query] == [theirs]
+        assert [job.title for job in GenerationJob.query] == ["Theirs"]
+    assert deleted_keys(s3_client) == ["a.png", "b.png"]
+
+
+def test_derivatives_are_deleted_with_their_original(app, s3_client):
+    variants = '[{"url": "%s", "width": 320}]' % s3_uploader.public_url("a-320.webp")
+
+    with app.app_context():
+        s3_cleanup.delete_images([(s3_uploader.public_url("a.png"), variants),
+                                  ("https://elsewhere.example.com/b.png", None)])
+
+    assert deleted_keys(s3_client) == ["a-320.webp", "a.png"]
+
+
+def test_delete_objects_batches_hold_at_most_1000_keys(app, s3_client):
+    # S3 refuses bigger requests whatever the config says
+    app.config["S3_DELETE_BATCH_SIZE"] = 5000
+    s3_uploader.init_app(app)
+    keys = [f"{n}.png" for n in range(2500)]
+
+    deleted = s3_uploader.delete_keys(keys + keys[:10])
+
+    assert deleted == 2500
+    assert [len(batch) for batch in s3_client.batches] == [1000, 1000, 500]
+    assert deleted_keys(s3_client) == sorted(keys)
+
+
+def test_cleanup_doesnt_wait_for_the_job_workers(app, s3_client, monkeypatch):
+    # the test profile runs jobs inline, give both queues threads
+    app.config.update(JOB_QUEUE_BACKEND="thread", JOB_QUEUE_WORKERS=1)
+    job_queue = app.extensions["job_queue"]
+    job_queue.init_app(app)
+    s3_cleanup.init_app(app)
+    threads = []
+    delete_images = s3_cleanup.delete_images
+
+    def record_thread(images):
+        threads.append(threading.current_thread().name)
+        return delete_images(images)
+
+    monkeypatch.setattr(s3_cleanup, "delete_images", record_thread)
+    # the only job worker is busy generating
+    release = threading.Event()
+    busy = job_queue.enqueue(release.wait, 5)
+
+    with app.app_context():
+        s3_cleanup.enqueue([(s3_uploader.public_url("a.png"), None)])
+    s3_cleanup.queue.shutdown()
+
+    release.set()
+    busy.result(5)
+    job_queue.shutdown()
+    assert deleted_keys(s3_client) == ["a.png"]
+    assert threads[0].startswith("scribcraft-s3-cleanup-queue")
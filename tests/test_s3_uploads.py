@@ -0,0 +1,87 @@
+"""S3Uploader copies every concept image of a scrib to the bucket at once, retrying failed transfers.
+
+Runs against a local moto S3 server, images are downloaded from benchmarks/fake_openai.py.
+"""
+import time
+
+import pytest
+
+from s3_uploads import S3Uploader, S3UploadError, IMMUTABLE_CACHE_CONTROL
+from image_derivatives import DERIVATIVE_WIDTHS, DERIVATIVE_FORMATS, content_hash, original_key
+
+BUCKET = "scribcraft-test"
+
+
+@pytest.fixture
+def uploader(make_app, s3_endpoint):
+    app = make_app(S3_ENDPOINT_URL=s3_endpoint, S3_BUCKET_NAME=BUCKET)
+    uploader = S3Uploader(app)
+    uploader.get_client().create_bucket(Bucket=BUCKET)
+    yield uploader
+    for obj in uploader.iter_objects():
+        uploader.get_client().delete_object(Bucket=BUCKET, Key=obj["Key"])
+    uploader.get_client().delete_bucket(Bucket=BUCKET)
+
+
+@pytest.fixture
+def image_urls(fake_openai):
+    host, port = fake_openai.server.server_address
+    return [f"http://{host}:{port}/images/{n}.png" for n in range(3)]
+
+
+def test_uploads_every_image_with_its_derivatives(uploader, image_urls, fake_openai):
+    uploaded = uploader.upload_concept_images(image_urls, scrib_id=1)
+
+    client = uploader.get_client()
+    for image, data in zip(uploaded, fake_openai.images):
+        key = original_key(content_hash(data))
+        assert image["url"] == f"{uploader.endpoint_url}/{BUCKET}/{key}"
+        obj = client.get_object(Bucket=BUCKET, Key=key)
+        assert obj["Body"].read() == data
+        assert obj["CacheControl"] == IMMUTABLE_CACHE_CONTROL
+        assert len(image["variants"]) == len(DERIVATIVE_WIDTHS) * len(DERIVATIVE_FORMATS)
+        for variant in image["variants"]:
+            assert uploader.key_for_url(variant["url"]) in {obj["Key"] for obj in uploader.iter_objects()}
+
+
+def test_images_transfer_concurrently(uploader, image_urls, monkeypatch):
+    download = uploader._download
+
+    def slow_download(url, remaining):
+        time.sleep(0.5)
+        return download(url, remaining)
+
+    monkeypatch.setattr(uploader, "_download", slow_download)
+    # resizing is cpu bound, leave it out of the timing
+    uploader.make_derivatives = False
+    started = time.monotonic()
+    uploader.upload_concept_images(image_urls, scrib_id=1)
+
+    # serial downloads alone would take 1.5s
+    assert time.monotonic() - started < 1.0
+
+
+def test_failed_puts_are_retried(uploader, image_urls, monkeypatch):
+    monkeypatch.setattr("s3_uploads.random.uniform", lambda low, high: 0)
+    put = uploader._put
+    failed = []
+
+    def flaky_put(key, data, content_type, **extra):
+        if key not in failed:
+            failed.append(key)
+            raise ConnectionError("connection reset")
+        return put(key, data, content_type, **extra)
+
+    monkeypatch.setattr(uploader, "_put", flaky_put)
+    uploaded = uploader.upload_concept_images(image_urls[:1], scrib_id=1)
+
+    assert uploader.key_for_url(uploaded[0]["url"]) in failed
+    assert len(list(uploader.iter_objects())) == len(failed)
+
+
+def test_raises_when_an_image_cannot_be_downloaded(uploader, image_urls, fake_openai, monkeypatch):
+    monkeypatch.setattr("s3_uploads.random.uniform", lambda low, high: 0)
+    host, port = fake_openai.server.server_address
+
+    with pytest.raises(S3UploadError):
+        uploader.upload_concept_images(image_urls[:1] + [f"http://{host}:{port}/images/missing.png"], scrib_id=1)
@@ -0,0 +1,92 @@
+"""Full-text search over scribs (SQLite FTS5 here), its ILIKE fallback and the username typeahead."""
+import pytest
+
+from models import db, Scrib
+from search import search_scribs_query
+from conftest import login, add_user, add_scrib
+
+
+@pytest.fixture
+def scribs(app, user):
+    """ids of the seeded scribs by name"""
+
+    with app.app_context():
+        return {
+            "title": add_scrib(user, title="Dragon of the north", prompt="ice", scrib_text="snow").id,
+            "prompt": add_scrib(user, title="Winter", prompt="a dragon sleeps", scrib_text="snow").id,
+            "text": add_scrib(user, title="Harbor", prompt="ships", scrib_text="the dragons return").id,
+            "other": add_scrib(user, title="Cats", prompt="cats", scrib_text="cats everywhere").id,
+        }
+
+
+def search(client, q, **params):
+    response = client.get("/api/scribs/search", query_string={"q": q, **params})
+    assert response.status_code == 200
+    body = response.get_json()
+    return [scrib["id"] for scrib in body["scribs"]], body["next_offset"]
+
+
+def test_matches_title_prompt_and_text_best_first(client, user, scribs):
+    login(client, user)
+
+    ids, next_offset = search(client, "dragon")
+
+    # title matches weigh the most, then the prompt, then the text
+    assert ids == [scribs["title"], scribs["prompt"], scribs["text"]]
+    assert next_offset is None
+
+
+def test_every_term_must_match_and_the_last_one_is_a_prefix(client, user, scribs):
+    login(client, user)
+
+    assert search(client, "dragon nor")[0] == [scribs["title"]]
+    assert search(client, "dragon cats")[0] == []
+
+
+def test_pages_through_results(client, user, scribs):
+    login(client, user)
+
+    first, next_offset = search(client, "dragon", limit=2)
+    second, last_offset = search(client, "dragon", limit=2, offset=next_offset)
+
+    assert first + second == [scribs["title"], scribs["prompt"], scribs["text"]]
+    assert last_offset is None
+
+
+def test_query_syntax_is_not_passed_to_the_index(client, user, scribs):
+    login(client, user)
+
+    assert search(client, '"dragon" OR cats*')[0] == []
+    assert search(client, "*-")[0] == []
+
+
+def test_index_follows_updates_and_deletes(app, client, user, scribs):
+    login(client, user)
+    with app.app_context():
+        Scrib.query.get(scribs["other"]).title = "Cats and a dragon"
+        db.session.delete(Scrib.query.get(scribs["text"]))
+        db.session.commit()
+
+    assert search(client, "dragon")[0] == [scribs["title"], scribs["other"], scribs["prompt"]]
+
+
+def test_other_databases_fall_back_to_ilike(app, scribs, monkeypatch):
+    with app.app_context():
+        monkeypatch.setattr(db.engine.dialect, "name", "mysql")
+
+        assert [scrib.id for scrib in search_scribs_query("DRAGON")] == [
+            scribs["text"], scribs["prompt"], scribs["title"]]
+        assert [scrib.id for scrib in search_scribs_query("dragon nor")] == [scribs["title"]]
+        # "_" is a word character, not a wildcard
+        assert search_scribs_query("dr_gon").all() == []
+
+
+def test_username_prefix_ignores_case(app, client, user):
+    login(client, user)
+    with app.app_context():
+        for username in ["Alice", "alfred", "bob"]:
+            add_user(username)
+
+    response = client.get("/api/users/search", query_string={"prefix": "AL"})
+
+    assert [found["username"] for found in response.get_json()["users"]] == ["alfred", "Alice"]
@@ -0,0 +1,103 @@
+"""The logged in user comes from a snapshot cache, routes changing the user must drop it."""
+from collections import OrderedDict
+
+import pytest
+
+from app import user_cache
+from models import db, User
+from user_cache import UserCache, CachedUser
+from conftest import login, add_user
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    """user_cache lives as long as the process, user ids start over with every test's database"""
+
+    monkeypatch.setattr(user_cache, "entries", OrderedDict())
+
+
+def cached(user_id):
+    entry = user_cache.entries.get(user_id)
+    return entry[0] if entry is not None else None
+
+
+def test_requests_reuse_the_snapshot(app, client, user):
+    login(client, user)
+    client.get("/")
+    with app.app_context():
+        User.query.get(user).username = "changed"
+        db.session.commit()
+
+    client.get("/")
+
+    # changed behind the routes' back: still the snapshot
+    assert cached(user).username == "viewer"
+
+
+def test_profile_edit_drops_the_snapshot(app, client, user):
+    login(client, user)
+    client.get("/")
+
+    client.post(f"/users/edit/{user}", data={"username": "renamed", "email": "renamed@example.com",
+                                             "image_url": "https://example.com/me.png", "about_me": "hi"})
+
+    assert cached(user) is None
+    client.get("/")
+    assert cached(user)[1:5] == ("renamed", "renamed@example.com", "https://example.com/me.png", "hi")
+
+
+def test_deleted_users_are_logged_out_everywhere(app, client, user):
+    # another browser still holds a session for the user
+    other_browser = app.test_client()
+    login(other_browser, user)
+    login(client, user)
+    other_browser.get("/")
+
+    client.post("/users/delete")
+
+    assert cached(user) is None
+    response = other_browser.get(f"/users/edit/{user}")
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/login")
+
+
+def test_missing_users_are_not_cached(app):
+    cache = UserCache(app)
+
+    assert cache.get(1, lambda user_id: None) is None
+    assert cache.entries == {}
+
+
+def snapshot(user_id):
+    return CachedUser(id=user_id, username=f"user{user_id}", email=None, image_url=None,
+                      about_me=None, date_time=None)
+
+
+def test_least_recently_used_snapshots_are_evicted(app):
+    app.config["USER_CACHE_SIZE"] = 2
+    cache = UserCache(app)
+    cache.put(snapshot(1))
+    cache.put(snapshot(2))
+
+    cache.get(1, snapshot)
+    cache.put(snapshot(3))
+
+    assert list(cache.entries) == [1, 3]
+
+
+def test_snapshots_expire(app, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("user_cache.time.monotonic", lambda: now[0])
+    cache = UserCache(app)
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return snapshot(user_id)
+
+    cache.get(1, load)
+    cache.get(1, load)
+    now[0] += app.config["USER_CACHE_TTL"]
+    cache.get(1, load)
+
+    assert loads == [1, 1]
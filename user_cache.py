@@ -0,0 +1,89 @@
+"""In-process LRU/TTL cache of the logged in user's identity.
+
+add_user_to_g used to load the User row on every request. Instead we keep a small immutable
+snapshot of the fields templates and views read off g.user, keyed by user id. Routes that
+change or delete a user must call invalidate(); the TTL bounds how long other worker
+processes can serve a stale snapshot.
+"""
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from metrics import counter
+
+CachedUser = namedtuple(
+    "CachedUser", ["id", "username", "email", "image_url", "about_me", "date_time"])
+
+user_cache_lookups_total = counter(
+    "scribcraft_user_cache_lookups_total", "Logged in user cache lookups", ["outcome"])
+
+
+def snapshot_user(user):
+    """Build the cached, detached snapshot of a User row"""
+
+    return CachedUser(id=user.id, username=user.username, email=user.email, image_url=user.image_url,
+                      about_me=user.about_me, date_time=user.date_time)
+
+
+class UserCache:
+    """Small extension configured from app.config['USER_CACHE_*']"""
+
+    def __init__(self, app=None):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("USER_CACHE_SIZE", 1024)
+        app.config.setdefault("USER_CACHE_TTL", 60)
+
+        self.max_size = app.config["USER_CACHE_SIZE"]
+        self.ttl = app.config["USER_CACHE_TTL"]
+        app.extensions["user_cache"] = self
+
+    def get(self, user_id, load_user):
+        """Returns the snapshot for user_id, calling load_user(user_id) on a miss.
+        Returns None (and caches nothing) if load_user finds no user.
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(user_id)
+                user_cache_lookups_total.inc(outcome="hit")
+                return entry[0]
+        user_cache_lookups_total.inc(outcome="miss")
+
+        user = load_user(user_id)
+        if user is None:
+            return None
+
+        cached_user = snapshot_user(user)
+        self.put(cached_user)
+        return cached_user
+
+    def put(self, cached_user):
+        with self.lock:
+            self.entries[cached_user.id] = (
+                cached_user, time.monotonic() + self.ttl)
+            self.entries.move_to_end(cached_user.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        """hit/miss counters, the same values /metrics exports"""
+
+        hits = user_cache_lookups_total.get(outcome="hit")
+        misses = user_cache_lookups_total.get(outcome="miss")
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "size": len(self.entries)
+        }